@@ -0,0 +1,168 @@
+import math
+import numbers
+
+from threading import RLock
+
+
+# Two-sided 95% critical values of the Student's t distribution, by degrees of
+# freedom
+_T_95 = [12.706, 4.303, 3.182, 2.776, 2.571, 2.447, 2.365, 2.306, 2.262, 2.228,
+         2.201, 2.179, 2.160, 2.145, 2.131, 2.120, 2.110, 2.101, 2.093, 2.086,
+         2.080, 2.074, 2.069, 2.064, 2.060, 2.056, 2.052, 2.048, 2.045, 2.042]
+
+
+def t_critical(df):
+    """Return the two-sided 95% critical value of the Student's t distribution.
+
+    Args:
+      df (int): The degrees of freedom.
+
+    Returns:
+      float: the critical value.
+    """
+
+    if df < 1:
+        raise ValueError("At least one degree of freedom is needed")
+    if df <= len(_T_95):
+        return _T_95[df - 1]
+    if df <= 60:
+        return 2.000
+    if df <= 120:
+        return 1.980
+    return 1.960
+
+
+def median(values):
+    """Return the median of the given values.
+
+    Args:
+      values (list of float): The values.
+
+    Returns:
+      float: the median, or None if there are no values.
+    """
+
+    if not values:
+        return None
+    values = sorted(values)
+    mid = len(values) // 2
+    if len(values) % 2:
+        return values[mid]
+    return (values[mid - 1] + values[mid]) / 2.0
+
+
+class RunningStats(object):
+    """This class keeps the count, mean, variance, minimum and maximum of the
+    values of the repetitions of a combination, updated online, and the values
+    themselves for their median, as there are few repetitions."""
+
+    def __init__(self):
+        self.n = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = None
+        self.max = None
+        self.values = []
+
+    def add(self, x):
+        """Add a value.
+
+        Args:
+          x (float): The value.
+        """
+
+        # Welford's algorithm
+        self.n += 1
+        delta = x - self.mean
+        self.mean += delta / self.n
+        self.m2 += delta * (x - self.mean)
+
+        if self.min is None or x < self.min:
+            self.min = x
+        if self.max is None or x > self.max:
+            self.max = x
+        self.values.append(x)
+
+    def get_variance(self):
+        """Return the sample variance, or None with less than two values."""
+
+        if self.n < 2:
+            return None
+        return self.m2 / (self.n - 1)
+
+    def get_ci_width(self):
+        """Return the width of the 95% confidence interval of the mean, or
+        None with less than two values."""
+
+        variance = self.get_variance()
+        if variance is None:
+            return None
+        return 2 * t_critical(self.n - 1) * math.sqrt(variance / self.n)
+
+    def get_summary(self):
+        """Return the statistics of the values.
+
+        Returns:
+          dict: the n, mean, variance, min, max and median of the values.
+        """
+
+        return {"n": self.n,
+                "mean": self.mean if self.n else None,
+                "variance": self.get_variance(),
+                "min": self.min,
+                "max": self.max,
+                "median": median(self.values)}
+
+
+class OnlineAggregator(object):
+    """This class aggregates the metrics of the repetitions of each
+    combination as they are added. Non-numeric metrics are ignored. It is
+    thread-safe."""
+
+    def __init__(self):
+        self.__lock = RLock()
+        self.stats = {}
+
+    def add(self, comb_id, metrics):
+        """Add the metrics of a repetition of a combination.
+
+        Args:
+          comb_id (int): The experiment combination identifier.
+          metrics (dict): The value of each metric.
+
+        Returns:
+          dict: the up-to-date summary of each metric of the combination.
+        """
+
+        with self.__lock:
+            comb_stats = self.stats.setdefault(comb_id, {})
+            for (metric, value) in metrics.items():
+                if isinstance(value, bool) or \
+                        not isinstance(value, numbers.Real):
+                    continue
+                comb_stats.setdefault(metric, RunningStats()).add(value)
+            return self.get_summary(comb_id)
+
+    def get_summary(self, comb_id):
+        """Return the summary of each metric of the given combination.
+
+        Args:
+          comb_id (int): The experiment combination identifier.
+
+        Returns:
+          dict: the statistics of each metric.
+        """
+
+        with self.__lock:
+            return dict((metric, rs.get_summary()) for (metric, rs)
+                        in self.stats.get(comb_id, {}).items())
+
+    def discard(self, comb_id):
+        """Forget the statistics of the given combination.
+
+        Args:
+          comb_id (int): The experiment combination identifier.
+        """
+
+        with self.__lock:
+            self.stats.pop(comb_id, None)
@@ -0,0 +1,135 @@
+import os
+
+from threading import RLock
+
+from execo.action import Remote
+from execo_engine import logger
+
+from div_p2p.ds_cache import file_hash
+
+
+class ArtifactCache(object):
+    """This class checks which hosts already have the artifacts needed by the
+    experiments, so that identical transfers and redeployments are skipped.
+    Files are compared by the hash of their content. Deployed environments are
+    identified by a marker written in the hosts after each deployment. It is
+    thread-safe."""
+
+    env_marker = "/var/lib/div_p2p/env"
+
+    def __init__(self, check_timeout=30):
+        """Create an ArtifactCache.
+
+        Args:
+          check_timeout (int, optional): Number of seconds to wait for the
+            checks in the hosts (default: 30).
+        """
+
+        self.__lock = RLock()
+        self.check_timeout = check_timeout
+
+        self.stats = {}
+
+    def _check(self, hosts, cmd, connection_params=None):
+        check = Remote(cmd, hosts, connection_params=connection_params)
+        for p in check.processes:
+            p.nolog_exit_code = True
+            p.nolog_error = True
+            p.nolog_timeout = True
+            p.timeout = self.check_timeout
+        check.run()
+
+        ok = set(p.host.address for p in check.processes if p.ok)
+        return [h for h in hosts if h.address in ok]
+
+    def hosts_with_file(self, hosts, local_path, remote_path):
+        """Return the hosts in which the given remote file has the same content
+        as the local one.
+
+        Args:
+          hosts (list of Host): The hosts.
+          local_path (str): The local path of the file.
+          remote_path (str): The remote path of the file.
+
+        Returns:
+          list of Host: the hosts with an identical file.
+        """
+
+        cmd = ("echo '" + file_hash(local_path) + "  " + remote_path + "' | "
+               "sha1sum -c --status")
+        return self._check(hosts, cmd)
+
+    def hosts_with_env(self, hosts, env_id):
+        """Return the hosts which still run the given environment.
+
+        Args:
+          hosts (list of Host): The hosts.
+          env_id (str): The identifier of the environment.
+
+        Returns:
+          list of Host: the hosts already deployed with the environment.
+        """
+
+        cmd = "grep -qxF '" + env_id + "' " + self.env_marker
+        return self._check(hosts, cmd, {"user": "root"})
+
+    def mark_env(self, hosts, env_id):
+        """Write the marker of the given environment in the hosts.
+
+        Args:
+          hosts (list of Host): The hosts just deployed.
+          env_id (str): The identifier of the environment.
+        """
+
+        mark = Remote("mkdir -p " + os.path.dirname(self.env_marker) + " && "
+                      "echo '" + env_id + "' > " + self.env_marker,
+                      hosts, connection_params={"user": "root"})
+        mark.run()
+
+    def record(self, artifact, skipped, done, duration):
+        """Record the result of the setup of an artifact in some hosts.
+
+        Args:
+          artifact (str): The name of the artifact, e.g., jar or env.
+          skipped (int): The number of hosts where it was already present.
+          done (int): The number of hosts where it was transferred or deployed.
+          duration (float): The time spent transferring or deploying it.
+        """
+
+        with self.__lock:
+            stats = self.stats.setdefault(artifact, {"skipped": 0, "done": 0,
+                                                     "runs": 0, "time": 0.0})
+            stats["skipped"] += skipped
+            stats["done"] += done
+            if done:
+                stats["runs"] += 1
+                stats["time"] += duration
+
+    def get_time_saved(self, artifact):
+        """Return an estimation of the setup time saved in the hosts for the
+        given artifact, i.e., its mean setup time per host, as transfers and
+        deployments are shared by several hosts, for each host where it was
+        skipped, or None if it is unknown.
+
+        Args:
+          artifact (str): The name of the artifact.
+        """
+
+        with self.__lock:
+            stats = self.stats.get(artifact)
+            if not stats or not stats["done"]:
+                return None
+            return stats["skipped"] * stats["time"] / stats["done"]
+
+    def log_stats(self):
+        """Log the transfers and deployments skipped."""
+
+        with self.__lock:
+            for (artifact, stats) in sorted(self.stats.items()):
+                line = ("Artifact " + artifact + ": skipped in " +
+                        str(stats["skipped"]) + " hosts, set up in " +
+                        str(stats["done"]) + " hosts in %.1fs" % stats["time"])
+                saved = self.get_time_saved(artifact)
+                if saved:
+                    line += ", about %.1fs saved" % saved
+                logger.info(line)
@@ -0,0 +1,146 @@
+import hashlib
+import os
+
+from threading import RLock
+
+from execo.config import default_connection_params
+from execo.process import Process
+from execo_engine import logger
+
+
+# Exit code of ssh when the connection could not be established
+SSH_CONNECTION_ERROR = 255
+
+
+class SshConnection(object):
+    """This class holds a multiplexed SSH connection to a host. The first
+    session opened with its connection parameters becomes a master which is
+    kept alive in background, and the following ssh, scp and taktuk sessions
+    reuse it instead of connecting and authenticating again. A dropped master
+    is replaced by the next session after reconnect() is called."""
+
+    def __init__(self, host, control_dir="/tmp", persist=600):
+        """Create the connection to a host. The master is started lazily.
+
+        Args:
+          host (Host): The host.
+          control_dir (str, optional): The local directory of the control
+            socket (default: /tmp).
+          persist (int, optional): Number of seconds the master is kept alive
+            once idle (default: 600).
+        """
+
+        self.host = host
+        key = "%s@%s:%s" % (host.user, host.address, host.port)
+        self.control_path = os.path.join(
+            control_dir,
+            "div_p2p-ssh-" + hashlib.sha1(key.encode()).hexdigest()[:12])
+
+        mux_options = ("-o", "ControlMaster=auto",
+                       "-o", "ControlPath=" + self.control_path,
+                       "-o", "ControlPersist=" + str(persist))
+        self.connection_params = {
+            "ssh_options": (tuple(default_connection_params["ssh_options"]) +
+                            mux_options),
+            "scp_options": (tuple(default_connection_params["scp_options"]) +
+                            mux_options),
+            "taktuk_connector_options":
+                (tuple(default_connection_params["taktuk_connector_options"]) +
+                 mux_options)
+        }
+
+        self.reconnections = 0
+
+    def _control(self, cmd):
+        control = Process(default_connection_params["ssh"] + " -O " + cmd +
+                          " -o ControlPath=" + self.control_path + " " +
+                          self.host.address)
+        control.nolog_exit_code = True
+        control.nolog_error = True
+        control.run(timeout=10)
+        return control.ok
+
+    def is_alive(self):
+        """Return whether the master is running."""
+
+        return self._control("check")
+
+    def reconnect(self):
+        """Discard the master if it is not responding, so that the next
+        session starts a new one."""
+
+        if not os.path.exists(self.control_path) or self.is_alive():
+            return
+        logger.warn("SSH connection to " + str(self.host.address) +
+                    " dropped, reconnecting")
+        self.reconnections += 1
+        self._control("exit")
+        if os.path.exists(self.control_path):
+            os.remove(self.control_path)
+
+    def close(self):
+        """Stop the master."""
+
+        if os.path.exists(self.control_path):
+            self._control("exit")
+
+
+_connections = {}
+_connections_lock = RLock()
+_enabled = True
+
+
+def set_multiplexing(enabled):
+    """Enable or disable the reuse of SSH connections.
+
+    Args:
+      enabled (bool): Whether connections are multiplexed.
+    """
+
+    global _enabled
+    _enabled = enabled
+
+
+def get_connection(host):
+    """Return the shared connection to the given host.
+
+    Args:
+      host (Host): The host.
+
+    Returns:
+      SshConnection: the connection or None if multiplexing is disabled.
+    """
+
+    if not _enabled:
+        return None
+    key = (host.user, host.address, host.port)
+    with _connections_lock:
+        if key not in _connections:
+            _connections[key] = SshConnection(host)
+        return _connections[key]
+
+
+def get_connection_params(host):
+    """Return the connection parameters to reach the given host through its
+    shared connection.
+
+    Args:
+      host (Host): The host.
+
+    Returns:
+      dict: the connection parameters or None if multiplexing is disabled.
+    """
+
+    connection = get_connection(host)
+    if connection is None:
+        return None
+    return connection.connection_params
+
+
+def close_connections():
+    """Stop all the shared connections."""
+
+    with _connections_lock:
+        for connection in _connections.values():
+            connection.close()
+        _connections.clear()
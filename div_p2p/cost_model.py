@@ -0,0 +1,94 @@
+import math
+
+from threading import RLock
+
+
+def _to_number(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+class RuntimeModel(object):
+    """This class predicts the runtime of a repetition of a combination from
+    the runtimes observed so far. The logarithm of the runtime is modeled as
+    the sum of the effects of the values of the parameters, each effect being
+    the mean deviation of the runs with that value from the global mean. The
+    effect of an unseen numeric value is interpolated from the closest seen
+    values. It is thread-safe."""
+
+    def __init__(self):
+        self.__lock = RLock()
+        self.n = 0
+        self.log_sum = 0.0
+        # Sum and count of the log runtimes, by parameter and value
+        self.values = {}
+
+    def add(self, comb, run_time):
+        """Add an observed runtime.
+
+        Args:
+          comb (dict): The combination.
+          run_time (float): The mean runtime of its repetitions, in seconds.
+        """
+
+        if run_time is None or run_time <= 0:
+            return
+        log_time = math.log(run_time)
+        with self.__lock:
+            self.n += 1
+            self.log_sum += log_time
+            for (pn, pv) in comb.items():
+                stats = self.values.setdefault(pn, {}).setdefault(pv, [0.0, 0])
+                stats[0] += log_time
+                stats[1] += 1
+
+    def get_num_samples(self):
+        """Return the number of runtimes observed."""
+
+        return self.n
+
+    def _get_effect(self, pn, pv, mean):
+        param_values = self.values.get(pn)
+        if not param_values:
+            return 0.0
+        if pv in param_values:
+            (log_sum, n) = param_values[pv]
+            return log_sum / n - mean
+
+        # Interpolate between the closest numeric values
+        x = _to_number(pv)
+        if x is None:
+            return 0.0
+        points = sorted((_to_number(v), s[0] / s[1] - mean)
+                        for (v, s) in param_values.items()
+                        if _to_number(v) is not None)
+        if not points:
+            return 0.0
+        if x <= points[0][0]:
+            return points[0][1]
+        if x >= points[-1][0]:
+            return points[-1][1]
+        for ((x0, e0), (x1, e1)) in zip(points, points[1:]):
+            if x0 <= x <= x1:
+                return e0 + (e1 - e0) * (x - x0) / (x1 - x0)
+        return 0.0
+
+    def predict(self, comb):
+        """Return the predicted runtime of a repetition of a combination.
+
+        Args:
+          comb (dict): The combination.
+
+        Returns:
+          float: the runtime in seconds or None if no runtime was observed.
+        """
+
+        with self.__lock:
+            if not self.n:
+                return None
+            mean = self.log_sum / self.n
+            log_time = mean + sum(self._get_effect(pn, pv, mean)
+                                  for (pn, pv) in comb.items())
+            return math.exp(log_time)
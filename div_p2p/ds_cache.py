@@ -0,0 +1,399 @@
+import hashlib
+import os
+import time
+
+from threading import Condition, RLock, Thread
+
+from execo.action import TaktukPut
+from execo.process import SshProcess
+from execo_engine import logger
+
+from div_p2p.connection import get_connection_params
+
+
+class DatasetCacheException(Exception):
+    pass
+
+
+_hashes = {}
+_hashes_lock = RLock()
+
+
+def file_hash(path):
+    """Return the SHA-1 of the content of the given local file. Hashes are
+    memoized as long as the size and modification time of the file do not
+    change.
+
+    Args:
+      path (str): The path of the file.
+
+    Returns:
+      str: the hexadecimal digest.
+    """
+
+    st = os.stat(path)
+    key = (os.path.abspath(path), st.st_size, st.st_mtime)
+    with _hashes_lock:
+        if key in _hashes:
+            return _hashes[key]
+
+    sha = hashlib.sha1()
+    f = open(path, "rb")
+    block = f.read(1 << 20)
+    while block:
+        sha.update(block)
+        block = f.read(1 << 20)
+    f.close()
+
+    with _hashes_lock:
+        _hashes[key] = sha.hexdigest()
+    return _hashes[key]
+
+
+def parse_size(size):
+    """Parse a size with an optional K, M, G or T suffix.
+
+    Args:
+      size (str): The size.
+
+    Returns:
+      int: the size in bytes.
+    """
+
+    size = size.strip().upper()
+    units = {"K": 1 << 10, "M": 1 << 20, "G": 1 << 30, "T": 1 << 40}
+    if size and size[-1] in units:
+        return int(float(size[:-1]) * units[size[-1]])
+    return int(size)
+
+
+class DatasetCache(object):
+    """This class keeps the record of the datasets stored in a host, indexed by
+    the hash of their content. The record is also stored in the host so that it
+    survives the engine. It is thread-safe."""
+
+    index_name = "index"
+
+    def __init__(self, host, cache_dir, budget=None):
+        """Create the DatasetCache of a host.
+
+        Args:
+          host (Host): The host.
+          cache_dir (str): The remote directory where datasets are stored.
+          budget (int, optional): The maximum number of bytes used by the
+            datasets in the host (default: no limit).
+        """
+
+        self.__lock = RLock()
+        self.__cond = Condition(self.__lock)
+        self.host = host
+        self.cache_dir = cache_dir
+        self.budget = budget
+        self.connection_params = get_connection_params(host)
+
+        self.entries = None
+        self.in_use = {}
+        # Size of the datasets being transferred, reserved in the budget
+        self.transferring = {}
+        self.prefetched = {}
+        self.cancelled = set()
+
+        self.hits = 0
+        self.misses = 0
+        self.prefetches = 0
+        self.evictions = 0
+        self.bytes_transferred = 0
+        self.time_hidden = 0
+        self.time_exposed = 0
+
+    def _load(self):
+        index_path = os.path.join(self.cache_dir, self.index_name)
+        load = SshProcess("mkdir -p " + self.cache_dir + "; "
+                          "cat " + index_path + " 2>/dev/null; "
+                          "echo; echo __FILES__; "
+                          "find " + self.cache_dir + " -mindepth 2 -maxdepth 2 "
+                          "-type f",
+                          self.host, connection_params=self.connection_params)
+        load.nolog_exit_code = load.nolog_error = True
+        load.run()
+
+        self.entries = {}
+        if not load.ok or "__FILES__" not in load.stdout:
+            logger.warn("Host " + str(self.host.address) + ": could not load "
+                        "the dataset cache index, starting with an empty one")
+            return
+
+        (index, files) = load.stdout.split("__FILES__", 1)
+        present = set(f.strip() for f in files.splitlines() if f.strip())
+
+        for line in index.splitlines():
+            fields = line.split(" ", 3)
+            if len(fields) != 4:
+                continue
+            (ds_hash, size, last_used, name) = fields
+            if os.path.join(self.cache_dir, ds_hash, name) in present:
+                self.entries[ds_hash] = {"name": name,
+                                         "size": int(size),
+                                         "last_used": float(last_used)}
+
+        logger.info("Host " + str(self.host.address) + ": " +
+                    str(len(self.entries)) + " datasets already in cache")
+
+    def _save(self):
+        lines = ["%s %i %f %s" % (h, e["size"], e["last_used"], e["name"])
+                 for (h, e) in self.entries.items()]
+        content = "\n".join(lines).replace("'", "'\\''")
+        index_path = os.path.join(self.cache_dir, self.index_name)
+        save = SshProcess("printf '%s\\n' '" + content + "' > " + index_path,
+                          self.host, connection_params=self.connection_params)
+        save.run()
+
+    def get_used_bytes(self):
+        """Return the number of bytes used by the datasets in the host."""
+
+        with self.__lock:
+            if self.entries is None:
+                return 0
+            return sum(e["size"] for e in self.entries.values())
+
+    def _evict(self, needed):
+        if self.budget is None:
+            return
+
+        used = self.get_used_bytes() + sum(self.transferring.values())
+        while used + needed > self.budget:
+            candidates = [(e["last_used"], h) for (h, e) in self.entries.items()
+                          if not self.in_use.get(h)]
+            if not candidates:
+                logger.warn("Host " + str(self.host.address) + ": dataset "
+                            "cache budget exceeded but all datasets are in use")
+                return
+
+            (_, ds_hash) = min(candidates)
+            remove = SshProcess("rm -rf " +
+                                os.path.join(self.cache_dir, ds_hash),
+                                self.host,
+                                connection_params=self.connection_params)
+            remove.run()
+
+            used -= self.entries[ds_hash]["size"]
+            del self.entries[ds_hash]
+            self.evictions += 1
+            logger.info("Host " + str(self.host.address) + ": evicted dataset "
+                        + ds_hash)
+
+    def _transfer(self, local_path, ds_hash):
+        """Transfer the given dataset if it is neither present nor being
+        transferred. Must be called with the lock held.
+
+        Returns:
+          float: the duration of the transfer or None if it was not needed.
+        """
+
+        while ds_hash in self.transferring:
+            self.__cond.wait()
+        if ds_hash in self.entries:
+            return None
+
+        name = os.path.basename(local_path)
+        remote_dir = os.path.join(self.cache_dir, ds_hash)
+        size = os.path.getsize(local_path)
+        self._evict(size)
+        self.transferring[ds_hash] = size
+
+        # Transfer without holding the lock
+        start = time.time()
+        self.__lock.release()
+        try:
+            mkdir = SshProcess("mkdir -p " + remote_dir, self.host,
+                               connection_params=self.connection_params)
+            mkdir.run()
+            copy_ds = TaktukPut([self.host], [local_path],
+                                os.path.join(remote_dir, name),
+                                connection_params=self.connection_params)
+            copy_ds.run()
+        finally:
+            self.__lock.acquire()
+            self.transferring.pop(ds_hash, None)
+            self.__cond.notify_all()
+
+        if not copy_ds.ok:
+            raise DatasetCacheException("Could not copy dataset " +
+                                        local_path + " to " +
+                                        str(self.host.address))
+
+        self.bytes_transferred += size
+        self.entries[ds_hash] = {"name": name, "size": size,
+                                 "last_used": time.time()}
+        self._save()
+        return time.time() - start
+
+    def acquire(self, local_path):
+        """Make the given dataset available in the host, transferring it only if
+        it is not already there. The dataset is not evicted until it is
+        released.
+
+        Args:
+          local_path (str): The local path of the dataset.
+
+        Returns:
+          str: the remote path of the dataset.
+        """
+
+        ds_hash = file_hash(local_path)
+        start = time.time()
+
+        with self.__lock:
+            if self.entries is None:
+                self._load()
+
+            # A prefetch being cancelled is used anyway
+            self.cancelled.discard(ds_hash)
+            while ds_hash in self.prefetched and \
+                    self.prefetched[ds_hash] is None:
+                self.__cond.wait()
+            duration = self._transfer(local_path, ds_hash)
+            wait = time.time() - start
+
+            if ds_hash in self.prefetched:
+                # Transferred in background, part of it may have been waited
+                prefetch_duration = self.prefetched.pop(ds_hash)
+                self.prefetches += 1
+                self.time_exposed += wait
+                self.time_hidden += max(prefetch_duration - wait, 0)
+                # The prefetch already pinned the dataset
+                self.in_use[ds_hash] -= 1
+                logger.info("Host " + str(self.host.address) + ": dataset " +
+                            os.path.basename(local_path) + " prefetched")
+            elif duration is None:
+                self.hits += 1
+                logger.info("Host " + str(self.host.address) + ": dataset " +
+                            os.path.basename(local_path) + " found in cache")
+            else:
+                self.misses += 1
+                self.time_exposed += duration
+
+            self.entries[ds_hash]["last_used"] = time.time()
+            self.in_use[ds_hash] = self.in_use.get(ds_hash, 0) + 1
+            self._save()
+
+            return os.path.join(self.cache_dir, ds_hash,
+                                self.entries[ds_hash]["name"])
+
+    def prefetch(self, local_path):
+        """Start the transfer of the given dataset in background, if it is
+        neither present nor being transferred. The dataset is kept pinned
+        until it is acquired or the prefetch is cancelled.
+
+        Args:
+          local_path (str): The local path of the dataset.
+
+        Returns:
+          bool: whether a prefetch was started.
+        """
+
+        ds_hash = file_hash(local_path)
+        with self.__lock:
+            if self.entries is None:
+                self._load()
+            if (ds_hash in self.entries or ds_hash in self.transferring or
+                    ds_hash in self.prefetched):
+                return False
+            # Pending until the transfer finishes
+            self.prefetched[ds_hash] = None
+
+        def do_prefetch():
+            with self.__lock:
+                try:
+                    duration = self._transfer(local_path, ds_hash)
+                    if ds_hash in self.cancelled:
+                        # Nobody waits for it any more
+                        self.cancelled.discard(ds_hash)
+                        del self.prefetched[ds_hash]
+                    else:
+                        self.prefetched[ds_hash] = duration or 0
+                        self.in_use[ds_hash] = self.in_use.get(ds_hash, 0) + 1
+                except Exception as e:
+                    self.cancelled.discard(ds_hash)
+                    logger.warn("Host " + str(self.host.address) +
+                                ": prefetch of " + local_path + " failed: " +
+                                str(e))
+                    del self.prefetched[ds_hash]
+                finally:
+                    self.__cond.notify_all()
+
+        logger.info("Host " + str(self.host.address) + ": prefetching " +
+                    os.path.basename(local_path))
+        t = Thread(target=do_prefetch)
+        t.daemon = True
+        t.start()
+        return True
+
+    def cancel_prefetch(self, local_path):
+        """Cancel the prefetch of the given dataset, e.g., because its group
+        was taken by another host, so that it is unpinned without being
+        acquired. A pending transfer is completed but the dataset is not
+        pinned.
+
+        Args:
+          local_path (str): The local path of the dataset.
+        """
+
+        ds_hash = file_hash(local_path)
+        with self.__lock:
+            if ds_hash not in self.prefetched:
+                return
+            if self.prefetched[ds_hash] is None:
+                self.cancelled.add(ds_hash)
+            else:
+                del self.prefetched[ds_hash]
+                if self.in_use.get(ds_hash):
+                    self.in_use[ds_hash] -= 1
+
+    def register(self, local_path, ds_hash=None):
+        """Register a dataset transferred to the host by other means, e.g., a
+        broadcast to all the hosts.
+
+        Args:
+          local_path (str): The local path of the dataset.
+          ds_hash (str, optional): The hash of the dataset (default: computed
+            from the local file).
+        """
+
+        if ds_hash is None:
+            ds_hash = file_hash(local_path)
+        size = os.path.getsize(local_path)
+        with self.__lock:
+            if self.entries is None:
+                self._load()
+            if ds_hash not in self.entries:
+                self._evict(size)
+                self.entries[ds_hash] = {"name": os.path.basename(local_path),
+                                         "size": size,
+                                         "last_used": time.time()}
+                self.bytes_transferred += size
+                self._save()
+
+    def release(self, remote_path):
+        """Release a dataset previously acquired.
+
+        Args:
+          remote_path (str): The remote path of the dataset.
+        """
+
+        ds_hash = os.path.basename(os.path.dirname(remote_path))
+        with self.__lock:
+            if self.in_use.get(ds_hash):
+                self.in_use[ds_hash] -= 1
+
+    def log_stats(self):
+        """Log the transfers performed and avoided in the host."""
+
+        with self.__lock:
+            logger.info("Host " + str(self.host.address) + " dataset cache: " +
+                        str(self.hits) + " hits, " + str(self.misses) +
+                        " misses, " + str(self.prefetches) + " prefetched, " +
+                        str(self.evictions) + " evictions, " +
+                        str(self.bytes_transferred) + " bytes transferred, " +
+                        "transfer time %.1fs hidden / %.1fs exposed" %
+                        (self.time_hidden, self.time_exposed))
@@ -1,6 +1,8 @@
-import datetime
+import gzip
+import hashlib
 import os
 import sys
+import tempfile
 import time
 import shutil
 
@@ -9,19 +11,38 @@ try:  # Import Python 3 package, turn back to Python 2 if fails
 except ImportError:
     import ConfigParser as configparser
 
-from threading import RLock
+from threading import RLock, Thread
 
-from execo.action import TaktukPut
-from execo.time_utils import timedelta_to_seconds, format_date, get_seconds
+from execo.action import Remote, TaktukPut
+from execo.time_utils import format_date
 from execo_engine import logger
 from execo_engine.engine import Engine
-from execo_engine.sweep import ParamSweeper, sweep
-from execo_g5k.api_utils import get_cluster_site
+from execo_engine.sweep import HashableDict
+from execo_g5k.api_utils import get_cluster_hosts, get_cluster_site, \
+    get_host_attributes, get_host_cluster
 from execo_g5k.kadeploy import Deployment, deploy
-from execo_g5k.oar import oarsub, get_oar_job_nodes, get_oar_job_info, oardel
-from execo_g5k.planning import get_jobs_specs, get_planning, compute_slots
-
+from execo_g5k.oar import oarsub, get_oar_job_nodes, get_oar_job_info, oardel, \
+    wait_oar_job_start
+from execo_g5k.planning import get_jobs_specs
+
+from div_p2p.aggregate import OnlineAggregator
+from div_p2p.artifacts import ArtifactCache
+from div_p2p.connection import close_connections, set_multiplexing
+from div_p2p.cost_model import RuntimeModel
+from div_p2p.ds_cache import DatasetCache, file_hash, parse_size
+from div_p2p.explorer import GridRefinementExplorer
+from div_p2p.host_pool import HostPool
+from div_p2p.params import Constraint, iter_combinations, parse_values
+from div_p2p.planner import ReservationPlanner
+from div_p2p.profiler import RESOURCE_PREFIX, RemoteProfiler
+from div_p2p.progress import ProgressMonitor
+from div_p2p.result_cache import ResultCache
+from div_p2p.results import ResultsStore, convert_number, parse_output
+from div_p2p.scheduler import DatasetScheduler
+from div_p2p.sweeper import CombinationSweeper
 from div_p2p.test_thread import TestThread
+from div_p2p.trace import get_tracer, set_tracing, span, traced
+from div_p2p.wrapper import HostConfs
 
 
 class DivEngineException(Exception):
@@ -32,8 +53,33 @@ class ParameterException(DivEngineException):
     pass
 
 
+def parse_clusters(clusters):
+    """Parse a comma-separated list of clusters, each one optionally followed by
+    :<weight>.
+
+    Args:
+      clusters (str): The clusters.
+
+    Returns:
+      dict: the weight of each cluster.
+    """
+
+    weights = {}
+    for c in clusters.split(","):
+        if ":" in c:
+            (name, weight) = c.split(":", 1)
+            weights[name.strip()] = float(weight)
+        else:
+            weights[c.strip()] = 1.0
+    return weights
+
+
 class StatsManager(object):
-    """This class manages the statistics of the tests. It is thread-safe."""
+    """This class manages the statistics of the tests. They are stored either
+    in a ResultsStore database or, in csv format, in summary files and one
+    output file per experiment. It is thread-safe."""
+
+    formats = ["sqlite", "csv"]
 
     def __init__(self, engine):
         """Create a StatsManager linked to the given engine.
@@ -50,15 +96,31 @@ class StatsManager(object):
         self.output_path = None
         self.summary_file_name = "summary.csv"
         self.ds_summary_file_name = "ds-summary.csv"
+        self.clusters_summary_file_name = "clusters-summary.csv"
         self.summary_file = None
         self.ds_summary_file = None
 
+        self.format = "sqlite"
+        self.store_path = "results.db"
+        self.store_keep_output = True
+        self.store = None
+
         self.summary_props = []
 
         self.printed_dss = []
 
+        self.cluster_stats = {}
+
+        self.aggregator = OnlineAggregator()
+
+        # Mean metrics and duration of the repetitions of the experiments,
+        # kept when there is no store
+        self.results = {}
+        self.run_times = []
+
     def initialize(self, ds_parameters, xp_parameters):
-        """Create and write headers of the summary files.
+        """Open the summary files, writing their headers if they are new.
+        Existing results are kept and appended to.
 
         Args:
           ds_parameters (dict): The datasets parameters.
@@ -66,22 +128,126 @@ class StatsManager(object):
         """
 
         with self.__lock:
-            # Xp summary
-            self.summary_file = open(self.summary_file_name, "w")
             self.summary_props = []
             self.summary_props.extend(ds_parameters.keys())
             self.summary_props.extend(xp_parameters.keys())
-            header = "comb_id"
+
+            if self.format == "sqlite":
+                self.store = ResultsStore(self.store_path, self.summary_props,
+                                          keep_output=self.store_keep_output)
+                self.printed_dss = list(self.store.get_datasets().keys())
+                return
+
+            # Xp summary
+            header = "comb_id, cluster, n_reps"
             for pn in self.summary_props:
                 header += ", " + str(pn)
-            self.summary_file.write(header + "\n")
-            self.summary_file.flush()
+            # Last, so that lines are still read with older headers
+            header += ", run_time"
+            self.summary_file = self._open_summary(self.summary_file_name,
+                                                   header)
 
             # Ds summary
-            self.ds_summary_file = open(self.ds_summary_file_name, "w")
-            header = "ds_id, ds_class, ds_class_properties"
-            self.ds_summary_file.write(header + "\n")
-            self.ds_summary_file.flush()
+            self.ds_summary_file = self._open_summary(
+                self.ds_summary_file_name,
+                "ds_id, ds_class, ds_class_properties")
+            self.printed_dss = [int(i) for i in
+                                self._read_ids(self.ds_summary_file_name)]
+
+            # Results of previous executions
+            params = dict(ds_parameters)
+            params.update(xp_parameters)
+            (self.results, self.run_times) = self._read_summary(params)
+
+    def _open_summary(self, file_name, header):
+        """Open a summary file for appending, writing its header if it is
+        empty."""
+
+        new = not os.path.exists(file_name) or os.path.getsize(file_name) == 0
+        summary_file = open(file_name, "a")
+        if new:
+            summary_file.write(header + "\n")
+            summary_file.flush()
+        return summary_file
+
+    def _read_ids(self, file_name):
+        """Return the identifiers in the first column of a summary file."""
+
+        ids = []
+        summary_file = open(file_name)
+        summary_file.readline()
+        for line in summary_file:
+            id_str = line.split(",")[0].strip()
+            if id_str.isdigit():
+                ids.append(id_str)
+        summary_file.close()
+        return ids
+
+    def _read_summary(self, params):
+        """Rebuild the mean metrics of the experiments listed in the summary
+        file from their stats files, and the mean duration of their
+        repetitions, if known.
+
+        Args:
+          params (dict): The values of each parameter, used to restore the
+            type of the values in the summary file.
+
+        Returns:
+          tuple: the mean metrics by combination and the list of the
+            combinations with the mean duration of their repetitions.
+        """
+
+        values_by_str = dict((pn, dict((str(v), v) for v in values))
+                             for (pn, values) in params.items())
+
+        results = {}
+        run_times = []
+        summary_file = open(self.summary_file_name)
+        columns = [c.strip() for c in summary_file.readline().split(",")]
+        for line in summary_file:
+            values = dict(zip(columns, [v.strip() for v in line.split(",")]))
+            if not values.get("comb_id", "").isdigit():
+                continue
+            comb = HashableDict()
+            for pn in self.summary_props:
+                value = values.get(pn)
+                comb[pn] = values_by_str.get(pn, {}).get(value, value)
+
+            run_time = convert_number(values.get("run_time", ""))
+            n_reps = convert_number(values.get("n_reps", ""))
+            if isinstance(run_time, (int, float)) and \
+                    isinstance(n_reps, int) and n_reps > 0:
+                run_times.append((comb, run_time / float(n_reps)))
+
+            # Raw output of a single repetition or mean of several ones
+            stats_path = os.path.join(self.stats_path, values["comb_id"])
+            if not os.path.exists(stats_path):
+                logger.warn("Stats of comb with id " + values["comb_id"] +
+                            " not found in " + stats_path)
+                continue
+            stats_file = open(stats_path)
+            results[comb] = parse_output(stats_file.read())
+            stats_file.close()
+        summary_file.close()
+        return (results, run_times)
+
+    def get_done_comb_ids(self):
+        """Return the identifiers of the experiments whose results were
+        already stored, possibly by a previous execution.
+
+        Returns:
+          set of int: the combination identifiers.
+        """
+
+        if self.store:
+            self.store.flush()
+            (columns, rows) = self.store.get_xps()
+            idx = columns.index("comb_id")
+            return set(row[idx] for row in rows)
+
+        with self.__lock:
+            self.summary_file.flush()
+            return set(int(i) for i in self._read_ids(self.summary_file_name))
 
     def add_ds(self, ds_id, comb):
         """Add a new dataset to the statistics.
@@ -96,6 +262,13 @@ class StatsManager(object):
             (ds_class_name, ds_params) = \
                 self.engine.comb_manager.get_ds_class_params(comb)
 
+            if self.store:
+                with self.__lock:
+                    if not ds_id in self.printed_dss:
+                        self.store.add_ds(ds_id, ds_class_name, ds_params)
+                        self.printed_dss.append(ds_id)
+                return
+
             line = str(ds_id) + "," + ds_class_name + "," + str(ds_params)
 
             with self.__lock:
@@ -105,32 +278,197 @@ class StatsManager(object):
 
                     self.printed_dss.append(ds_id)
 
-    def add_xp(self, comb_id, comb, out_path):
-        """Add a new experiment to the statistics.
+    def add_xp(self, comb_id, comb, out_paths, host=None, run_times=None,
+               profiles=None):
+        """Add a new experiment to the statistics, with the output of each of
+        its repetitions. The metrics of the repetitions are aggregated online.
 
         Args:
           comb_id (int): The experiment combination identifier.
           comb (dict): The combination including the experiment's parameters.
+          out_paths (list of str): The local paths of the outputs of the
+            repetitions.
+          host (Host, optional): The host where the experiment was executed.
+          run_times (list of float, optional): The duration of each
+            repetition.
+          profiles (list of dict, optional): The resources used by each
+            repetition, stored as additional metrics.
         """
 
-        local_path = os.path.join(self.stats_path, str(comb_id))
+        cluster = ""
+        if host is not None:
+            cluster = get_host_cluster(host.address) or ""
 
-        logger.info("Copying stats from comb with id " + str(comb_id) +
-                    " to " + local_path)
-        shutil.move(out_path, local_path)
+        run_time = sum(run_times) if run_times else None
+        if run_time is not None:
+            self.engine.comb_manager.runtime_model.add(
+                comb, run_time / len(run_times))
 
-        line = str(comb_id)
-        for pn in self.summary_props:
-            line += ", " + str(comb[pn])
+        if self.store:
+            logger.info("Storing stats from comb with id " + str(comb_id))
+            self.store.remove_xp(comb_id)
+        else:
+            line = str(comb_id) + ", " + cluster + ", " + str(len(out_paths))
+            for pn in self.summary_props:
+                line += ", " + str(comb[pn])
+            line += ", " + (str(run_time) if run_time is not None else "")
+
+        summary = {}
+        for (rep, out_path) in enumerate(out_paths):
+            out_file = open(out_path)
+            output = out_file.read()
+            out_file.close()
+            metrics = parse_output(output)
+            if profiles and profiles[rep]:
+                metrics.update(profiles[rep])
+            summary = self.aggregator.add(comb_id, metrics)
+
+            if self.store:
+                self.store.add_rep(comb_id, rep, metrics, output)
+                os.remove(out_path)
+            else:
+                local_path = os.path.join(self.stats_path, str(comb_id))
+                if len(out_paths) > 1:
+                    local_path += "." + str(rep)
+                logger.info("Copying stats from comb with id " + str(comb_id) +
+                            " to " + local_path)
+                shutil.move(out_path, local_path)
+
+        if self.store:
+            # The experiment row goes last, as it marks complete results
+            self.store.set_summary(comb_id, summary)
+            self.store.add_xp(comb_id, cluster, comb, len(out_paths), run_time)
+        else:
+            if len(out_paths) > 1:
+                self._write_summary_output(comb_id, summary)
+            self._write_resources(comb_id, summary)
+        self.aggregator.discard(comb_id)
 
         with self.__lock:
-            self.summary_file.write(line + "\n")
-            self.summary_file.flush()
+            if not self.store:
+                self.summary_file.write(line + "\n")
+                self.summary_file.flush()
+                self.results[HashableDict(comb)] = \
+                    dict((m, st["mean"]) for (m, st) in summary.items())
+
+            if self.engine.progress:
+                cost = None
+                if self.engine.scheduler:
+                    cost = self.engine.scheduler.get_cost(comb)
+                self.engine.progress.add_xp(host, run_times, cost)
+
+            if cluster:
+                stats = self.cluster_stats.setdefault(
+                    cluster, {"hosts": set(), "runs": 0, "run_time": 0.0})
+                stats["hosts"].add(host.address)
+                stats["runs"] += len(out_paths)
+                stats["run_time"] += sum(run_times or [])
+
+    def _write_summary_output(self, comb_id, summary):
+        """Write the mean of the metrics over the repetitions in the stats file
+        of the combination, in the format of a single output."""
+
+        metrics = sorted(m for m in summary
+                         if not m.startswith(RESOURCE_PREFIX))
+        summary_file = open(os.path.join(self.stats_path, str(comb_id)), "w")
+        summary_file.write(", ".join(metrics) + "\n")
+        summary_file.write(", ".join(str(summary[m]["mean"])
+                                     for m in metrics) + "\n")
+        summary_file.close()
+
+    def _write_resources(self, comb_id, summary):
+        """Write the mean of the resources used by the repetitions, if
+        profiled, in a file next to the stats file of the combination."""
+
+        res_path = os.path.join(self.stats_path, str(comb_id) + ".resources")
+        resources = sorted(m for m in summary if m.startswith(RESOURCE_PREFIX))
+        if not resources:
+            # Do not keep those of a previous execution
+            if os.path.exists(res_path):
+                os.remove(res_path)
+            return
+        res_file = open(res_path, "w")
+        res_file.write(", ".join(resources) + "\n")
+        res_file.write(", ".join(str(summary[m]["mean"])
+                                 for m in resources) + "\n")
+        res_file.close()
+
+    def get_run_times(self):
+        """Return the mean duration of the repetitions of the experiments
+        stored by previous executions.
+
+        Returns:
+          list of tuple: the combination and the duration of each experiment.
+        """
+
+        if not self.store:
+            with self.__lock:
+                return list(self.run_times)
+
+        (columns, rows) = self.store.get_xps()
+        run_times = []
+        for row in rows:
+            values = dict(zip(columns, row))
+            if values["run_time"] is None or not values["n_reps"]:
+                continue
+            comb = dict((pn, values[pn]) for pn in self.summary_props)
+            run_times.append((comb, values["run_time"] / values["n_reps"]))
+        return run_times
+
+    def get_results(self, metric):
+        """Return the mean of the given metric for each experiment done.
+
+        Args:
+          metric (str): The name of the metric.
+
+        Returns:
+          dict: the mean of the metric (or None if unknown) by combination.
+        """
+
+        if not self.store:
+            with self.__lock:
+                return dict((comb, means.get(metric))
+                            for (comb, means) in self.results.items())
+
+        self.store.flush()
+        summaries = self.store.get_summaries(stat="mean")
+        (columns, rows) = self.store.get_xps()
+        results = {}
+        for row in rows:
+            values = dict(zip(columns, row))
+            comb = HashableDict((pn, values[pn]) for pn in self.summary_props)
+            results[comb] = summaries.get(values["comb_id"], {}).get(metric)
+        return results
+
+    def write_clusters_summary(self):
+        """Write the number of hosts and runs and the mean run time of each
+        cluster, so that results obtained in different clusters can be
+        compared."""
+
+        with self.__lock:
+            if not self.cluster_stats:
+                return
+
+            clusters_file = open(self.clusters_summary_file_name, "w")
+            clusters_file.write("cluster, n_hosts, n_runs, mean_run_time\n")
+            for (cluster, stats) in sorted(self.cluster_stats.items()):
+                mean = stats["run_time"] / max(stats["runs"], 1)
+                clusters_file.write("%s, %i, %i, %.3f\n" %
+                                    (cluster, len(stats["hosts"]),
+                                     stats["runs"], mean))
+                logger.info("Cluster " + cluster + ": " +
+                            str(len(stats["hosts"])) + " hosts, " +
+                            str(stats["runs"]) + " runs, mean run time " +
+                            "%.1fs" % mean)
+            clusters_file.close()
 
     def close(self):
-        """Close the summary files."""
+        """Close the summary files and the results store."""
 
         with self.__lock:
+            self.write_clusters_summary()
+            if self.store:
+                self.store.close()
             if self.summary_file:
                 self.summary_file.close()
             if self.ds_summary_file:
@@ -151,11 +489,23 @@ class CombinationManager(object):
 
         self.__lock = RLock()
         self.engine = engine
-        self.comb_id = 0
         self.ds_id = 0
 
         self.num_repetitions = 1
 
+        # Adaptive repetitions
+        self.adaptive_repetitions = False
+        self.min_repetitions = 2
+        self.max_repetitions = 10
+        self.ci_metric = None
+        self.ci_width = 0.05
+        self.ci_relative = True
+
+        self.reps_done = 0
+        self.reps_combs = 0
+
+        self.runtime_model = RuntimeModel()
+
     def get_ds_class_params(self, comb):
         """Return the dataset class parameters for the given combination.
 
@@ -168,8 +518,24 @@ class CombinationManager(object):
         ds_idx = comb["ds.config"]
         return self.engine.ds_config[ds_idx]
 
+    def _get_ds_config_key(self, comb):
+        """Return the class and properties of the dataset of the given
+        combination, which identify it whatever its position in the
+        configuration."""
+
+        (ds_class, ds_params) = self.get_ds_class_params(comb)
+        return ds_class + "(" + ",".join(
+            str(k) + "=" + str(ds_params[k]) for k in sorted(ds_params)) + ")"
+
+    def _hash(self, key):
+        # 60 bits, to fit in a signed 64-bit integer
+        return int(hashlib.sha1(key.encode()).hexdigest()[:15], 16)
+
     def get_comb_id(self, comb):
-        """Generate a new experiment identifier for the given combination.
+        """Return the experiment identifier of the given combination. It is
+        derived from the values of its parameters and from the dataset class
+        and properties, so that it is the same across executions of the
+        engine, even if the datasets are reordered in the configuration.
 
         Args:
           comb (dict): The experiment parameters.
@@ -177,21 +543,27 @@ class CombinationManager(object):
         Returns:
           int: the combination identifier.
         """
-        with self.__lock:
-            comb_id = self.comb_id
-            self.comb_id += 1
-        return comb_id
+        values = []
+        for pn in sorted(comb):
+            if pn == "ds.config":
+                value = self._get_ds_config_key(comb)
+            else:
+                value = comb[pn]
+            values.append(str(pn) + "=" + str(value))
+        return self._hash(";".join(values))
 
     def get_ds_id(self, comb):
-        """Generate a new dataset identifier for the given combination.
+        """Return the dataset identifier of the given combination. It is
+        derived from the dataset class and properties, so that it is the same
+        across executions of the engine.
 
         Args:
           comb (dict): The dataset parameters.
 
         Returns:
-          int: the combination identifier.
+          int: the dataset identifier.
         """
-        return comb["ds.config"]
+        return self._hash(self._get_ds_config_key(comb))
 
     def get_ds_parameters(self, params):
         """Return the params and values referring to the dataset.
@@ -224,13 +596,112 @@ class CombinationManager(object):
 
     def get_num_repetitions(self):
         """Return the number of repetitions to be performed for each
-        combination.
+        combination, or the maximum one in adaptive mode.
 
         Returns:
           int: the number of repetitions.
         """
+        if self.adaptive_repetitions:
+            return self.max_repetitions
         return self.num_repetitions
 
+    def get_min_repetitions(self):
+        """Return the minimum number of repetitions of a combination whose
+        results are complete.
+
+        Returns:
+          int: the number of repetitions.
+        """
+        if self.adaptive_repetitions:
+            return self.min_repetitions
+        return self.num_repetitions
+
+    def get_expected_repetitions(self):
+        """Return the number of repetitions expected for each combination,
+        i.e., in adaptive mode, the mean of those run so far or the maximum if
+        none was run yet.
+
+        Returns:
+          float: the number of repetitions.
+        """
+        with self.__lock:
+            if self.adaptive_repetitions and self.reps_combs:
+                return float(self.reps_done) / self.reps_combs
+        return self.get_num_repetitions()
+
+    def get_expected_cost(self, comb):
+        """Return the expected duration of a combination, i.e., its expected
+        number of repetitions times the runtime predicted for each of them. If
+        no runtime was observed yet, each repetition costs 1.
+
+        Args:
+          comb (dict): The combination.
+
+        Returns:
+          float: the expected cost.
+        """
+        run_time = self.runtime_model.predict(comb)
+        if run_time is None:
+            run_time = 1.0
+        return self.get_expected_repetitions() * run_time
+
+    def has_converged(self, rep_stats):
+        """Return whether no more repetitions of a combination are needed, given
+        the statistics of the target metric over the repetitions run so far.
+
+        Args:
+          rep_stats (RunningStats): The statistics of the metric.
+
+        Returns:
+          bool: True if the confidence interval of the metric is narrow
+            enough or the maximum number of repetitions is reached.
+        """
+        if not self.adaptive_repetitions:
+            return rep_stats.n >= self.num_repetitions
+        if rep_stats.n >= self.max_repetitions:
+            return True
+        if rep_stats.n < self.min_repetitions:
+            return False
+
+        width = rep_stats.get_ci_width()
+        if width is None:
+            return False
+        if self.ci_relative:
+            return width <= self.ci_width * abs(rep_stats.mean)
+        return width <= self.ci_width
+
+    def add_repetitions(self, n_reps):
+        """Record the number of repetitions run for a combination.
+
+        Args:
+          n_reps (int): The number of repetitions.
+        """
+        with self.__lock:
+            self.reps_done += n_reps
+            self.reps_combs += 1
+
+    def log_repetitions(self):
+        """Log the number of repetitions run and saved in adaptive mode."""
+        if self.adaptive_repetitions and self.reps_combs:
+            saved = self.reps_combs * self.max_repetitions - self.reps_done
+            logger.info("Adaptive repetitions: %.2f per combination on "
+                        "average, %i saved" %
+                        (float(self.reps_done) / self.reps_combs, saved))
+
+    def get_ds_key(self, comb):
+        """Return a hashable key identifying the dataset used by the given
+        combination.
+
+        Args:
+          comb (dict): The combination.
+
+        Returns:
+          tuple: the values of the dataset parameters.
+        """
+
+        return tuple((var, comb[var])
+                     for var in sorted(self.engine.ds_parameters.keys()))
+
     def uses_same_ds(self, comb1, comb2):
         """Determine if both combinations use the same dataset.
 
@@ -256,7 +727,9 @@ class DivEngine(Engine):
         self.options_parser.set_usage(
             "usage: %prog <cluster> <n_nodes> <config_file>")
         self.options_parser.add_argument("cluster",
-                    "The cluster on which to run the experiment")
+                    "The cluster on which to run the experiment. Several "
+                    "clusters can be given separated by commas, each one "
+                    "optionally followed by :<weight>")
         self.options_parser.add_argument("n_nodes",
                     "The number of nodes in which the experiment is going to be"
                     " deployed")
@@ -285,15 +758,72 @@ class DivEngine(Engine):
         self.use_kadeploy = False
         self.kadeploy_env_file = None
         self.kadeploy_env_name = None
+        self.deploy_pipelined = True
+        self.deploy_batch_size = 8
+        self.deploy_max_tries = 3
+        self.artifact_cache = ArtifactCache()
+        self.result_cache = None
 
         self.jar_file = None
         self.remote_dir = "/tmp"
+        self.use_worker = False
+        self.batch_confs = True
+
+        self.slots_per_host = 1
+        # Number of slots of each host, once resolved
+        self.host_slots = {}
+        self.cluster_cores = None
+        self.slots_pinning = "none"
+
+        self.ds_cache_budget = None
+        self.ds_caches = {}
+        self.host_confs = {}
+        self.ds_prefetch = True
+        self.ds_broadcast = "none"
+        self.ds_broadcast_min_groups = 2
+        self.ds_broadcast_compress = False
+
+        self.speculation = False
+        self.spec_percentile = 90
+        self.spec_max_copies = 1
+
+        self.elastic = False
+        self.elastic_check_period = 30
+        self.elastic_target_nodes = None
+        self.elastic_max_restarts = 2
+
+        self.oar_jobs = []
+
+        self.planner_policy = "earliest"
+        self.planner_min_nodes = 1
+        self.planner_total_work = None
+        self.planner_run_time = None
+
+        self.explore = "none"
+        self.explore_metric = None
+        self.explore_goal = "max"
+        self.explore_top = 3
+        self.explorer = None
+
+        self.constraints = []
+
+        self.trace_file_name = "trace.json"
+        self.trace_summary_file_name = "trace-summary.csv"
+
+        self.sweeper = None
+        self.scheduler = None
+        self.progress = ProgressMonitor(self)
+
+        self.profile = False
+        self.profile_period = 1
+        self.profile_gc = False
 
     def run(self):
         """Inherited method, put here the code for running the engine."""
 
         # Get parameters
-        self.cluster = self.args[0]
+        self.clusters = parse_clusters(self.args[0])
+        self.cluster = sorted(self.clusters, key=lambda c: -self.clusters[c])[0]
         self.n_nodes = int(self.args[1])
         self.config_file = self.args[2]
         self.site = get_cluster_site(self.cluster)
@@ -305,58 +835,109 @@ class DivEngine(Engine):
         # Set oar job id
         if self.options.oar_job_id:
             self.oar_job_id = self.options.oar_job_id
+            self.jobs = [(self.oar_job_id, self.frontend)]
         else:
             self.oar_job_id = None
+            self.jobs = []
 
         # Main
         try:
             # Creation of the main iterator used for the first control loop.
             self.define_parameters()
+            if self.progress:
+                self.progress.start()
 
             job_is_dead = False
             # While they are combinations to treat
-            while len(self.sweeper.get_remaining()) > 0:
+            while self.has_remaining():
 
                 ## SETUP
                 # If no job, we make a reservation and prepare the hosts for the
                 # experiments
-                if job_is_dead or self.oar_job_id is None:
+                if job_is_dead or not self.jobs:
                     self.make_reservation()
+                    job_is_dead = False
                     success = self.setup()
                     if not success:
                         break
+                    pending_setup = self.is_setup_pipelined()
                 else:
-                    self.hosts = get_oar_job_nodes(self.oar_job_id,
-                                                   self.frontend)
+                    pending_setup = False
+                    self.jobs_hosts = [(job, get_oar_job_nodes(*job))
+                                       for job in self.jobs]
+                    self.hosts = [h for (_, hosts) in self.jobs_hosts
+                                  for h in hosts]
+                    for job in self.jobs:
+                        if job not in self.oar_jobs:
+                            self.oar_jobs.append(job)
                 ## SETUP FINISHED
 
-                logger.info("Setup finished in hosts " + str(self.hosts))
-
-                test_threads = []
-                for h in self.hosts:
-                    t = TestThread(h, self.comb_manager, self.stats_manager)
-                    test_threads.append(t)
-                    t.name = "th_" + str(h.address).split(".")[0]
-                    t.start()
-
-                for t in test_threads:
-                    t.join()
-
-                if get_oar_job_info(self.oar_job_id,
-                                    self.frontend)['state'] == 'Error':
+                if pending_setup:
+                    logger.info("Hosts " + str(self.hosts) + " will join as "
+                                "soon as they are set up")
+                else:
+                    logger.info("Setup finished in hosts " + str(self.hosts))
+
+                self.scheduler = DatasetScheduler(
+                    self.comb_manager,
+                    slots_per_host=self.get_slots_per_node(),
+                    speculation=self.speculation,
+                    spec_percentile=self.spec_percentile,
+                    spec_max_copies=self.spec_max_copies)
+                self.scheduler.build(self.hosts)
+
+                host_pool = HostPool(self,
+                                     check_period=self.elastic_check_period,
+                                     target_nodes=self.elastic_target_nodes,
+                                     elastic=self.elastic,
+                                     max_restarts=self.elastic_max_restarts)
+                if self.progress:
+                    self.progress.deadline = self.get_jobs_end()
+
+                model_trained = \
+                    self.comb_manager.runtime_model.get_num_samples() > 0
+                host_pool.run(self.jobs_hosts, pending_setup)
+
+                if self.artifact_cache:
+                    self.artifact_cache.log_stats()
+                for ds_cache in self.ds_caches.values():
+                    ds_cache.log_stats()
+                self.scheduler.log_stats()
+                (predicted, actual) = self.scheduler.get_makespan()
+                if model_trained and actual is not None:
+                    logger.info("Makespan: predicted %.1fs, actual %.1fs" %
+                                (predicted, actual))
+                self.comb_manager.log_repetitions()
+
+                # Jobs reserved by the pool are reused too, unless they ended
+                jobs_states = [get_oar_job_info(*job)['state']
+                               for job in self.jobs]
+                self.jobs = [job for (job, state) in zip(self.jobs, jobs_states)
+                             if state not in ['Error', 'Terminated']]
+                if not self.jobs or not host_pool.get_live_hosts():
                     job_is_dead = True
 
         finally:
-            if self.oar_job_id is not None:
+            if self.oar_jobs:
                 if not self.options.keep_alive:
-                    pass
-                    logger.info('Deleting job')
-                    oardel([(self.oar_job_id, self.frontend)])
+                    logger.info('Deleting jobs')
+                    oardel(self.oar_jobs)
                 else:
-                    logger.info('Keeping job alive for debugging')
+                    logger.info('Keeping jobs alive for debugging')
+
+            close_connections()
 
             # Close stats
+            if self.progress:
+                self.progress.stop()
             self.stats_manager.close()
+            if self.result_cache:
+                self.result_cache.log_stats()
+
+            tracer = get_tracer()
+            if tracer:
+                tracer.write_trace(self.trace_file_name)
+                tracer.write_summary(self.trace_summary_file_name)
 
     def __define_test_parameters(self, config):
         if config.has_section("test_parameters"):
@@ -375,10 +956,72 @@ class DivEngine(Engine):
                 self.stats_manager.ds_summary_file_name = \
                     config.get("test_parameters", "test.ds_summary_file")
 
+            if "test.results.format" in test_parameters_names:
+                self.stats_manager.format = \
+                    config.get("test_parameters", "test.results.format")
+                if self.stats_manager.format not in StatsManager.formats:
+                    logger.error("test.results.format should be one of " +
+                                 str(StatsManager.formats))
+                    raise ParameterException("test.results.format should be "
+                                             "one of " +
+                                             str(StatsManager.formats))
+
+            if "test.results.store" in test_parameters_names:
+                self.stats_manager.store_path = \
+                    config.get("test_parameters", "test.results.store")
+
+            if "test.results.keep_output" in test_parameters_names:
+                self.stats_manager.store_keep_output = config.getboolean(
+                    "test_parameters", "test.results.keep_output")
+
+            if "test.clusters_summary_file" in test_parameters_names:
+                self.stats_manager.clusters_summary_file_name = \
+                    config.get("test_parameters",
+                               "test.clusters_summary_file")
+
             if "test.num_repetitions" in test_parameters_names:
                 self.comb_manager.num_repetitions = \
                     int(config.get("test_parameters", "test.num_repetitions"))
 
+            if "test.repetitions.adaptive" in test_parameters_names:
+                self.comb_manager.adaptive_repetitions = config.getboolean(
+                    "test_parameters", "test.repetitions.adaptive")
+
+            if self.comb_manager.adaptive_repetitions:
+                if "test.repetitions.metric" in test_parameters_names:
+                    self.comb_manager.ci_metric = config.get(
+                        "test_parameters", "test.repetitions.metric")
+                else:
+                    logger.error("test.repetitions.metric should be specified "
+                                 "with adaptive repetitions")
+                    raise ParameterException("test.repetitions.metric should "
+                                             "be specified with adaptive "
+                                             "repetitions")
+
+                if "test.repetitions.min" in test_parameters_names:
+                    self.comb_manager.min_repetitions = int(config.get(
+                        "test_parameters", "test.repetitions.min"))
+
+                if "test.repetitions.max" in test_parameters_names:
+                    self.comb_manager.max_repetitions = int(config.get(
+                        "test_parameters", "test.repetitions.max"))
+
+                if "test.repetitions.ci_width" in test_parameters_names:
+                    self.comb_manager.ci_width = float(config.get(
+                        "test_parameters", "test.repetitions.ci_width"))
+
+                if "test.repetitions.ci_relative" in test_parameters_names:
+                    self.comb_manager.ci_relative = config.getboolean(
+                        "test_parameters", "test.repetitions.ci_relative")
+
+                if not (1 <= self.comb_manager.min_repetitions <=
+                        self.comb_manager.max_repetitions):
+                    logger.error("test.repetitions.min should be between 1 "
+                                 "and test.repetitions.max")
+                    raise ParameterException("test.repetitions.min should be "
+                                             "between 1 and "
+                                             "test.repetitions.max")
+
             if "test.jar_file" in test_parameters_names:
                 self.jar_file = config.get("test_parameters", "test.jar_file")
 
@@ -386,6 +1029,195 @@ class DivEngine(Engine):
                 self.remote_dir = config.get("test_parameters",
                                              "test.remote_dir")
 
+            if "test.use_worker" in test_parameters_names:
+                self.use_worker = config.getboolean("test_parameters",
+                                                    "test.use_worker")
+
+            if "test.slots_per_host" in test_parameters_names:
+                slots = config.get("test_parameters", "test.slots_per_host")
+                if slots.strip() == "auto":
+                    self.slots_per_host = "auto"
+                else:
+                    self.slots_per_host = int(slots)
+
+            if "test.slots.pinning" in test_parameters_names:
+                self.slots_pinning = \
+                    config.get("test_parameters", "test.slots.pinning").strip()
+                if self.slots_pinning not in ["none", "cores", "numa"]:
+                    logger.error("test.slots.pinning should be one of none, "
+                                 "cores or numa")
+                    raise ParameterException("test.slots.pinning should be one "
+                                             "of none, cores or numa")
+
+            if "test.ds_cache.budget" in test_parameters_names:
+                self.ds_cache_budget = parse_size(
+                    config.get("test_parameters", "test.ds_cache.budget"))
+
+            if "test.ds_prefetch" in test_parameters_names:
+                self.ds_prefetch = config.getboolean("test_parameters",
+                                                     "test.ds_prefetch")
+
+            if "test.ds_broadcast" in test_parameters_names:
+                self.ds_broadcast = \
+                    config.get("test_parameters", "test.ds_broadcast").strip()
+                if self.ds_broadcast not in ["none", "all", "hot"]:
+                    logger.error("test.ds_broadcast should be one of none, all "
+                                 "or hot")
+                    raise ParameterException("test.ds_broadcast should be one "
+                                             "of none, all or hot")
+
+            if "test.ds_broadcast.min_groups" in test_parameters_names:
+                self.ds_broadcast_min_groups = int(config.get(
+                    "test_parameters", "test.ds_broadcast.min_groups"))
+
+            if "test.ds_broadcast.compress" in test_parameters_names:
+                self.ds_broadcast_compress = config.getboolean(
+                    "test_parameters", "test.ds_broadcast.compress")
+
+            if "test.speculation" in test_parameters_names:
+                self.speculation = config.getboolean("test_parameters",
+                                                     "test.speculation")
+
+            if "test.speculation.percentile" in test_parameters_names:
+                self.spec_percentile = float(config.get(
+                    "test_parameters", "test.speculation.percentile"))
+
+            if "test.speculation.max_copies" in test_parameters_names:
+                self.spec_max_copies = int(config.get(
+                    "test_parameters", "test.speculation.max_copies"))
+
+            if "test.elastic" in test_parameters_names:
+                self.elastic = config.getboolean("test_parameters",
+                                                 "test.elastic")
+
+            if "test.elastic.check_period" in test_parameters_names:
+                self.elastic_check_period = int(config.get(
+                    "test_parameters", "test.elastic.check_period"))
+
+            if "test.elastic.target_nodes" in test_parameters_names:
+                self.elastic_target_nodes = int(config.get(
+                    "test_parameters", "test.elastic.target_nodes"))
+
+            if "test.elastic.max_restarts" in test_parameters_names:
+                self.elastic_max_restarts = int(config.get(
+                    "test_parameters", "test.elastic.max_restarts"))
+
+            if "test.planner.policy" in test_parameters_names:
+                self.planner_policy = \
+                    config.get("test_parameters", "test.planner.policy").strip()
+                if self.planner_policy not in ReservationPlanner.policies:
+                    msg = ("test.planner.policy should be one of " +
+                           ", ".join(ReservationPlanner.policies))
+                    logger.error(msg)
+                    raise ParameterException(msg)
+
+            if "test.planner.min_nodes" in test_parameters_names:
+                self.planner_min_nodes = int(config.get(
+                    "test_parameters", "test.planner.min_nodes"))
+
+            if "test.planner.total_work" in test_parameters_names:
+                # In node-hours
+                self.planner_total_work = 3600 * float(config.get(
+                    "test_parameters", "test.planner.total_work"))
+
+            if "test.planner.run_time" in test_parameters_names:
+                # In seconds
+                self.planner_run_time = float(config.get(
+                    "test_parameters", "test.planner.run_time"))
+
+            if "test.explore" in test_parameters_names:
+                self.explore = \
+                    config.get("test_parameters", "test.explore").strip()
+                if self.explore not in ["none", "grid"]:
+                    logger.error("test.explore should be one of none or grid")
+                    raise ParameterException("test.explore should be one of "
+                                             "none or grid")
+
+            if self.explore != "none":
+                if "test.explore.metric" in test_parameters_names:
+                    self.explore_metric = config.get(
+                        "test_parameters", "test.explore.metric").strip()
+                else:
+                    logger.error("test.explore.metric should be specified "
+                                 "when exploring")
+                    raise ParameterException("test.explore.metric should be "
+                                             "specified when exploring")
+
+                if "test.explore.goal" in test_parameters_names:
+                    self.explore_goal = config.get(
+                        "test_parameters", "test.explore.goal").strip()
+                    if self.explore_goal not in GridRefinementExplorer.goals:
+                        logger.error("test.explore.goal should be one of max "
+                                     "or min")
+                        raise ParameterException("test.explore.goal should be "
+                                                 "one of max or min")
+
+                if "test.explore.top" in test_parameters_names:
+                    self.explore_top = int(config.get(
+                        "test_parameters", "test.explore.top"))
+                    if self.explore_top < 1:
+                        logger.error("test.explore.top should be at least 1")
+                        raise ParameterException("test.explore.top should be "
+                                                 "at least 1")
+
+            if "test.batch_confs" in test_parameters_names:
+                self.batch_confs = config.getboolean("test_parameters",
+                                                     "test.batch_confs")
+
+            if "test.progress" in test_parameters_names:
+                if not config.getboolean("test_parameters", "test.progress"):
+                    self.progress = None
+
+            if self.progress:
+                if "test.progress.file" in test_parameters_names:
+                    self.progress.path = config.get("test_parameters",
+                                                    "test.progress.file")
+
+                if "test.progress.period" in test_parameters_names:
+                    self.progress.period = int(config.get(
+                        "test_parameters", "test.progress.period"))
+
+                if "test.progress.http_port" in test_parameters_names:
+                    self.progress.http_port = int(config.get(
+                        "test_parameters", "test.progress.http_port"))
+
+            if "test.trace" in test_parameters_names:
+                set_tracing(config.getboolean("test_parameters",
+                                              "test.trace"))
+
+            if "test.trace.file" in test_parameters_names:
+                self.trace_file_name = config.get("test_parameters",
+                                                  "test.trace.file")
+
+            if "test.trace.summary_file" in test_parameters_names:
+                self.trace_summary_file_name = config.get(
+                    "test_parameters", "test.trace.summary_file")
+
+            if "test.profile" in test_parameters_names:
+                self.profile = config.getboolean("test_parameters",
+                                                 "test.profile")
+
+            if "test.profile.period" in test_parameters_names:
+                self.profile_period = float(config.get(
+                    "test_parameters", "test.profile.period"))
+                if self.profile_period <= 0:
+                    logger.error("test.profile.period should be positive")
+                    raise ParameterException("test.profile.period should be "
+                                             "positive")
+
+            if "test.profile.gc" in test_parameters_names:
+                self.profile_gc = config.getboolean("test_parameters",
+                                                    "test.profile.gc")
+
+            if "test.ssh_multiplexing" in test_parameters_names:
+                set_multiplexing(config.getboolean("test_parameters",
+                                                   "test.ssh_multiplexing"))
+
+            if "test.artifact_cache" in test_parameters_names:
+                if not config.getboolean("test_parameters",
+                                         "test.artifact_cache"):
+                    self.artifact_cache = None
+
             if "test.use_kadeploy" in test_parameters_names:
                 self.use_kadeploy = config.getboolean("test_parameters",
                                                       "test.use_kadeploy")
@@ -404,6 +1236,51 @@ class DivEngine(Engine):
                                              "test.kadeploy.env_name should be "
                                              "specified")
 
+                if "test.kadeploy.pipelined" in test_parameters_names:
+                    self.deploy_pipelined = config.getboolean(
+                        "test_parameters", "test.kadeploy.pipelined")
+
+                if self.deploy_pipelined and self.ds_broadcast != "none":
+                    logger.warn("test.ds_broadcast is ignored with "
+                                "test.kadeploy.pipelined, datasets are copied "
+                                "to each host on demand. Set "
+                                "test.kadeploy.pipelined to false to "
+                                "broadcast them")
+
+                if "test.kadeploy.batch_size" in test_parameters_names:
+                    self.deploy_batch_size = int(config.get(
+                        "test_parameters", "test.kadeploy.batch_size"))
+                    if self.deploy_batch_size < 1:
+                        logger.error("test.kadeploy.batch_size should be at "
+                                     "least 1")
+                        raise ParameterException("test.kadeploy.batch_size "
+                                                 "should be at least 1")
+
+                if "test.kadeploy.max_tries" in test_parameters_names:
+                    self.deploy_max_tries = int(config.get(
+                        "test_parameters", "test.kadeploy.max_tries"))
+
+            # Results are shared by campaigns only if asked, as they are
+            # kept in the home directory
+            if "test.result_cache" in test_parameters_names and \
+                    config.getboolean("test_parameters", "test.result_cache"):
+                self.result_cache = ResultCache()
+                self.result_cache.jar_path = self.jar_file
+                if self.use_kadeploy:
+                    self.result_cache.env_id = self.get_env_id()
+
+                if "test.result_cache.path" in test_parameters_names:
+                    self.result_cache.path = config.get(
+                        "test_parameters", "test.result_cache.path")
+
+                if "test.result_cache.bypass" in test_parameters_names:
+                    self.result_cache.bypass = config.getboolean(
+                        "test_parameters", "test.result_cache.bypass")
+
+                if "test.result_cache.max_size" in test_parameters_names:
+                    self.result_cache.max_size = parse_size(config.get(
+                        "test_parameters", "test.result_cache.max_size"))
+
     def __define_ds_parameters(self, config):
         ds_parameters_names = config.options("ds_parameters")
         self.ds_parameters = {}
@@ -417,7 +1294,8 @@ class DivEngine(Engine):
             elif pn == "ds.class":
                 ds_classes = [v.strip() for v in pv]
             else:
-                self.ds_parameters[pn] = [v.strip() for v in pv]
+                self.ds_parameters[pn] = self.__parse_values(
+                    pn, config.get("ds_parameters", pn))
 
         # Create ds configurations
         self.ds_config = []
@@ -439,6 +1317,32 @@ class DivEngine(Engine):
 
         self.ds_parameters["ds.config"] = range(0, len(self.ds_config))
 
+    def __parse_values(self, pn, string):
+        try:
+            return parse_values(string)
+        except ValueError as e:
+            logger.error("Wrong values of " + pn + ": " + str(e))
+            raise ParameterException("Wrong values of " + pn + ": " + str(e))
+
+    def __define_constraints(self, config):
+        self.constraints = []
+        if not config.has_section("constraints"):
+            return
+        for cn in config.options("constraints"):
+            try:
+                self.constraints.append(Constraint(
+                    config.get("constraints", cn), self.parameters.keys()))
+            except ValueError as e:
+                logger.error("Wrong constraint " + cn + ": " + str(e))
+                raise ParameterException("Wrong constraint " + cn + ": " +
+                                         str(e))
+
+    def _filter_combinations(self, combs):
+        """Return the given combinations which satisfy the constraints."""
+
+        return [c for c in combs if all(ct.accepts(c)
+                                        for ct in self.constraints)]
+
     def define_parameters(self):
         """Create the iterator that contains the parameters to be explored."""
 
@@ -455,16 +1359,21 @@ class DivEngine(Engine):
         xp_parameters_names = config.options("xp_parameters")
         self.xp_parameters = {}
         for pn in xp_parameters_names:
-            pv = config.get("xp_parameters", pn).split(",")
-            self.xp_parameters[pn] = [v.strip() for v in pv]
+            self.xp_parameters[pn] = self.__parse_values(
+                pn, config.get("xp_parameters", pn))
 
         # GLOBAL
         self.parameters = {}
         self.parameters.update(self.ds_parameters)
         self.parameters.update(self.xp_parameters)
 
+        # CONSTRAINTS
+        self.__define_constraints(config)
+
         # SUMMARY FILES
         self.stats_manager.initialize(self.ds_parameters, self.xp_parameters)
+        for (comb, run_time) in self.stats_manager.get_run_times():
+            self.comb_manager.runtime_model.add(comb, run_time)
 
         # PRINT PARAMETERS
         print_ds_parameters = {}
@@ -472,131 +1381,633 @@ class DivEngine(Engine):
         print_ds_parameters["ds.config"] = self.ds_config
         logger.info("Dataset parameters: " + str(print_ds_parameters))
         logger.info("Experiment parameters: " + str(self.xp_parameters))
-
-        self.sweeper = ParamSweeper(os.path.join(self.result_dir, "sweeps"),
-                                    sweep(self.parameters))
+        if self.constraints:
+            logger.info("Constraints: " +
+                        ", ".join(str(c) for c in self.constraints))
+
+        sweeps_dir = os.path.join(self.result_dir, "sweeps")
+        if not os.path.exists(sweeps_dir):
+            os.makedirs(sweeps_dir)
+        if self.explore == "grid":
+            self.explorer = GridRefinementExplorer(
+                self.parameters, self.explore_metric, goal=self.explore_goal,
+                top=self.explore_top, fixed=list(self.ds_parameters.keys()),
+                state_path=os.path.join(sweeps_dir, "explorer"))
+            # The levels explored are resumed from their file, if any
+            self.sweeper = CombinationSweeper(
+                self.comb_manager.get_comb_id,
+                path=os.path.join(sweeps_dir, "explored"))
+            if not self.sweeper.get_num_total():
+                self.sweeper.add_combinations(self._filter_combinations(
+                    self.explorer.get_initial()))
+                self.explorer.save()
+        else:
+            # Invalid combinations are discarded as they are generated
+            self.sweeper = CombinationSweeper(
+                self.comb_manager.get_comb_id,
+                generator=lambda: iter_combinations(self.parameters,
+                                                    self.constraints))
         self.comb_manager.sweeper = self.sweeper
+        self.resume()
 
+        if self.comb_manager.adaptive_repetitions:
+            repetitions = "%i to %i, until the 95%% CI of %s is within %s" % (
+                self.comb_manager.min_repetitions,
+                self.comb_manager.max_repetitions,
+                self.comb_manager.ci_metric, self.comb_manager.ci_width)
+        else:
+            repetitions = self.comb_manager.num_repetitions
         logger.info('Number of parameters combinations %s, '
                     'Number of repetitions %s',
-                    len(self.sweeper.get_remaining()),
-                    self.comb_manager.num_repetitions)
+                    self.sweeper.get_num_remaining(), repetitions)
+
+    def resume(self):
+        """Rebuild the state of the sweeper from the existing results. The
+        combinations left in progress by a previous execution are run again,
+        unless their results were stored before it stopped."""
+
+        done_ids = self.stats_manager.get_done_comb_ids()
+        if not done_ids:
+            return
+        self.sweeper.set_done_ids(done_ids)
+        logger.info("Resuming: %i experiments with stored results, %i of "
+                    "them marked as done" % (len(done_ids),
+                                             self.sweeper.get_num_done()))
+
+    def has_remaining(self):
+        """Return whether there are combinations left to test. When exploring,
+        the combinations of the next level are added once all the previous
+        ones are done.
+
+        Returns:
+          bool: whether there are remaining combinations.
+        """
+
+        while self.sweeper.get_num_remaining() == 0:
+            if not self.explorer:
+                return False
+            new_combs = self.explorer.refine(
+                self.stats_manager.get_results(self.explore_metric))
+            if not new_combs:
+                logger.info("Exploration finished")
+                return False
+            self.sweeper.add_combinations(
+                self._filter_combinations(new_combs))
+            # Saved last, so that a level is not skipped when resuming
+            self.explorer.save()
+        return True
 
     def make_reservation(self):
-        """Perform a reservation of the required number of nodes."""
+        """Perform a reservation of the required number of nodes, possibly
+        across several clusters (one job per site)."""
+
+        self.jobs = self._reserve(self.n_nodes)
+        self.oar_jobs.extend(self.jobs)
+        (self.oar_job_id, self.frontend) = self.jobs[0]
+
+    def add_reservation(self, n_nodes, setup=True, stop_event=None):
+        """Reserve some more nodes as soon as possible, wait for them and,
+        optionally, set them up. The jobs which start are added to those of
+        the engine, so that they are reused by the next batches, and all of
+        them to those deleted at the end of the campaign. Those given up
+        before they start are deleted right away.
+
+        Args:
+          n_nodes (int): The number of nodes.
+          setup (bool, optional): Whether to set up the hosts (default: True).
+          stop_event (Event, optional): An event which, once set, stops the
+            wait for the jobs (default: none).
+
+        Returns:
+          list of tuple: the (oar_job_id, frontend) of each job and the list of
+            its hosts, ready to run experiments if they were set up.
+        """
+
+        jobs = self._reserve(n_nodes, policy="earliest")
+        self.oar_jobs.extend(jobs)
+
+        jobs_hosts = []
+        for job in jobs:
+            with span("reservation_wait"):
+                if not self._wait_job_start(job, stop_event):
+                    if stop_event is not None and stop_event.is_set():
+                        logger.info("Deleting job " + str(job[0]) +
+                                    ", no longer needed")
+                        oardel([job])
+                    continue
+                hosts = get_oar_job_nodes(*job)
+            self.jobs.append(job)
+            if stop_event is not None and stop_event.is_set():
+                # The next jobs are deleted, this one is kept for reuse
+                continue
+            if setup:
+                hosts = self.setup_hosts(hosts)
+            jobs_hosts.append((job, hosts))
+        return jobs_hosts
+
+    def _wait_job_start(self, job, stop_event=None):
+        """Wait for a job to start, giving up if the event is set.
+
+        Returns:
+          bool: whether the job started.
+        """
+
+        if stop_event is None:
+            return wait_oar_job_start(*job)
+        while not stop_event.is_set():
+            if wait_oar_job_start(job[0], job[1], timeout=30):
+                return True
+            if get_oar_job_info(*job).get("state") in ["Error",
+                                                       "Terminated"]:
+                return False
+        return False
+
+    def get_jobs_end(self):
+        """Return the time at which the first of the jobs ends, or None if it
+        is unknown."""
+
+        ends = []
+        for job in self.jobs:
+            info = get_oar_job_info(*job)
+            if "start_date" in info and "walltime" in info:
+                ends.append(info["start_date"] + info["walltime"])
+        return min(ends) if ends else None
+
+    def _get_jobs_specs(self, resources, startdate=None):
+        jobs_specs = get_jobs_specs(resources, name=self.__class__.__name__)
+        for (sub, _) in jobs_specs:
+            sub.walltime = self.options.walltime
+            if self.use_kadeploy:
+                sub.additional_options = '-t deploy'
+            else:
+                sub.additional_options = '-t allow_classic_ssh'
+            sub.reservation_date = startdate
+        return jobs_specs
+
+    def _reserve(self, n_nodes, policy=None):
 
         logger.info('Performing reservation')
-        now = int(time.time() +
-                  timedelta_to_seconds(datetime.timedelta(minutes=1)))
-        starttime = now
-        endtime = int(starttime +
-                      timedelta_to_seconds(datetime.timedelta(days=3,
-                                                              minutes=1)))
-        startdate, n_nodes = self._get_nodes(starttime, endtime)
-
-        search_time = 3 * 24 * 60 * 60  # 3 days
-        walltime_seconds = get_seconds(self.options.walltime)
-
-        iteration = 0
-        while not n_nodes:
-            iteration += 1
-            logger.info('Not enough nodes found between %s and %s, ' +
-                        'increasing time window',
-                        format_date(starttime), format_date(endtime))
-            starttime = max(now, now +
-                            iteration * search_time - walltime_seconds)
-            endtime = int(now + (iteration + 1) * search_time)
-
-            startdate, n_nodes = self._get_nodes(starttime, endtime)
-            if starttime > int(time.time() + timedelta_to_seconds(
-                    datetime.timedelta(weeks=6))):
-                logger.error('There are not enough nodes on %s for your ' +
-                             'experiments, abort ...', self.cluster)
-                exit()
-
-        jobs_specs = get_jobs_specs({self.cluster: n_nodes},
-                                    name=self.__class__.__name__)
-        sub = jobs_specs[0][0]
-        sub.walltime = self.options.walltime
-        if self.use_kadeploy:
-            sub.additional_options = '-t deploy'
-        else:
-            sub.additional_options = '-t allow_classic_ssh'
-        sub.reservation_date = startdate
-        (self.oar_job_id, self.frontend) = oarsub(jobs_specs)[0]
-        logger.info('Startdate: %s, n_nodes: %s, job_id: %s',
-                    format_date(startdate),
-                    str(n_nodes), str(self.oar_job_id))
-
-    def _get_nodes(self, starttime, endtime):
-
-        planning = get_planning(elements=[self.cluster],
-                                starttime=starttime,
-                                endtime=endtime,
-                                out_of_chart=self.options.outofchart)
-        slots = compute_slots(planning, self.options.walltime)
-        startdate = slots[0][0]
-        i_slot = 0
-        n_nodes = slots[i_slot][2][self.cluster]
-        while n_nodes < self.n_nodes:
-            logger.debug(slots[i_slot])
-            startdate = slots[i_slot][0]
-            n_nodes = slots[i_slot][2][self.cluster]
-            i_slot += 1
-            if i_slot == len(slots) - 1:
-                return False, False
-        return startdate, self.n_nodes
+        planner = ReservationPlanner(self.clusters, self.options.walltime,
+                                     self.options.outofchart)
+        startdate, resources = planner.find_slot(
+            n_nodes, policy or self.planner_policy,
+            total_work=self.estimate_total_work(),
+            min_nodes=self.planner_min_nodes)
+        if startdate is None:
+            logger.error('There are not enough nodes on %s for your ' +
+                         'experiments, abort ...', ", ".join(self.clusters))
+            exit()
+
+        jobs_specs = self._get_jobs_specs(resources, startdate)
+        with span("reservation"):
+            jobs = [job for job in oarsub(jobs_specs) if job[0] is not None]
+        logger.info('Startdate: %s, n_nodes: %s, jobs: %s',
+                    format_date(startdate), str(resources), str(jobs))
+        return jobs
+
+    def estimate_total_work(self):
+        """Estimate the remaining work of the campaign, either from
+        test.planner.total_work, from the number of remaining runs and
+        test.planner.run_time or from the runtimes observed so far.
+
+        Returns:
+          float: the remaining work in node-seconds or None if unknown.
+        """
+
+        if self.planner_total_work:
+            return self.planner_total_work
+        if self.planner_run_time:
+            n_runs = (self.sweeper.get_num_remaining() *
+                      self.comb_manager.get_expected_repetitions())
+            return n_runs * self.planner_run_time / self.get_slots_per_node()
+        if self.comb_manager.runtime_model.get_num_samples():
+            return (sum(self.comb_manager.get_expected_cost(c)
+                        for c in self.sweeper.iter_remaining()) /
+                    self.get_slots_per_node())
+        return None
+
+    def get_slots_per_node(self, host_key=None):
+        """Return the number of experiments run in parallel per node. With
+        automatic slots, it is the number of slots resolved in the given host
+        or, on average, in the hosts set up so far or, before that, the number
+        of cores of the nodes of the cluster.
+
+        Args:
+          host_key (str, optional): The address of the host.
+
+        Returns:
+          float: the number of slots.
+        """
+
+        if self.slots_per_host != "auto":
+            return self.slots_per_host
+        if host_key in self.host_slots:
+            return self.host_slots[host_key]
+        if self.host_slots:
+            return (sum(self.host_slots.values()) /
+                    float(len(self.host_slots)))
+        return self._get_cluster_cores()
+
+    def _get_cluster_cores(self):
+        """Return the number of hardware threads of the nodes of the cluster,
+        as given by nproc, or 1 if it is unknown."""
+
+        if self.cluster_cores is None:
+            try:
+                attrs = get_host_attributes(get_cluster_hosts(self.cluster)[0])
+                arch = attrs["architecture"]
+                self.cluster_cores = arch.get("nb_threads") or arch["nb_cores"]
+            except Exception as e:
+                logger.warn("Could not retrieve the number of cores of " +
+                            str(self.cluster) + ", assuming 1 slot per node: " +
+                            str(e))
+                self.cluster_cores = 1
+        return self.cluster_cores
+
+    def _get_remote_jar(self):
+        """Return the path of the experiment jar in the hosts."""
+
+        return os.path.join(self.remote_dir, os.path.basename(self.jar_file))
+
+    def create_thread(self, slot_info):
+        """Create the thread running the experiments of a slot.
+
+        Args:
+          slot_info (tuple): The slot as returned by get_host_slots.
+
+        Returns:
+          TestThread: the thread, not started.
+        """
+
+        (h, slot, slot_dir, cmd_prefix) = slot_info
+        profiler = None
+        if self.profile:
+            profiler = RemoteProfiler(slot_dir, self.profile_period,
+                                      self.profile_gc)
+        t = TestThread(h, self.comb_manager, self.stats_manager,
+                       self.scheduler, self.get_ds_cache(h),
+                       slot_dir, self._get_remote_jar(),
+                       self.use_worker, cmd_prefix, self.ds_prefetch,
+                       self.batch_confs, self.result_cache, profiler,
+                       self.get_host_confs(h))
+        t.name = "th_" + str(h.address).split(".")[0]
+        if self.slots_per_host != 1:
+            t.name += "_" + str(slot)
+        return t
+
+    def get_ds_cache(self, host):
+        """Return the dataset cache of the given host, shared by all its slots.
+
+        Args:
+          host (Host): The host.
+
+        Returns:
+          DatasetCache: the dataset cache of the host.
+        """
+
+        if host.address not in self.ds_caches:
+            self.ds_caches[host.address] = DatasetCache(
+                host, os.path.join(self.remote_dir, "ds-cache"),
+                self.ds_cache_budget)
+        return self.ds_caches[host.address]
+
+    def get_host_confs(self, host):
+        """Return the record of the properties files uploaded to the given
+        host, shared by all its slots.
+
+        Args:
+          host (Host): The host.
+
+        Returns:
+          HostConfs: the properties files of the host.
+        """
+
+        if host.address not in self.host_confs:
+            self.host_confs[host.address] = HostConfs(
+                os.path.join(self.remote_dir, "confs"))
+        return self.host_confs[host.address]
+
+    def get_host_slots(self, hosts):
+        """Return the experiment slots to be run in the given hosts. Each slot
+        has its own remote directory and, optionally, is pinned to a subset of
+        the cores or to a NUMA node.
+
+        Args:
+          hosts (list of Host): The hosts.
+
+        Returns:
+          list of tuple: (host, slot index, slot remote directory, command
+            prefix) for every slot.
+        """
+
+        if self.slots_per_host == 1 and self.slots_pinning == "none":
+            for h in hosts:
+                self.host_slots[h.address] = 1
+            return [(h, 0, self.remote_dir, "") for h in hosts]
+
+        # Retrieve number of cores and NUMA nodes of each host
+        get_topology = Remote("nproc; ls -d /sys/devices/system/node/node[0-9]*"
+                              " 2>/dev/null | wc -l", hosts)
+        get_topology.run()
+
+        slots = []
+        for p in get_topology.processes:
+            try:
+                (n_cores, n_numa) = [int(v) for v in p.stdout.split()]
+            except ValueError:
+                logger.warn("Could not retrieve the topology of " +
+                            str(p.host.address) + ", using a single slot")
+                (n_cores, n_numa) = (1, 1)
+            n_numa = max(n_numa, 1)
+
+            if self.slots_per_host == "auto":
+                n_slots = n_cores
+            else:
+                n_slots = self.slots_per_host
+
+            self.host_slots[p.host.address] = n_slots
+
+            if self.slots_pinning == "cores" and n_slots > n_cores:
+                logger.warn("Host " + str(p.host.address) + ": " +
+                            str(n_slots) + " slots for " + str(n_cores) +
+                            " cores, slots are not pinned to cores")
+
+            for slot in range(0, n_slots):
+                if n_slots == 1:
+                    slot_dir = self.remote_dir
+                else:
+                    slot_dir = os.path.join(self.remote_dir,
+                                            "slot-" + str(slot))
+
+                if self.slots_pinning == "cores" and n_slots <= n_cores:
+                    first = slot * n_cores // n_slots
+                    last = (slot + 1) * n_cores // n_slots - 1
+                    cmd_prefix = "taskset -c %i-%i " % (first, last)
+                elif self.slots_pinning == "numa":
+                    node = slot % n_numa
+                    cmd_prefix = ("numactl --cpunodebind=%i --membind=%i " %
+                                  (node, node))
+                else:
+                    cmd_prefix = ""
+
+                slots.append((p.host, slot, slot_dir, cmd_prefix))
+
+            logger.info("Host " + str(p.host.address) + ": " + str(n_cores) +
+                        " cores, " + str(n_numa) + " NUMA nodes, " +
+                        str(n_slots) + " slots")
+
+        # Create slot directories
+        slot_dirs = set(s[2] for s in slots if s[2] != self.remote_dir)
+        if slot_dirs:
+            mkdirs = Remote("mkdir -p " + " ".join(sorted(slot_dirs)), hosts)
+            mkdirs.run()
+
+        return slots
+
+    def is_setup_pipelined(self):
+        """Return whether hosts are set up independently in background, joining
+        the pool as soon as they are ready, instead of waiting for all of them.
+        """
+
+        return self.use_kadeploy and self.deploy_pipelined
 
     def setup(self):
         """Setup the cluster of hosts. Optionally deploy env and then copy the
-        executable jar to all the nodes.
+        executable jar to all the nodes. If the setup is pipelined, it is
+        performed afterwards by the HostPool.
         """
 
-        self.hosts = get_oar_job_nodes(self.oar_job_id, self.frontend)
+        with span("reservation_wait"):
+            jobs_hosts = [(job, get_oar_job_nodes(*job)) for job in self.jobs]
+        if self.is_setup_pipelined():
+            self.jobs_hosts = jobs_hosts
+            self.hosts = [h for (_, hosts) in jobs_hosts for h in hosts]
+            return len(self.hosts) != 0
+
+        ready = self.setup_hosts([h for (_, hosts) in jobs_hosts
+                                  for h in hosts])
+
+        self.jobs_hosts = [(job, [h for h in hosts if h in ready])
+                           for (job, hosts) in jobs_hosts]
+        self.hosts = ready
+
+        return len(self.hosts) != 0
+
+    def setup_hosts(self, hosts, deploy_tries=None, broadcast=True):
+        """Setup the given hosts. Optionally deploy env and then copy the
+        executable jar and, optionally, broadcast the datasets.
+
+        Args:
+          hosts (list of Host): The hosts to be set up.
+          deploy_tries (int, optional): Maximum number of tries of the
+            deployment (default: test.kadeploy.max_tries).
+          broadcast (bool, optional): Whether to broadcast the datasets, if
+            enabled by test.ds_broadcast (default: True).
+
+        Returns:
+          list of Host: the hosts ready to run experiments.
+        """
 
         if self.use_kadeploy:
-            (deployed, undeployed) = self.deploy_nodes()
-            return (len(deployed) != 0)
+            (deployed, undeployed) = self.deploy_nodes(
+                hosts, max_tries=deploy_tries or self.deploy_max_tries)
+            hosts = [h for h in hosts if h.address in deployed]
+            if len(hosts) == 0:
+                return []
 
-        copy_code = TaktukPut(self.hosts, [self.jar_file], self.remote_dir)
-        copy_code.run()
+        hosts = self.copy_jar(hosts)
+        if len(hosts) == 0:
+            return []
 
-        return True
+        if broadcast and self.ds_broadcast != "none":
+            self.broadcast_datasets(hosts)
+
+        return hosts
+
+    @traced("jar_copy")
+    def copy_jar(self, hosts):
+        """Copy the executable jar to the given hosts, skipping those which
+        already have an identical one.
+
+        Args:
+          hosts (list of Host): The hosts.
+
+        Returns:
+          list of Host: the hosts with the jar.
+        """
+
+        present = []
+        if self.artifact_cache:
+            present = self.artifact_cache.hosts_with_file(
+                hosts, self.jar_file, self._get_remote_jar())
+        missing = [h for h in hosts if h not in present]
+
+        start = time.time()
+        copied = set()
+        if missing:
+            copy_code = TaktukPut(missing, [self.jar_file], self.remote_dir)
+            copy_code.run()
+            copied = set(p.host.address for p in copy_code.processes if p.ok)
+        duration = time.time() - start
+
+        if self.artifact_cache:
+            self.artifact_cache.record("jar", len(present), len(copied),
+                                       duration)
+            logger.info("Jar already present in %i hosts, copied to %i hosts "
+                        "in %.1fs" % (len(present), len(copied), duration))
+
+        return [h for h in hosts if h in present or h.address in copied]
+
+    def get_env_id(self):
+        """Return the identifier of the environment to deploy, which is the
+        hash of the environment file, if available locally, or its name."""
 
-    def deploy_nodes(self, min_deployed_hosts=1, max_tries=3):
+        if self.kadeploy_env_file:
+            if os.path.exists(self.kadeploy_env_file):
+                return "file:" + file_hash(self.kadeploy_env_file)
+            return "file:" + self.kadeploy_env_file
+        return "name:" + str(self.kadeploy_env_name)
+
+    def get_broadcast_datasets(self):
+        """Return the local paths of the datasets to be broadcast to all the
+        hosts before the experiments start: all of them or only the hot ones,
+        i.e., those used by at least test.ds_broadcast.min_groups dataset
+        groups among the remaining combinations.
+
+        Returns:
+          list of str: the local paths of the datasets.
+        """
+
+        groups = {}
+        for comb in self.sweeper.iter_remaining():
+            (_, ds_params) = self.comb_manager.get_ds_class_params(comb)
+            groups.setdefault(ds_params["local_path"], set()).add(
+                self.comb_manager.get_ds_key(comb))
+
+        if self.ds_broadcast == "all":
+            return sorted(groups)
+        return sorted(path for (path, ds_keys) in groups.items()
+                      if len(ds_keys) >= self.ds_broadcast_min_groups)
+
+    @traced("ds_broadcast")
+    def broadcast_datasets(self, hosts):
+        """Copy the datasets to the dataset cache of all the given hosts at
+        once, through a tree-structured Taktuk transfer, optionally compressing
+        them in transit.
+
+        Args:
+          hosts (list of Host): The hosts.
+        """
+
+        for local_path in self.get_broadcast_datasets():
+            start = time.time()
+            ds_hash = file_hash(local_path)
+            name = os.path.basename(local_path)
+            remote_dir = os.path.join(self.remote_dir, "ds-cache", ds_hash)
+
+            mkdir = Remote("mkdir -p " + remote_dir, hosts)
+            mkdir.run()
+
+            if self.ds_broadcast_compress:
+                (fd, sent_path) = tempfile.mkstemp(".gz", "div_p2p-ds-", "/tmp")
+                os.close(fd)
+                src = open(local_path, "rb")
+                dst = gzip.open(sent_path, "wb")
+                shutil.copyfileobj(src, dst)
+                dst.close()
+                src.close()
+                remote_path = os.path.join(remote_dir, name + ".gz")
+            else:
+                sent_path = local_path
+                remote_path = os.path.join(remote_dir, name)
+
+            copy_ds = TaktukPut(hosts, [sent_path], remote_path)
+            copy_ds.run()
+            ok_hosts = [p.host for p in copy_ds.processes if p.ok]
+
+            if self.ds_broadcast_compress:
+                os.remove(sent_path)
+                uncompress = Remote("gunzip -f " + remote_path, ok_hosts)
+                uncompress.run()
+                ok_hosts = [p.host for p in uncompress.processes if p.ok]
+
+            register_threads = []
+            for h in ok_hosts:
+                t = Thread(target=self.get_ds_cache(h).register,
+                           args=(local_path, ds_hash))
+                register_threads.append(t)
+                t.start()
+            for t in register_threads:
+                t.join()
+
+            logger.info("Dataset " + name + " broadcast to " +
+                        str(len(ok_hosts)) + "/" + str(len(hosts)) +
+                        " hosts in %.1fs" % (time.time() - start))
+
+    @traced("deploy")
+    def deploy_nodes(self, hosts=None, min_deployed_hosts=1, max_tries=3):
         """Deploy nodes in the cluster. If the number of deployed nodes is less
         that the specified min, try again.
 
         Args:
+          hosts (list of Host, optional): The hosts to deploy (default: all the
+            hosts of the job).
           min_deployed_hosts (int, optional): minimum number of nodes to be
             deployed (default: 1).
           max_tries (int, optional): maximum number of tries to reach the
             minimum number of nodes (default: 3).
         """
 
-        logger.info("Deploying " + str(len(self.hosts)) + " nodes")
+        if hosts is None:
+            hosts = self.hosts
+
+        # Skip the hosts still running the environment
+        env_id = self.get_env_id()
+        present = []
+        if self.artifact_cache:
+            present = self.artifact_cache.hosts_with_env(hosts, env_id)
+            if present:
+                logger.info("Environment already deployed in " +
+                            str(len(present)) + " nodes")
+        if len(present) == len(hosts):
+            if self.artifact_cache:
+                self.artifact_cache.record("env", len(present), 0, 0)
+            return (set(h.address for h in hosts), set())
+        hosts = [h for h in hosts if h not in present]
+
+        logger.info("Deploying " + str(len(hosts)) + " nodes")
 
         def correct_deployment(deployed, undeployed):
             return len(deployed) >= min_deployed_hosts
 
         if self.kadeploy_env_file:
-            deployment = Deployment(self.hosts, env_file=self.kadeploy_env_file)
+            deployment = Deployment(hosts, env_file=self.kadeploy_env_file)
         elif self.kadeploy_env_name:
-            deployment = Deployment(self.hosts, env_name=self.kadeploy_env_name)
+            deployment = Deployment(hosts, env_name=self.kadeploy_env_name)
         else:
             logger.error("Neither env_file nor env_name are specified")
             raise ParameterException("Neither env_file nor env_name are "
                                      "specified")
 
+        start = time.time()
         (deployed, undeployed) = deploy(
             deployment,
+            check_deployed_command=not self.artifact_cache,
             num_tries=max_tries,
             check_enough_func=correct_deployment,
             out=True
         )
+        duration = time.time() - start
+
+        logger.info("%i deployed, %i undeployed in %.1fs" %
+                    (len(deployed), len(undeployed), duration))
 
-        logger.info("%i deployed, %i undeployed" % (len(deployed),
-                                                    len(undeployed)))
+        if self.artifact_cache:
+            self.artifact_cache.mark_env([h for h in hosts
+                                          if h.address in deployed], env_id)
+            self.artifact_cache.record("env", len(present), len(deployed),
+                                       duration)
+            deployed = set(deployed) | set(h.address for h in present)
 
         if not correct_deployment(deployed, undeployed):
             logger.error("It was not possible to deploy min number of hosts")
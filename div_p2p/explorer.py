@@ -0,0 +1,156 @@
+import itertools
+import json
+import os
+
+from execo_engine import logger
+from execo_engine.sweep import HashableDict
+
+
+def _to_number(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+class GridRefinementExplorer(object):
+    """This class explores the parameter space coarse-to-fine instead of
+    sweeping its full cartesian product.
+
+    Numeric parameters with at least three values are refined: they are first
+    explored on a coarse grid (every stride-th value, plus the last one) and,
+    once all the combinations of a level are done, the stride is halved and
+    only the neighbours of the best combinations are added. The other
+    parameters, e.g., datasets, are fully swept and the best combinations are
+    chosen separately for each of their values. The current stride is saved to
+    disk so that the exploration can be resumed."""
+
+    goals = ["max", "min"]
+
+    def __init__(self, parameters, metric, goal="max", top=3, fixed=None,
+                 state_path=None):
+        """Create a GridRefinementExplorer.
+
+        Args:
+          parameters (dict): The values of each parameter.
+          metric (str): The metric to optimize.
+          goal (str, optional): Whether to maximize or minimize the metric
+            (default: max).
+          top (int, optional): Number of best combinations refined for each
+            value of the non-refined parameters (default: 3).
+          fixed (list of str, optional): Parameters which are never refined,
+            even if numeric (default: none).
+          state_path (str, optional): The file where the state is saved
+            (default: not saved).
+        """
+
+        self.metric = metric
+        self.goal = goal
+        self.top = top
+        self.state_path = state_path
+
+        # Refined parameters have their values sorted numerically
+        self.values = {}
+        self.refined = []
+        for (pn, pv) in parameters.items():
+            numbers = [_to_number(v) for v in pv]
+            if len(pv) >= 3 and None not in numbers and \
+                    pn not in (fixed or []):
+                self.values[pn] = [v for (_, v) in sorted(zip(numbers, pv))]
+                self.refined.append(pn)
+            else:
+                self.values[pn] = list(pv)
+        self.fixed = [pn for pn in self.values if pn not in self.refined]
+
+        self.stride = 1
+        for pn in self.refined:
+            while (len(self.values[pn]) - 1) // (self.stride * 2) >= 2:
+                self.stride *= 2
+
+        if self.state_path and os.path.exists(self.state_path):
+            state_file = open(self.state_path)
+            self.stride = json.load(state_file)["stride"]
+            state_file.close()
+
+    def save(self):
+        """Save the state of the exploration, once the combinations of the
+        current level are saved."""
+
+        if self.state_path:
+            state_file = open(self.state_path, "w")
+            json.dump({"stride": self.stride}, state_file)
+            state_file.close()
+
+    def _grid_indexes(self, pn):
+        n = len(self.values[pn])
+        indexes = list(range(0, n, self.stride))
+        if indexes[-1] != n - 1:
+            indexes.append(n - 1)
+        return indexes
+
+    def get_initial(self):
+        """Return the combinations of the current level of the grid.
+
+        Returns:
+          list of HashableDict: the combinations.
+        """
+
+        names = self.fixed + self.refined
+        axes = ([self.values[pn] for pn in self.fixed] +
+                [[self.values[pn][i] for i in self._grid_indexes(pn)]
+                 for pn in self.refined])
+        combs = [HashableDict(zip(names, vs))
+                 for vs in itertools.product(*axes)]
+        logger.info("Exploring %i combinations with stride %i" %
+                    (len(combs), self.stride))
+        return combs
+
+    def refine(self, results):
+        """Halve the stride and return the neighbours of the best combinations
+        found so far. The new state is not saved until save() is called.
+
+        Args:
+          results (dict): The value of the metric for each combination done.
+
+        Returns:
+          list of HashableDict: the new combinations, empty if the exploration
+            is finished.
+        """
+
+        if self.stride <= 1 or not self.refined:
+            return []
+        self.stride //= 2
+
+        # Best combinations for each value of the non-refined parameters
+        groups = {}
+        for (comb, value) in results.items():
+            # Skip the experiments of other sweeps sharing the results
+            if value is None or not all(comb.get(pn) in pv for (pn, pv)
+                                        in self.values.items()):
+                continue
+            key = tuple(comb[pn] for pn in self.fixed)
+            groups.setdefault(key, []).append((value, comb))
+        if not groups:
+            logger.warn("No results of metric " + self.metric + " to refine "
+                        "the exploration")
+
+        new_combs = set()
+        for ranked in groups.values():
+            ranked.sort(key=lambda r: r[0], reverse=(self.goal == "max"))
+            for (_, comb) in ranked[:self.top]:
+                neighbours = []
+                for pn in self.refined:
+                    idx = self.values[pn].index(comb[pn])
+                    neighbours.append(sorted(set(
+                        self.values[pn][i]
+                        for i in [idx - self.stride, idx, idx + self.stride]
+                        if 0 <= i < len(self.values[pn]))))
+                for vs in itertools.product(*neighbours):
+                    new_comb = HashableDict(comb)
+                    new_comb.update(zip(self.refined, vs))
+                    new_combs.add(HashableDict(new_comb))
+
+        new_combs.difference_update(results)
+        logger.info("Refining with stride %i: %i new combinations" %
+                    (self.stride, len(new_combs)))
+        return list(new_combs)
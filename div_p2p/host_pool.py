@@ -0,0 +1,278 @@
+import time
+
+from threading import Event, RLock, Thread
+
+from execo.process import SshProcess
+from execo_engine import logger
+from execo_g5k.oar import get_oar_job_info
+
+
+class HostPool(object):
+    """This class supervises the threads running in the reserved hosts. Failed
+    threads are restarted if their host is still reachable, otherwise the host
+    is removed from the pool and its work is given to the others. Hosts may be
+    set up in background, each one joining the pool as soon as it is ready.
+    Optionally, new nodes are reserved and added to the pool while the
+    experiments go on, to replace lost hosts or to increase the capacity."""
+
+    def __init__(self, engine, check_period=30, target_nodes=None,
+                 elastic=False, max_restarts=2):
+        """Create a HostPool linked to the given engine.
+
+        Args:
+          engine (DivEngine): The engine to which the HostPool is linked to.
+          check_period (int, optional): Number of seconds between checks of the
+            jobs and the capacity of the pool (default: 30).
+          target_nodes (int, optional): Number of hosts the pool should have
+            (default: the number of nodes of the engine).
+          elastic (bool, optional): Whether to reserve new nodes when the pool
+            has less hosts than the target (default: False).
+          max_restarts (int, optional): Maximum number of times a failed slot is
+            restarted in a reachable host (default: 2).
+        """
+
+        self.__lock = RLock()
+        self.engine = engine
+        self.check_period = check_period
+        self.target_nodes = target_nodes
+        self.elastic = elastic
+        self.max_restarts = max_restarts
+
+        self.threads = []
+        self.hosts = {}
+        self.host_jobs = {}
+        self.dead_hosts = set()
+        self.restarts = {}
+        self.handled = set()
+        self.reserving = False
+        self.reserve_thread = None
+        self.stop_event = Event()
+        self.setting_up = 0
+        self.pending_hosts = set()
+
+    def add_hosts(self, hosts, job=None):
+        """Add the given hosts to the pool and start their threads.
+
+        Args:
+          hosts (list of Host): The hosts, already set up.
+          job (tuple, optional): The (oar_job_id, frontend) of the hosts.
+        """
+
+        if not hosts:
+            return
+
+        slots = self.engine.get_host_slots(hosts)
+        with self.__lock:
+            for h in hosts:
+                self.hosts[h.address] = h
+                self.host_jobs[h.address] = job
+                self.engine.scheduler.add_host(h.address)
+            for slot_info in slots:
+                self._start_thread(slot_info)
+
+        logger.info("Hosts added to the pool: " +
+                    str([h.address for h in hosts]))
+
+    def setup_hosts(self, hosts, job=None):
+        """Set up the given hosts in background, in batches of
+        test.kadeploy.batch_size hosts. Each batch joins the pool as soon as it
+        is ready, and its hosts that could not be set up are retried up to
+        test.kadeploy.max_tries times before being given up. Datasets are not
+        broadcast to them.
+
+        Args:
+          hosts (list of Host): The hosts, not yet set up.
+          job (tuple, optional): The (oar_job_id, frontend) of the hosts.
+        """
+
+        if self.engine.ds_broadcast != "none":
+            logger.warn("Datasets are not broadcast to hosts set up in "
+                        "background, they are copied to each host on demand")
+
+        batch_size = self.engine.deploy_batch_size
+        for i in range(0, len(hosts), batch_size):
+            with self.__lock:
+                self.setting_up += 1
+                self.pending_hosts.update(h.address
+                                          for h in hosts[i:i + batch_size])
+            t = Thread(target=self._setup_batch,
+                       args=(hosts[i:i + batch_size], job))
+            t.daemon = True
+            t.start()
+
+    def _setup_batch(self, hosts, job):
+        max_tries = self.engine.deploy_max_tries
+        try:
+            for n_try in range(max_tries):
+                try:
+                    # A broadcast per batch would be as slow as copying the
+                    # datasets to each host on demand
+                    ready = self.engine.setup_hosts(hosts, deploy_tries=1,
+                                                    broadcast=False)
+                except Exception as e:
+                    logger.warn("Could not set up hosts " +
+                                str([h.address for h in hosts]) + ": " +
+                                str(e))
+                    ready = []
+                self.add_hosts(ready, job)
+                with self.__lock:
+                    self.pending_hosts.difference_update(h.address
+                                                         for h in ready)
+
+                hosts = [h for h in hosts if h not in ready]
+                if not hosts:
+                    return
+                if n_try + 1 < max_tries:
+                    logger.info("Retrying setup of hosts " +
+                                str([h.address for h in hosts]) + " (" +
+                                str(n_try + 2) + "/" + str(max_tries) + ")")
+
+            for h in hosts:
+                self._remove_host(h.address, "setup failed")
+        finally:
+            with self.__lock:
+                self.pending_hosts.difference_update(h.address for h in hosts)
+                self.setting_up -= 1
+
+    def _start_thread(self, slot_info):
+        t = self.engine.create_thread(slot_info)
+        t.slot_info = slot_info
+        self.threads.append(t)
+        t.start()
+
+    def get_live_hosts(self):
+        """Return the addresses of the hosts of the pool not known to be dead.
+        """
+
+        with self.__lock:
+            return [hk for hk in self.hosts if hk not in self.dead_hosts]
+
+    def _is_reachable(self, host):
+        check = SshProcess("true", host)
+        check.run(timeout=60)
+        return check.ok
+
+    def _remove_host(self, host_key, reason):
+        with self.__lock:
+            if host_key in self.dead_hosts:
+                return
+            self.dead_hosts.add(host_key)
+        logger.warn("Removing host " + host_key + " from the pool: " + reason)
+        self.engine.scheduler.release_host(host_key)
+
+        # Its combinations in progress are given to the other hosts
+        with self.__lock:
+            threads = [t for t in self.threads
+                       if t.slot_info[0].address == host_key and t.is_alive()]
+        for t in threads:
+            t.stop()
+
+    def _check_threads(self):
+        for t in list(self.threads):
+            if t.is_alive() or t in self.handled:
+                continue
+            self.handled.add(t)
+            if not t.failed:
+                continue
+
+            (host, slot) = t.slot_info[0:2]
+            if host.address in self.dead_hosts:
+                continue
+
+            key = (host.address, slot)
+            restarts = self.restarts.get(key, 0)
+            if restarts < self.max_restarts and self._is_reachable(host):
+                self.restarts[key] = restarts + 1
+                logger.info("Restarting failed thread " + t.name)
+                with self.__lock:
+                    self._start_thread(t.slot_info)
+            else:
+                self._remove_host(host.address, "thread " + t.name + " failed")
+
+    def _check_jobs(self):
+        jobs = set(j for j in self.host_jobs.values() if j is not None)
+        for (job_id, frontend) in jobs:
+            state = get_oar_job_info(job_id, frontend).get('state')
+            if state in ['Error', 'Terminated']:
+                for (hk, job) in self.host_jobs.items():
+                    if job == (job_id, frontend):
+                        self._remove_host(hk, "job " + str(job_id) + " is " +
+                                          str(state))
+
+    def _grow(self):
+        target = self.target_nodes or self.engine.n_nodes
+        missing = target - len(self.get_live_hosts())
+        with self.__lock:
+            # Hosts being set up will join the pool
+            missing -= len(self.pending_hosts)
+            if missing <= 0 or self.reserving or \
+                    self.engine.scheduler.get_num_remaining() == 0:
+                return
+            self.reserving = True
+
+        pipelined = self.engine.is_setup_pipelined()
+
+        def reserve():
+            try:
+                for (job, hosts) in self.engine.add_reservation(
+                        missing, setup=not pipelined,
+                        stop_event=self.stop_event):
+                    if self.stop_event.is_set():
+                        break
+                    if pipelined:
+                        self.setup_hosts(hosts, job)
+                    else:
+                        self.add_hosts(hosts, job)
+            except Exception as e:
+                logger.warn("Could not add nodes to the pool: " + str(e))
+            finally:
+                with self.__lock:
+                    self.reserving = False
+
+        logger.info("Reserving " + str(missing) + " more nodes")
+        self.reserve_thread = Thread(target=reserve)
+        self.reserve_thread.daemon = True
+        self.reserve_thread.start()
+
+    def run(self, jobs_hosts, pending_setup=False):
+        """Start the threads in the given hosts and supervise them until there
+        is no more work or no live thread.
+
+        Args:
+          jobs_hosts (list of tuple): The (oar_job_id, frontend) of each job
+            and its initial hosts.
+          pending_setup (bool, optional): Whether the hosts still have to be
+            set up (default: False, they are already set up).
+        """
+
+        for (job, hosts) in jobs_hosts:
+            if pending_setup:
+                self.setup_hosts(hosts, job)
+            else:
+                self.add_hosts(hosts, job)
+
+        last_check = time.time()
+        while True:
+            time.sleep(1)
+
+            self._check_threads()
+            with self.__lock:
+                # Threads of dead hosts may be stuck in their SSH sessions
+                alive = [t for t in self.threads if t.is_alive() and
+                         t.slot_info[0].address not in self.dead_hosts]
+                waiting = self.reserving or self.setting_up > 0
+            if not alive and (not waiting or
+                              self.engine.scheduler.is_finished()):
+                break
+
+            if time.time() - last_check > self.check_period:
+                last_check = time.time()
+                self._check_jobs()
+                if self.elastic:
+                    self._grow()
+
+        # Wait for the reservation in progress, if any, so that its jobs are
+        # known when they are deleted
+        self.stop_event.set()
+        if self.reserve_thread is not None:
+            self.reserve_thread.join()
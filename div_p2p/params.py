@@ -0,0 +1,191 @@
+import itertools
+import math
+import operator
+import re
+
+from execo_engine.sweep import HashableDict
+
+
+_RANGE_RE = re.compile(r"^(range|logrange)\((.*)\)$")
+
+
+def _to_number(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _format_number(x):
+    if x == math.floor(x) and abs(x) < 1e15:
+        return str(int(x))
+    return "%.10g" % x
+
+
+def _split(string):
+    """Split a list of values by the commas which are not within
+    parentheses."""
+
+    tokens = []
+    depth = 0
+    start = 0
+    for (idx, char) in enumerate(string):
+        if char == "(":
+            depth += 1
+        elif char == ")":
+            depth -= 1
+        elif char == "," and depth == 0:
+            tokens.append(string[start:idx])
+            start = idx + 1
+    tokens.append(string[start:])
+    return tokens
+
+
+def expand_range(kind, args):
+    """Return the values of a range.
+
+    Args:
+      kind (str): Either range, for an arithmetic progression, or logrange,
+        for a geometric one.
+      args (str): The start, the stop (included) and optionally the step
+        (default: 1) or the factor (default: 2), separated by commas.
+
+    Returns:
+      list of str: the values.
+    """
+
+    try:
+        numbers = [float(a) for a in args.split(",")]
+    except ValueError:
+        raise ValueError("Arguments of " + kind + " should be numbers: " +
+                         args)
+    if len(numbers) not in [2, 3]:
+        raise ValueError(kind + " takes a start, a stop and optionally a " +
+                         ("step" if kind == "range" else "factor"))
+
+    values = []
+    if kind == "range":
+        (start, stop, step) = (numbers + [1])[:3]
+        if step <= 0:
+            raise ValueError("The step of range should be positive")
+        n = int(math.floor((stop - start) / step + 1e-9))
+        values = [start + i * step for i in range(n + 1)]
+    else:
+        (start, stop, factor) = (numbers + [2])[:3]
+        if start <= 0 or factor <= 1:
+            raise ValueError("The start of logrange should be positive and "
+                             "its factor greater than 1")
+        x = start
+        while x <= stop * (1 + 1e-9):
+            values.append(x)
+            x *= factor
+    return [_format_number(x) for x in values]
+
+
+def parse_values(string):
+    """Parse a comma-separated list of parameter values, in which ranges can
+    be given as range(start, stop[, step]) or logrange(start, stop[, factor]).
+    Duplicate values are removed, keeping the first occurrence.
+
+    Args:
+      string (str): The list of values.
+
+    Returns:
+      list of str: the distinct values, in order.
+    """
+
+    values = []
+    seen = set()
+    for token in _split(string):
+        token = token.strip()
+        match = _RANGE_RE.match(token)
+        if match:
+            tokens = expand_range(match.group(1), match.group(2))
+        else:
+            tokens = [token]
+        for value in tokens:
+            if value not in seen:
+                seen.add(value)
+                values.append(value)
+    return values
+
+
+class Constraint(object):
+    """This class represents a comparison between a parameter and another one
+    or a value, e.g., "xp.n_peers >= xp.n_neighbours", which the combinations
+    to be tested must satisfy. Numbers are compared numerically and other
+    values as strings."""
+
+    operators = [("==", operator.eq), ("!=", operator.ne),
+                 ("<=", operator.le), (">=", operator.ge),
+                 ("<", operator.lt), (">", operator.gt)]
+
+    def __init__(self, expression, param_names):
+        """Parse a constraint.
+
+        Args:
+          expression (str): The comparison.
+          param_names (list of str): The names of the parameters.
+        """
+
+        self.expression = expression.strip()
+        self.param_names = set(param_names)
+
+        for (symbol, func) in self.operators:
+            if symbol in self.expression:
+                (left, right) = self.expression.split(symbol, 1)
+                self.left = left.strip()
+                self.right = right.strip()
+                self.func = func
+                break
+        else:
+            raise ValueError("No comparison in constraint " + self.expression)
+
+        if self.left not in self.param_names and \
+                self.right not in self.param_names:
+            raise ValueError("Constraint " + self.expression + " does not "
+                             "refer to any parameter")
+
+    def _value(self, operand, comb):
+        if operand in self.param_names:
+            return comb[operand]
+        return operand
+
+    def accepts(self, comb):
+        """Return whether the given combination satisfies the constraint.
+
+        Args:
+          comb (dict): The combination.
+
+        Returns:
+          bool: True if it satisfies the constraint.
+        """
+
+        left = self._value(self.left, comb)
+        right = self._value(self.right, comb)
+        (left_n, right_n) = (_to_number(left), _to_number(right))
+        if left_n is not None and right_n is not None:
+            return self.func(left_n, right_n)
+        return self.func(str(left), str(right))
+
+    def __str__(self):
+        return self.expression
+
+
+def iter_combinations(parameters, constraints=None):
+    """Generate lazily the combinations of the values of the parameters which
+    satisfy all the constraints.
+
+    Args:
+      parameters (dict): The values of each parameter.
+      constraints (list of Constraint, optional): The constraints.
+
+    Returns:
+      generator of HashableDict: the combinations.
+    """
+
+    names = sorted(parameters)
+    for values in itertools.product(*[parameters[pn] for pn in names]):
+        comb = HashableDict(zip(names, values))
+        if not constraints or all(c.accepts(comb) for c in constraints):
+            yield comb
@@ -0,0 +1,183 @@
+import bisect
+import math
+import time
+
+from execo.time_utils import format_date, get_seconds
+from execo_engine import logger
+from execo_g5k.planning import get_planning, compute_slots
+
+
+class PlannerException(Exception):
+    pass
+
+
+class ReservationPlanner(object):
+    """This class chooses when and how many nodes to reserve, possibly across
+    several clusters. The planning of the clusters is fetched once per horizon
+    and its slots are indexed by start time and number of free nodes. The slot
+    is chosen according to a policy:
+
+      - earliest: the first slot with the wanted number of nodes.
+      - makespan: the slot in which the campaign would finish soonest, given an
+        estimation of its total work, possibly with less nodes, but enough to
+        finish it within the walltime if possible.
+      - min_nodes: the first slot with the minimum number of nodes needed to
+        finish the total work within the walltime.
+    """
+
+    policies = ["earliest", "makespan", "min_nodes"]
+
+    def __init__(self, elements, walltime, out_of_chart=False,
+                 horizon=3 * 24 * 3600, max_horizon=6 * 7 * 24 * 3600):
+        """Create a ReservationPlanner.
+
+        Args:
+          elements (dict): The clusters in which nodes are reserved, with the
+            weight of each of them in the distribution of the nodes.
+          walltime (str): The walltime of the reservation.
+          out_of_chart (bool, optional): Whether to allow reservations outside
+            the charter (default: False).
+          horizon (int, optional): Number of seconds of planning fetched at
+            once (default: 3 days).
+          max_horizon (int, optional): Number of seconds after which the
+            search is abandoned (default: 6 weeks).
+        """
+
+        self.elements = elements
+        self.walltime = walltime
+        self.out_of_chart = out_of_chart
+        self.horizon = horizon
+        self.max_horizon = max_horizon
+
+        self.now = None
+        self.endtime = None
+        self.slots = []
+        self.starts = []
+        self.free = {}
+        self.total_free = []
+        self.max_free = []
+
+    def _fetch(self, endtime):
+        logger.info("Fetching planning until %s", format_date(endtime))
+        planning = get_planning(elements=list(self.elements.keys()),
+                                starttime=self.now,
+                                endtime=endtime,
+                                out_of_chart=self.out_of_chart)
+        self._set_slots(compute_slots(planning, self.walltime), endtime)
+
+    def _set_slots(self, slots, endtime):
+        self.endtime = endtime
+
+        # Index slots by start time and by the maximum number of free nodes in
+        # all the elements seen until each slot
+        self.slots = sorted(slots, key=lambda s: s[0])
+        self.starts = [s[0] for s in self.slots]
+        self.free = {}
+        for element in self.elements:
+            self.free[element] = [s[2].get(element, 0) for s in self.slots]
+        self.total_free = [sum(self.free[e][idx] for e in self.elements)
+                           for idx in range(len(self.slots))]
+        self.max_free = []
+        current = 0
+        for n in self.total_free:
+            current = max(current, n)
+            self.max_free.append(current)
+
+    def _first_fitting(self, n_nodes):
+        """Return the index of the first slot with at least n_nodes free."""
+
+        idx = bisect.bisect_left(self.max_free, n_nodes)
+        if idx < len(self.slots):
+            return idx
+        return None
+
+    def _distribute(self, idx, n_nodes):
+        """Distribute n_nodes among the elements according to their weights
+        and the free nodes of each of them in the given slot."""
+
+        total_weight = float(sum(self.elements.values()))
+        resources = {}
+        for (element, weight) in self.elements.items():
+            resources[element] = min(self.free[element][idx],
+                                     int(n_nodes * weight / total_weight))
+
+        # Nodes not assigned because of rounding or lack of free nodes
+        missing = n_nodes - sum(resources.values())
+        for element in sorted(self.elements, key=lambda e: -self.elements[e]):
+            extra = min(self.free[element][idx] - resources[element], missing)
+            resources[element] += extra
+            missing -= extra
+
+        return dict((e, n) for (e, n) in resources.items() if n > 0)
+
+    def _best_makespan(self, min_nodes, max_nodes, total_work):
+        best = None
+        for (idx, start) in enumerate(self.starts):
+            n_nodes = min(self.total_free[idx], max_nodes)
+            if n_nodes < min_nodes:
+                continue
+            finish = start + float(total_work) / n_nodes
+            if best is None or finish < best[0]:
+                best = (finish, idx, n_nodes)
+        return best
+
+    def find_slot(self, n_nodes, policy="earliest", total_work=None,
+                  min_nodes=1):
+        """Find the slot in which nodes should be reserved.
+
+        Args:
+          n_nodes (int): The wanted (maximum) number of nodes.
+          policy (str, optional): The policy (default: earliest).
+          total_work (float, optional): The estimated work of the campaign,
+            in node-seconds. Required by the makespan and min_nodes policies.
+          min_nodes (int, optional): The minimum number of nodes (default: 1).
+
+        Returns:
+          tuple: the start date of the slot and the number of nodes to reserve
+            in each element.
+        """
+
+        if policy not in self.policies:
+            raise PlannerException("Unknown reservation policy " + policy)
+        if policy != "earliest" and not total_work:
+            logger.warn("No estimation of the total work, using the earliest "
+                        "slot policy")
+            policy = "earliest"
+
+        if policy in ["makespan", "min_nodes"]:
+            # Nodes needed to finish the total work within the walltime
+            fit_nodes = int(math.ceil(float(total_work) /
+                                      get_seconds(self.walltime)))
+            if fit_nodes > n_nodes:
+                logger.warn("The total work needs %i nodes to fit in the "
+                            "walltime, only %i are reserved", fit_nodes,
+                            n_nodes)
+
+        if policy == "min_nodes":
+            n_nodes = min(n_nodes, max(min_nodes, fit_nodes))
+            policy = "earliest"
+        elif policy == "makespan":
+            min_nodes = min(n_nodes, max(min_nodes, fit_nodes))
+
+        self.now = int(time.time() + 60)
+        endtime = self.now + self.horizon
+        while endtime - self.now <= self.max_horizon:
+            self._fetch(endtime)
+
+            if policy == "earliest":
+                idx = self._first_fitting(n_nodes)
+                if idx is not None:
+                    return (self.starts[idx], self._distribute(idx, n_nodes))
+            else:
+                best = self._best_makespan(min_nodes, n_nodes, total_work)
+                if best is not None:
+                    (finish, idx, nodes) = best
+                    logger.info("Estimated end of the campaign: %s",
+                                format_date(finish))
+                    return (self.starts[idx], self._distribute(idx, nodes))
+
+            logger.info('Not enough nodes found before %s, increasing time '
+                        'window', format_date(endtime))
+            endtime += self.horizon
+
+        return (None, {})
@@ -0,0 +1,140 @@
+import os
+
+from execo.process import SshProcess
+from execo_engine import logger
+
+
+# Prefix of the names of the resource metrics, to tell them from those of the
+# tests
+RESOURCE_PREFIX = "res."
+
+
+class RemoteProfiler(object):
+    """This class profiles the resources used by each execution of the jar in
+    a host. The java command is started in background while a sampler reads
+    periodically its CPU time, peak RSS and disk I/O in /proc, together with
+    the network traffic of the host and, optionally, the time spent in GC
+    pauses according to its unified GC log (Java 9 or later). The summary of
+    a run is written in a remote file and retrieved afterwards."""
+
+    def __init__(self, remote_dir="/tmp", period=1, gc=False):
+        """Create a RemoteProfiler.
+
+        Args:
+          remote_dir (str, optional): The remote directory of the profile and
+            GC log files (default: /tmp).
+          period (float, optional): Number of seconds between samples
+            (default: 1).
+          gc (bool, optional): Whether to log and measure the GC pauses
+            (default: False).
+        """
+
+        self.period = period
+        self.gc = gc
+        self.profile_path = os.path.join(remote_dir, "div_p2p-profile")
+        self.gc_log_path = os.path.join(remote_dir, "div_p2p-gc.log")
+
+    def wrap(self, java_cmd):
+        """Return a shell command running the given java command with the
+        sampler. It only uses double quotes, so that it can be embedded in a
+        single-quoted command.
+
+        Args:
+          java_cmd (str): The java command, starting by java or by a command
+            which executes it, e.g., taskset.
+
+        Returns:
+          str: the wrapped command, with the exit code of the java command.
+        """
+
+        if self.gc:
+            java_cmd = java_cmd.replace(
+                "java ", "java -Xlog:gc:file=" + self.gc_log_path + " ", 1)
+
+        sample_path = self.profile_path + ".sample"
+        net = ("awk \"NR>2{r+=\\$2;t+=\\$10}END{print r,t}\" /proc/net/dev")
+        sampler = (
+            "while kill -0 $pid 2>/dev/null; do "
+            "c=$(cut -d\" \" -f14,15 /proc/$pid/stat 2>/dev/null); "
+            "h=$(awk \"/VmHWM/{print \\$2}\" /proc/$pid/status 2>/dev/null); "
+            "i=$(awk \"/^(read|write)_bytes/{printf \\\"%s \\\", \\$2}\" "
+            "/proc/$pid/io 2>/dev/null); "
+            "[ -n \"$c\" ] && echo \"$c $h $i\" > " + sample_path + "; "
+            "sleep " + str(self.period) + "; "
+            "done")
+
+        gc_time = "0"
+        if self.gc:
+            gc_time = ("$(awk \"/Pause/{v=\\$NF; sub(/ms/,\\\"\\\",v); s+=v}"
+                       "END{print s/1000}\" " + self.gc_log_path +
+                       " 2>/dev/null)")
+
+        return ("rm -f " + sample_path + " " + self.gc_log_path + "; "
+                "t0=$(date +%s.%N); n0=$(" + net + "); " +
+                java_cmd + " & pid=$!; "
+                "(" + sampler + ") < /dev/null > /dev/null 2>&1 & spid=$!; "
+                "wait $pid; rc=$?; kill $spid 2>/dev/null; "
+                "t1=$(date +%s.%N); n1=$(" + net + "); "
+                "echo \"$t0 $t1 $(getconf CLK_TCK) $n0 $n1 " + gc_time +
+                " $(cat " + sample_path + " 2>/dev/null)\" > " +
+                self.profile_path + "; "
+                "(exit $rc)")
+
+    def parse(self, content):
+        """Parse the summary of a run.
+
+        Args:
+          content (str): The content of the profile file.
+
+        Returns:
+          dict: the resource metrics of the run.
+        """
+
+        values = content.split()
+        try:
+            (t0, t1, clk_tck, rx0, tx0, rx1, tx1, gc_time) = \
+                [float(v) for v in values[:8]]
+            sample = [float(v) for v in values[8:]]
+        except ValueError:
+            return {}
+
+        wall = max(t1 - t0, 1e-6)
+        resources = {"wall_time": wall,
+                     "net_rx_bytes": rx1 - rx0,
+                     "net_tx_bytes": tx1 - tx0}
+        if len(sample) >= 2:
+            cpu_time = (sample[0] + sample[1]) / clk_tck
+            resources["cpu_time"] = cpu_time
+            resources["cpu_usage"] = cpu_time / wall
+        if len(sample) >= 3:
+            resources["peak_rss"] = sample[2] * 1024
+        if len(sample) >= 5:
+            resources["read_bytes"] = sample[3]
+            resources["write_bytes"] = sample[4]
+        if self.gc:
+            resources["gc_time"] = gc_time
+
+        return dict((RESOURCE_PREFIX + k, v) for (k, v) in resources.items())
+
+    def fetch(self, host, connection_params=None):
+        """Retrieve and remove the summary of the last run in a host.
+
+        Args:
+          host (Host): The host.
+          connection_params (dict, optional): The connection parameters.
+
+        Returns:
+          dict: the resource metrics of the run, empty if not available.
+        """
+
+        fetch = SshProcess("cat " + self.profile_path + " && rm -f " +
+                           self.profile_path, host,
+                           connection_params=connection_params)
+        fetch.nolog_exit_code = True
+        fetch.nolog_error = True
+        fetch.run()
+        if not fetch.ok:
+            logger.warn("Could not retrieve the profile of the run in " +
+                        str(host.address))
+            return {}
+        return self.parse(fetch.stdout)
@@ -0,0 +1,252 @@
+import json
+import os
+import time
+
+from collections import deque
+from threading import Event, RLock, Thread
+
+try:  # Import Python 3 package, turn back to Python 2 if fails
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+
+from execo.time_utils import format_date, format_duration
+from execo_engine import logger
+
+
+class ProgressMonitor(object):
+    """This class keeps rolling statistics of the progress of the campaign:
+    experiments finished per hour, utilization of each host and an estimation
+    of the remaining time, computed from the cost estimated by the scheduler
+    for the remaining combinations and the rate at which it is done. They are
+    periodically written in a status file, logged and, optionally, served as
+    JSON by a local HTTP endpoint. It is thread-safe."""
+
+    def __init__(self, engine, path="status.json", period=60, window=3600,
+                 http_port=None):
+        """Create a ProgressMonitor linked to the given engine.
+
+        Args:
+          engine (DivEngine): The engine to which the monitor is linked to.
+          path (str, optional): The path of the status file
+            (default: status.json).
+          period (int, optional): Number of seconds between updates of the
+            status (default: 60).
+          window (int, optional): Number of seconds of the window of the rolling
+            statistics (default: 3600).
+          http_port (int, optional): The local port of the HTTP endpoint
+            (default: disabled).
+        """
+
+        self.__lock = RLock()
+        self.engine = engine
+        self.path = path
+        self.period = period
+        self.window = window
+        self.http_port = http_port
+
+        self.start_time = None
+        self.deadline = None
+        self.n_done = 0
+        self.n_reps = 0
+        # (end time, duration, estimated cost) of the experiments finished
+        # within the window
+        self.recent = deque()
+        self.host_stats = {}
+
+        self.status = {}
+        self.stop_event = Event()
+        self.thread = None
+        self.server = None
+
+    def start(self):
+        """Start updating the status in background."""
+
+        self.start_time = time.time()
+        self.stop_event.clear()
+        self.thread = Thread(target=self._update_loop)
+        self.thread.daemon = True
+        self.thread.start()
+
+        if self.http_port:
+            self._start_server()
+
+    def _start_server(self):
+        monitor = self
+
+        class StatusHandler(BaseHTTPRequestHandler):
+
+            def do_GET(self):
+                content = json.dumps(monitor.get_status(), indent=2).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(content)))
+                self.end_headers()
+                self.wfile.write(content)
+
+            def log_message(self, *args):
+                pass
+
+        try:
+            self.server = HTTPServer(("127.0.0.1", self.http_port),
+                                     StatusHandler)
+        except Exception as e:
+            logger.warn("Could not start the status endpoint on port " +
+                        str(self.http_port) + ": " + str(e))
+            return
+        server_thread = Thread(target=self.server.serve_forever)
+        server_thread.daemon = True
+        server_thread.start()
+        logger.info("Status served in http://127.0.0.1:" +
+                    str(self.http_port))
+
+    def stop(self):
+        """Stop updating the status, writing it a last time."""
+
+        self.stop_event.set()
+        if self.thread:
+            self.thread.join()
+            self.thread = None
+        if self.server:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+    def add_xp(self, host, run_times, cost=None):
+        """Record a finished experiment.
+
+        Args:
+          host (Host): The host where it was executed, or None if it was not.
+          run_times (list of float): The duration of each repetition.
+          cost (float, optional): The cost estimated by the scheduler.
+        """
+
+        now = time.time()
+        duration = sum(run_times or [])
+        with self.__lock:
+            self.n_done += 1
+            self.n_reps += len(run_times or [])
+            if host is None:
+                return
+            self.recent.append((now, duration, cost))
+            stats = self.host_stats.setdefault(host.address,
+                                               {"runs": 0, "busy": 0.0,
+                                                "first": now - duration})
+            stats["runs"] += len(run_times or [])
+            stats["busy"] += duration
+
+    def _update_loop(self):
+        while not self.stop_event.wait(self.period):
+            self.update()
+        self.update()
+
+    def _get_remaining(self):
+        """Return the number of combinations not finished and their estimated
+        cost, None if unknown, from the counters of the scheduler or, before
+        it is built, of the sweeper."""
+
+        scheduler = self.engine.scheduler
+        if scheduler is not None:
+            return (scheduler.get_num_remaining() +
+                    scheduler.get_num_running(),
+                    scheduler.get_remaining_cost())
+        sweeper = self.engine.sweeper
+        return (sweeper.get_num_remaining() + sweeper.get_num_inprogress(),
+                None)
+
+    def update(self):
+        """Compute the status, write it in the status file and log it."""
+
+        try:
+            status = self._compute_status()
+        except Exception:
+            logger.exception("Could not compute the status of the campaign")
+            return
+
+        with self.__lock:
+            self.status = status
+
+        try:
+            temp_path = self.path + ".tmp"
+            status_file = open(temp_path, "w")
+            json.dump(status, status_file, indent=2)
+            status_file.close()
+            os.rename(temp_path, self.path)
+        except Exception:
+            logger.exception("Could not write the status of the campaign in " +
+                             self.path)
+
+        line = ("Progress: %i experiments done, %i remaining, %.1f per hour" %
+                (status["done"], status["remaining"],
+                 status["xps_per_hour"]))
+        if status["eta"] is not None:
+            line += ", ETA " + format_duration(status["eta"])
+            if status["fits_walltime"] is False:
+                line += " (beyond the walltime)"
+        logger.info(line)
+
+    def _compute_status(self):
+        now = time.time()
+        (remaining, remaining_cost) = self._get_remaining()
+
+        with self.__lock:
+            while self.recent and self.recent[0][0] < now - self.window:
+                self.recent.popleft()
+            elapsed = now - self.start_time
+            window = min(self.window, elapsed)
+
+            # Rolling throughput and number of slots busy on average
+            xps_per_hour = (3600.0 * len(self.recent) / window
+                            if window > 0 else 0.0)
+            parallelism = (sum(d for (_, d, _) in self.recent) / window
+                           if window > 0 else 0.0)
+            # Estimated cost done per second
+            cost_rate = (sum(c for (_, _, c) in self.recent if c) / window
+                         if window > 0 else 0.0)
+
+            hosts = {}
+            for (address, stats) in sorted(self.host_stats.items()):
+                host_elapsed = ((now - stats["first"]) *
+                                self.engine.get_slots_per_node(address))
+                hosts[address] = {
+                    "runs": stats["runs"],
+                    "busy": round(stats["busy"], 1),
+                    "utilization": (round(stats["busy"] / host_elapsed, 3)
+                                    if host_elapsed > 0 else None)}
+            n_done = self.n_done
+            n_reps = self.n_reps
+
+        eta = None
+        if remaining_cost is not None and cost_rate > 0:
+            eta = remaining_cost / cost_rate
+        elif xps_per_hour > 0:
+            eta = 3600.0 * remaining / xps_per_hour
+
+        fits_walltime = None
+        if eta is not None and self.deadline is not None:
+            fits_walltime = now + eta <= self.deadline
+
+        return {"time": format_date(now),
+                "elapsed": round(elapsed, 1),
+                "done": n_done,
+                "repetitions": n_reps,
+                "remaining": remaining,
+                "xps_per_hour": round(xps_per_hour, 2),
+                "parallelism": round(parallelism, 2),
+                "hosts": hosts,
+                "eta": round(eta, 1) if eta is not None else None,
+                "eta_date": format_date(now + eta) if eta is not None
+                else None,
+                "deadline": format_date(self.deadline) if self.deadline
+                else None,
+                "fits_walltime": fits_walltime}
+
+    def get_status(self):
+        """Return the last status computed.
+
+        Returns:
+          dict: the status of the campaign.
+        """
+
+        with self.__lock:
+            return dict(self.status)
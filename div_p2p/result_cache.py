@@ -0,0 +1,208 @@
+import hashlib
+import os
+import shutil
+import tempfile
+
+from threading import RLock
+
+from execo_engine import logger
+
+from div_p2p.ds_cache import file_hash
+
+
+class ResultCache(object):
+    """This class memoizes the outputs of the experiments in a local directory
+    shared by all the campaigns. Entries are addressed by a hash of the jar, of
+    the content of the dataset, of the properties of the test, except those
+    which only locate the dataset, and of the cluster and environment where it
+    ran, as the metrics include timings, so that an experiment already run by
+    any campaign is not run again. Entries are written atomically and, if a
+    maximum size is given, the least recently used ones are removed beyond it.
+    It is thread-safe."""
+
+    # Properties which do not change the result of a test
+    ignored_props = ["ds.config", "ds.class.path"]
+
+    def __init__(self, path=os.path.join("~", ".div_p2p", "result_cache"),
+                 bypass=False, max_size=None):
+        """Create a ResultCache.
+
+        Args:
+          path (str, optional): The directory of the cache
+            (default: ~/.div_p2p/result_cache).
+          bypass (bool, optional): Whether to ignore the cached results, which
+            are still updated with the new ones (default: False).
+          max_size (int, optional): The maximum number of bytes of the cache
+            (default: unlimited).
+        """
+
+        self.__lock = RLock()
+        self.path = path
+        self.bypass = bypass
+        self.max_size = max_size
+        self.jar_path = None
+        self.env_id = None
+
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.time_saved = 0.0
+
+    def get_key(self, ds_path, params, cluster=None):
+        """Return the key of an experiment.
+
+        Args:
+          ds_path (str): The local path of the dataset.
+          params (dict): The properties of the test.
+          cluster (str, optional): The cluster where it runs.
+
+        Returns:
+          str: the hexadecimal key.
+        """
+
+        content = "jar=" + file_hash(self.jar_path) + "\n"
+        content += "ds=" + file_hash(ds_path) + "\n"
+        content += "cluster=" + str(cluster) + "\n"
+        content += "env=" + str(self.env_id) + "\n"
+        content += "".join(str(key) + "=" + str(params[key]) + "\n"
+                           for key in sorted(params)
+                           if key not in self.ignored_props)
+        return hashlib.sha1(content.encode()).hexdigest()
+
+    def _entry_path(self, key):
+        return os.path.join(os.path.expanduser(self.path), key[:2], key)
+
+    def get(self, key, min_reps=1):
+        """Return the cached results of an experiment.
+
+        Args:
+          key (str): The key of the experiment.
+          min_reps (int, optional): The minimum number of repetitions needed
+            (default: 1).
+
+        Returns:
+          list of tuple: the local path of a copy of the output and the
+            duration of each repetition, or None if they are not cached or the
+            cache is bypassed.
+        """
+
+        entry_path = self._entry_path(key)
+        results = None
+        if not self.bypass and os.path.exists(entry_path):
+            results = self._read(entry_path, min_reps)
+
+        with self.__lock:
+            if results is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self.time_saved += sum(r[1] for r in results)
+        return results
+
+    def _read(self, entry_path, min_reps):
+        """Copy the outputs of an entry, or return None if it has not enough
+        repetitions or it was replaced or removed meanwhile."""
+
+        results = []
+        try:
+            times_path = os.path.join(entry_path, "run_times")
+            times_file = open(times_path)
+            run_times = [float(l) for l in times_file if l.strip()]
+            times_file.close()
+            if len(run_times) < min_reps:
+                return None
+            for (rep, run_time) in enumerate(run_times):
+                (fd, out_path) = tempfile.mkstemp("", "div_p2p-cached-", "/tmp")
+                os.close(fd)
+                results.append((out_path, run_time))
+                shutil.copy(os.path.join(entry_path, str(rep)), out_path)
+            # Recently used entries are the last to be pruned
+            os.utime(times_path, None)
+        except (IOError, OSError, ValueError):
+            for (out_path, _) in results:
+                if os.path.exists(out_path):
+                    os.remove(out_path)
+            return None
+        return results
+
+    def put(self, key, out_paths, run_times):
+        """Store the results of an experiment, replacing the cached ones.
+
+        Args:
+          key (str): The key of the experiment.
+          out_paths (list of str): The local paths of the outputs of the
+            repetitions. They are copied.
+          run_times (list of float): The duration of each repetition.
+        """
+
+        entry_path = self._entry_path(key)
+        parent_dir = os.path.dirname(entry_path)
+        temp_dir = None
+        try:
+            if not os.path.exists(parent_dir):
+                os.makedirs(parent_dir)
+            temp_dir = tempfile.mkdtemp("", ".tmp-" + key + "-", parent_dir)
+            for (rep, out_path) in enumerate(out_paths):
+                shutil.copy(out_path, os.path.join(temp_dir, str(rep)))
+            times_file = open(os.path.join(temp_dir, "run_times"), "w")
+            times_file.write("".join(str(t) + "\n" for t in run_times))
+            times_file.close()
+
+            # The old entry is moved away first, so that it is never seen
+            # partially removed
+            if os.path.exists(entry_path):
+                old_dir = tempfile.mkdtemp("", ".old-" + key + "-", parent_dir)
+                os.rename(entry_path, os.path.join(old_dir, key))
+                shutil.rmtree(old_dir, ignore_errors=True)
+            os.rename(temp_dir, entry_path)
+        except (IOError, OSError) as e:
+            # Another campaign may have stored the same experiment
+            logger.warn("Could not cache results in " + entry_path + ": " +
+                        str(e))
+            if temp_dir:
+                shutil.rmtree(temp_dir, ignore_errors=True)
+            return
+
+        with self.__lock:
+            self.stores += 1
+            if self.max_size is not None:
+                self._prune()
+
+    def _prune(self):
+        """Remove the least recently used entries until the cache fits in its
+        maximum size."""
+
+        root = os.path.expanduser(self.path)
+        entries = []
+        total = 0
+        for (dir_path, _, file_names) in os.walk(root):
+            if "run_times" not in file_names or \
+                    os.path.basename(dir_path).startswith("."):
+                continue
+            try:
+                size = sum(os.path.getsize(os.path.join(dir_path, f))
+                           for f in file_names)
+                last_used = os.path.getmtime(os.path.join(dir_path,
+                                                          "run_times"))
+            except OSError:
+                continue
+            entries.append((last_used, size, dir_path))
+            total += size
+
+        for (_, size, dir_path) in sorted(entries):
+            if total <= self.max_size:
+                break
+            shutil.rmtree(dir_path, ignore_errors=True)
+            total -= size
+
+    def log_stats(self):
+        """Log the hits and misses of the cache."""
+
+        with self.__lock:
+            line = ("Result cache: %i hits, %i misses, %i results stored" %
+                    (self.hits, self.misses, self.stores))
+            if self.time_saved:
+                line += ", about %.1fs of tests saved" % self.time_saved
+            if self.bypass:
+                line += " (bypassed)"
+            logger.info(line)
@@ -0,0 +1,421 @@
+import json
+import sqlite3
+import zlib
+
+from threading import Thread
+
+from execo_engine import logger
+
+try:
+    from Queue import Queue, Empty
+except ImportError:
+    from queue import Queue, Empty
+
+
+def convert_number(string):
+    """Convert the given string to an int or a float, if possible.
+
+    Args:
+      string (str): The string.
+
+    Returns:
+      the number or the string itself.
+    """
+
+    try:
+        return int(string)
+    except (TypeError, ValueError):
+        pass
+    try:
+        return float(string)
+    except (TypeError, ValueError):
+        return string
+
+
+def parse_output(content):
+    """Parse the metrics of the output of a test, a CSV whose first line
+    contains the names of the metrics and whose last line contains their final
+    values.
+
+    Args:
+      content (str): The output of the test.
+
+    Returns:
+      dict: the value of each metric.
+    """
+
+    lines = [l for l in content.splitlines() if l.strip()]
+    if len(lines) < 2:
+        return {}
+    names = [k.strip() for k in lines[0].split(",")]
+    values = [convert_number(v.strip()) for v in lines[-1].split(",")]
+    return dict(zip(names, values))
+
+
+# Columns of the experiments table which are not parameters
+_XP_COLUMNS = ["comb_id", "cluster", "n_reps", "run_time"]
+
+
+def _quote(name):
+    return '"' + name.replace('"', '""') + '"'
+
+
+class ResultsStore(object):
+    """This class stores the results of the tests in a single SQLite database:
+    the properties of the datasets, the parameters of each experiment in its
+    own indexed column, the parsed metrics and, optionally, the compressed
+    output of each of its repetitions, and the summary of the metrics over the
+    repetitions.
+
+    Writes are queued and performed by a background thread, which commits them
+    in groups. Queries can be done on a store opened only for reading."""
+
+    def __init__(self, path, params=None, commit_size=500, commit_period=2,
+                 keep_output=True):
+        """Open a results store.
+
+        Args:
+          path (str): The path of the database.
+          params (list of str, optional): The names of the parameters of the
+            experiments. If given, the store is opened for writing and created
+            if needed.
+          commit_size (int, optional): Maximum number of writes per commit
+            (default: 500).
+          commit_period (float, optional): Maximum number of seconds a write
+            waits before being committed (default: 2).
+          keep_output (bool, optional): Whether to store the output of the
+            tests besides their metrics (default: True).
+        """
+
+        self.path = path
+        self.params = params
+        self.commit_size = commit_size
+        self.commit_period = commit_period
+        self.keep_output = keep_output
+
+        self.queue = None
+        self.writer = None
+        self.error = None
+
+        if params is not None:
+            # Create the schema synchronously so that errors are raised here
+            conn = sqlite3.connect(self.path)
+            self._create_schema(conn)
+            conn.close()
+
+            self.queue = Queue()
+            self.writer = Thread(target=self._write_loop)
+            self.writer.daemon = True
+            self.writer.start()
+
+    def _create_schema(self, conn):
+        conn.execute("CREATE TABLE IF NOT EXISTS datasets ("
+                     "ds_id INTEGER PRIMARY KEY, ds_class TEXT, "
+                     "properties TEXT)")
+        conn.execute("CREATE TABLE IF NOT EXISTS xps ("
+                     "comb_id INTEGER, cluster TEXT, n_reps INTEGER, "
+                     "run_time REAL)")
+        conn.execute("CREATE TABLE IF NOT EXISTS metrics ("
+                     "comb_id INTEGER, rep INTEGER, metric TEXT, value)")
+        conn.execute("CREATE TABLE IF NOT EXISTS outputs ("
+                     "comb_id INTEGER, rep INTEGER, content BLOB)")
+        conn.execute("CREATE TABLE IF NOT EXISTS summaries ("
+                     "comb_id INTEGER, metric TEXT, n INTEGER, mean REAL, "
+                     "variance REAL, min, max, median REAL, "
+                     "PRIMARY KEY (comb_id, metric))")
+
+        # Stores created before repetitions were kept separately
+        for table in ["metrics", "outputs"]:
+            columns = [r[1] for r in
+                       conn.execute("PRAGMA table_info(" + table + ")")]
+            if "rep" not in columns:
+                conn.execute("ALTER TABLE " + table +
+                             " ADD COLUMN rep INTEGER DEFAULT 0")
+
+        columns = [r[1] for r in conn.execute("PRAGMA table_info(xps)")]
+        if "n_reps" not in columns:
+            conn.execute("ALTER TABLE xps ADD COLUMN n_reps INTEGER")
+        if "run_time" not in columns:
+            conn.execute("ALTER TABLE xps ADD COLUMN run_time REAL")
+        for pn in self.params:
+            if pn not in columns:
+                conn.execute("ALTER TABLE xps ADD COLUMN " + _quote(pn))
+            conn.execute("CREATE INDEX IF NOT EXISTS " +
+                         _quote("xps_" + pn) + " ON xps(" + _quote(pn) + ")")
+
+        conn.execute("CREATE INDEX IF NOT EXISTS xps_comb_id ON xps(comb_id)")
+        conn.execute("CREATE INDEX IF NOT EXISTS metrics_comb_id "
+                     "ON metrics(comb_id, metric)")
+        conn.execute("CREATE INDEX IF NOT EXISTS outputs_comb_id "
+                     "ON outputs(comb_id)")
+        conn.commit()
+
+    # Writing
+
+    def _write_loop(self):
+        conn = sqlite3.connect(self.path)
+        stop = False
+        while not stop:
+            ops = [self.queue.get()]
+            try:
+                while len(ops) < self.commit_size:
+                    ops.append(self.queue.get(timeout=self.commit_period))
+            except Empty:
+                pass
+
+            try:
+                if None in ops:
+                    stop = True
+                self._write(conn, [op for op in ops if op is not None])
+            finally:
+                for _ in ops:
+                    self.queue.task_done()
+        conn.close()
+
+    def _write(self, conn, ops):
+        """Commit the given writes in a single transaction or, if one of them
+        fails, one at a time, so that only the failing ones are lost."""
+
+        try:
+            for op in ops:
+                conn.execute(*op)
+            conn.commit()
+            return
+        except Exception:
+            conn.rollback()
+
+        for op in ops:
+            try:
+                conn.execute(*op)
+                conn.commit()
+            except Exception as e:
+                conn.rollback()
+                logger.error("Could not write in " + self.path + ": " + str(e))
+                self.error = e
+
+    def _put(self, sql, args):
+        if self.error is not None:
+            # Reported once, the writer keeps going
+            (error, self.error) = (self.error, None)
+            raise error
+        self.queue.put((sql, args))
+
+    def add_ds(self, ds_id, ds_class, properties):
+        """Add a dataset.
+
+        Args:
+          ds_id (int): The dataset identifier.
+          ds_class (str): The class of the dataset.
+          properties (dict): The properties of the dataset class.
+        """
+
+        self._put("INSERT OR REPLACE INTO datasets (ds_id, ds_class, "
+                  "properties) VALUES (?, ?, ?)",
+                  (ds_id, ds_class, json.dumps(properties, sort_keys=True,
+                                               default=str)))
+
+    def add_xp(self, comb_id, cluster, params, n_reps=1, run_time=None):
+        """Add an experiment.
+
+        Args:
+          comb_id (int): The experiment combination identifier.
+          cluster (str): The cluster where it was executed.
+          params (dict): The parameters of the experiment.
+          n_reps (int, optional): The number of repetitions run (default: 1).
+          run_time (float, optional): The total duration of the repetitions.
+        """
+
+        columns = _XP_COLUMNS + self.params
+        self._put("INSERT INTO xps (" + ", ".join(_quote(c) for c in columns) +
+                  ") VALUES (" + ", ".join("?" for _ in columns) + ")",
+                  [comb_id, cluster, n_reps, run_time] +
+                  [params.get(pn) for pn in self.params])
+
+    def remove_xp(self, comb_id):
+        """Remove the results of an experiment, e.g., those partially stored by
+        an interrupted execution.
+
+        Args:
+          comb_id (int): The experiment combination identifier.
+        """
+
+        for table in ["xps", "metrics", "outputs", "summaries"]:
+            self._put("DELETE FROM " + table + " WHERE comb_id = ?",
+                      (comb_id,))
+
+    def add_rep(self, comb_id, rep, metrics, output=None):
+        """Add the results of a repetition of an experiment.
+
+        Args:
+          comb_id (int): The experiment combination identifier.
+          rep (int): The index of the repetition.
+          metrics (dict): The value of each metric.
+          output (str, optional): The output of the test.
+        """
+
+        for (metric, value) in metrics.items():
+            # Columns are named, as rep is the last one in older stores
+            self._put("INSERT INTO metrics (comb_id, rep, metric, value) "
+                      "VALUES (?, ?, ?, ?)",
+                      (comb_id, rep, metric, value))
+        if output is not None and self.keep_output:
+            self._put("INSERT INTO outputs (comb_id, rep, content) "
+                      "VALUES (?, ?, ?)",
+                      (comb_id, rep,
+                       sqlite3.Binary(zlib.compress(output.encode()))))
+
+    def set_summary(self, comb_id, summary):
+        """Set the summary of the metrics of an experiment over its
+        repetitions.
+
+        Args:
+          comb_id (int): The experiment combination identifier.
+          summary (dict): The statistics of each metric, as returned by
+            OnlineAggregator.
+        """
+
+        for (metric, st) in summary.items():
+            self._put("INSERT OR REPLACE INTO summaries (comb_id, metric, n, "
+                      "mean, variance, min, max, median) VALUES "
+                      "(?, ?, ?, ?, ?, ?, ?, ?)",
+                      (comb_id, metric, st["n"], st["mean"], st["variance"],
+                       st["min"], st["max"], st["median"]))
+
+    def flush(self):
+        """Wait until all the queued writes are committed."""
+
+        if self.queue is not None:
+            self.queue.join()
+
+    def close(self):
+        """Commit the queued writes and stop the writer."""
+
+        if self.writer is not None:
+            self.queue.put(None)
+            self.writer.join()
+            self.writer = None
+
+    # Queries
+
+    def _connect(self):
+        return sqlite3.connect(self.path)
+
+    def get_params(self):
+        """Return the names of the parameters of the experiments."""
+
+        conn = self._connect()
+        columns = [r[1] for r in conn.execute("PRAGMA table_info(xps)")]
+        conn.close()
+        return [c for c in columns if c not in _XP_COLUMNS]
+
+    def get_datasets(self):
+        """Return the datasets.
+
+        Returns:
+          dict: the class and the properties of each dataset, by identifier.
+        """
+
+        conn = self._connect()
+        datasets = {}
+        for (ds_id, ds_class, properties) in conn.execute(
+                "SELECT ds_id, ds_class, properties FROM datasets"):
+            datasets[ds_id] = (ds_class, json.loads(properties))
+        conn.close()
+        return datasets
+
+    def get_xps(self, fixed_params=None):
+        """Return the experiments with the given values of the parameters.
+
+        Args:
+          fixed_params (dict, optional): The values of some parameters.
+
+        Returns:
+          tuple: the names of the columns (comb_id, cluster, n_reps, run_time
+            and the parameters) and the list of rows.
+        """
+
+        columns = _XP_COLUMNS + self.get_params()
+        sql = "SELECT " + ", ".join(_quote(c) for c in columns) + " FROM xps"
+        args = []
+        if fixed_params:
+            sql += " WHERE " + " AND ".join(_quote(k) + " = ?"
+                                            for k in fixed_params)
+            args = list(fixed_params.values())
+        sql += " ORDER BY comb_id"
+
+        conn = self._connect()
+        rows = [list(r) for r in conn.execute(sql, args)]
+        conn.close()
+        return (columns, rows)
+
+    def _where_comb_ids(self, sql, comb_ids):
+        if comb_ids is None:
+            return (sql, [])
+        comb_ids = list(comb_ids)
+        return (sql + " WHERE comb_id IN (" +
+                ", ".join("?" for _ in comb_ids) + ")", comb_ids)
+
+    def get_metrics(self, comb_ids=None):
+        """Return the metrics of each repetition of the given experiments.
+
+        Args:
+          comb_ids (list of int, optional): The experiment combination
+            identifiers (default: all).
+
+        Returns:
+          dict: the value of each metric, by comb_id and repetition.
+        """
+
+        (sql, args) = self._where_comb_ids(
+            "SELECT comb_id, rep, metric, value FROM metrics", comb_ids)
+
+        conn = self._connect()
+        metrics = {}
+        for (comb_id, rep, metric, value) in conn.execute(sql, args):
+            metrics.setdefault(comb_id, {}).setdefault(rep, {})[metric] = value
+        conn.close()
+        return metrics
+
+    def get_summaries(self, comb_ids=None, stat="mean"):
+        """Return a statistic of the metrics of the given experiments over
+        their repetitions.
+
+        Args:
+          comb_ids (list of int, optional): The experiment combination
+            identifiers (default: all).
+          stat (str, optional): The statistic: n, mean, variance, min, max or
+            median (default: mean).
+
+        Returns:
+          dict: the statistic of each metric, by comb_id.
+        """
+
+        if stat not in ["n", "mean", "variance", "min", "max", "median"]:
+            raise ValueError("Unknown statistic " + stat)
+        (sql, args) = self._where_comb_ids(
+            "SELECT comb_id, metric, " + stat + " FROM summaries", comb_ids)
+
+        conn = self._connect()
+        summaries = {}
+        for (comb_id, metric, value) in conn.execute(sql, args):
+            summaries.setdefault(comb_id, {})[metric] = value
+        conn.close()
+        return summaries
+
+    def get_output(self, comb_id):
+        """Return the stored outputs of the repetitions of the given
+        experiment.
+
+        Args:
+          comb_id (int): The experiment combination identifier.
+
+        Returns:
+          list of str: the outputs.
+        """
+
+        conn = self._connect()
+        outputs = [zlib.decompress(bytes(r[0])).decode() for r in conn.execute(
+            "SELECT content FROM outputs WHERE comb_id = ? ORDER BY rep",
+            (comb_id,))]
+        conn.close()
+        return outputs
@@ -0,0 +1,409 @@
+import heapq
+import time
+
+from threading import RLock
+
+from execo_engine import logger
+
+
+class DatasetScheduler(object):
+    """This class distributes the remaining combinations among the hosts. The
+    combinations are partitioned by dataset and whole dataset groups are
+    assigned to each host, so that datasets are copied as few times as possible.
+    Hosts only take combinations from groups assigned to other hosts once their
+    own groups are exhausted. Both groups and the combinations within them are
+    given longest first according to their estimated cost, so that long
+    experiments do not delay the end of the campaign.
+
+    Optionally, when there is no more work to distribute, idle hosts launch
+    speculative copies of combinations running for longer than a percentile of
+    the observed runtimes. The first copy to finish wins and the others are
+    aborted. It is thread-safe."""
+
+    def __init__(self, comb_manager, cost_func=None, slots_per_host=1,
+                 speculation=False, spec_percentile=90, spec_max_copies=1,
+                 spec_min_samples=5):
+        """Create a DatasetScheduler for the given combination manager.
+
+        Args:
+          comb_manager (CombinationManager): The combination manager whose
+            sweeper contains the combinations to be scheduled.
+          cost_func (function, optional): A function returning the estimated
+            cost of a combination (default: its expected duration).
+          slots_per_host (int, optional): The number of combinations executed
+            in parallel in each host (default: 1).
+          speculation (bool, optional): Whether to launch speculative copies of
+            straggler combinations (default: False).
+          spec_percentile (float, optional): The percentile of the observed
+            runtimes after which a running combination is a straggler
+            (default: 90).
+          spec_max_copies (int, optional): The maximum number of speculative
+            copies of a combination (default: 1).
+          spec_min_samples (int, optional): The minimum number of observed
+            runtimes before launching copies (default: 5).
+        """
+
+        self.__lock = RLock()
+        self.comb_manager = comb_manager
+        if cost_func:
+            self.cost_func = cost_func
+        else:
+            self.cost_func = comb_manager.get_expected_cost
+        self.slots_per_host = slots_per_host
+
+        self.groups = {}
+        self.host_groups = {}
+        self.group_owner = {}
+        self.num_remaining = 0
+        self.costs = {}
+        self.remaining_cost = 0.0
+
+        self.start_time = None
+        self.end_time = None
+        self.estimated_makespan = None
+
+        self.speculation = speculation
+        self.spec_percentile = spec_percentile
+        self.spec_max_copies = spec_max_copies
+        self.spec_min_samples = spec_min_samples
+
+        self.running = {}
+        self.finished = set()
+        self.runtimes = []
+        self.speculative_runs = 0
+        self.speculative_wins = 0
+
+    def build(self, hosts):
+        """Partition the remaining combinations by dataset and assign the
+        groups to the given hosts, balancing their estimated cost. All the
+        remaining combinations are held in memory until they are executed, as
+        ordering them by cost requires them all.
+
+        Args:
+          hosts (list of Host): The hosts executing the combinations.
+        """
+
+        with self.__lock:
+            self.groups = {}
+            for comb in self.comb_manager.sweeper.iter_remaining():
+                ds_key = self.comb_manager.get_ds_key(comb)
+                self.groups.setdefault(ds_key, []).append(comb)
+            self.num_remaining = sum(len(g) for g in self.groups.values())
+
+            # Combinations are popped from the end, so the longest goes last
+            self.costs = {}
+            for combs in self.groups.values():
+                for comb in combs:
+                    self.costs[comb] = self.cost_func(comb)
+                combs.sort(key=lambda c: self.costs[c])
+            self.remaining_cost = sum(self.costs.values())
+
+            # Longest groups first, each one to the least loaded host
+            costs = {}
+            for (ds_key, combs) in self.groups.items():
+                costs[ds_key] = sum(self.costs[c] for c in combs)
+
+            host_keys = sorted(set(h.address for h in hosts))
+            self.host_groups = dict((hk, []) for hk in host_keys)
+            self.group_owner = {}
+            loads = [(0, hk) for hk in host_keys]
+            for ds_key in sorted(costs, key=lambda k: -costs[k]):
+                (load, hk) = heapq.heappop(loads)
+                self.host_groups[hk].append(ds_key)
+                self.group_owner[ds_key] = hk
+                heapq.heappush(loads, (load + costs[ds_key], hk))
+
+            self.start_time = time.time()
+            self.end_time = None
+            self.estimated_makespan = \
+                max([l[0] for l in loads] or [0]) / float(self.slots_per_host)
+
+            logger.info("Scheduled " + str(self.num_remaining) +
+                        " combinations in " + str(len(self.groups)) +
+                        " dataset groups")
+            for (load, hk) in sorted(loads, key=lambda l: l[1]):
+                logger.info("Host " + hk + ": " +
+                            str(len(self.host_groups[hk])) +
+                            " dataset groups, estimated cost " + str(load))
+
+    def add_host(self, host_key):
+        """Add a host to the scheduler. New hosts take work from the groups of
+        the others.
+
+        Args:
+          host_key (str): The address of the host.
+        """
+
+        with self.__lock:
+            self.host_groups.setdefault(host_key, [])
+
+    def release_host(self, host_key):
+        """Remove a host from the scheduler. Its groups remain available to be
+        taken by the other hosts.
+
+        Args:
+          host_key (str): The address of the host.
+        """
+
+        with self.__lock:
+            for gk in self.host_groups.pop(host_key, []):
+                self.group_owner[gk] = None
+
+    def get_next(self, host_key, ds_key=None, runner=None):
+        """Return the next combination to be executed in the given host. It is
+        taken from the dataset group currently in use in the thread, then from
+        the next group assigned to the host and finally from the group of
+        another host with the highest number of remaining combinations. If
+        there are none and speculation is enabled, a straggler combination may
+        be returned.
+
+        Args:
+          host_key (str): The address of the host.
+          ds_key (tuple, optional): The dataset key of the group currently in
+            use in the thread.
+          runner (TestThread, optional): The thread which will execute the
+            combination. It must provide an abort(comb) method.
+
+        Returns:
+          dict: the combination or None if there is no more combinations.
+        """
+
+        with self.__lock:
+            while True:
+                ds_key = self._select_group(host_key, ds_key)
+                if ds_key is None:
+                    comb = self._get_straggler(host_key)
+                    if comb is not None:
+                        self.running[comb][runner] = (host_key, time.time(),
+                                                      True)
+                        self.speculative_runs += 1
+                        logger.info("Host " + host_key + " launches a "
+                                    "speculative copy of " + str(comb))
+                    return comb
+
+                comb = self.groups[ds_key].pop()
+                self.num_remaining -= 1
+
+                # Mark as in progress in the sweeper
+                if self.comb_manager.sweeper.claim(comb):
+                    self.running[comb] = {runner: (host_key, time.time(),
+                                                   False)}
+                    return comb
+                self.remaining_cost -= self.costs.get(comb, 0)
+
+    def _get_straggler(self, host_key):
+        if not self.speculation or \
+                len(self.runtimes) < max(self.spec_min_samples, 1):
+            return None
+
+        runtimes = sorted(self.runtimes)
+        idx = int(round((len(runtimes) - 1) * self.spec_percentile / 100.0))
+        threshold = runtimes[min(max(idx, 0), len(runtimes) - 1)]
+
+        now = time.time()
+        candidates = []
+        for (comb, runners) in self.running.items():
+            if not runners or len(runners) > self.spec_max_copies:
+                continue
+            if host_key in [r[0] for r in runners.values()]:
+                continue
+            elapsed = now - min(r[1] for r in runners.values())
+            if elapsed > threshold:
+                candidates.append((elapsed, comb))
+
+        if not candidates:
+            return None
+        return max(candidates, key=lambda c: c[0])[1]
+
+    def _select_group(self, host_key, ds_key):
+        if ds_key is not None and self.groups.get(ds_key):
+            return ds_key
+
+        own_groups = self.host_groups.setdefault(host_key, [])
+        while own_groups:
+            if self.groups.get(own_groups[0]):
+                return own_groups[0]
+            own_groups.pop(0)
+
+        # Steal: first a group not started by its owner, then the costliest
+        candidates = []
+        for (gk, combs) in self.groups.items():
+            if combs:
+                owner_groups = self.host_groups.get(self.group_owner.get(gk))
+                started = bool(owner_groups) and owner_groups[0] == gk
+                cost = sum(self.costs.get(c, 0) for c in combs)
+                candidates.append((started, -cost, gk))
+        if not candidates:
+            return None
+
+        (started, _, gk) = min(candidates, key=lambda c: c[:2])
+        owner = self.group_owner.get(gk)
+        if not started:
+            if owner in self.host_groups and gk in self.host_groups[owner]:
+                self.host_groups[owner].remove(gk)
+            own_groups.append(gk)
+            self.group_owner[gk] = host_key
+        logger.info("Host " + host_key + " takes work from dataset group of " +
+                    str(owner))
+        return gk
+
+    def peek_next_group(self, host_key, ds_key=None):
+        """Return a combination of the next dataset group to be executed in the
+        given host after the current one, without removing it.
+
+        Args:
+          host_key (str): The address of the host.
+          ds_key (tuple, optional): The dataset key of the group currently in
+            use in the thread.
+
+        Returns:
+          dict: a combination of the next group or None if unknown.
+        """
+
+        with self.__lock:
+            for gk in self.host_groups.get(host_key, []):
+                if gk != ds_key and self.groups.get(gk):
+                    return self.groups[gk][-1]
+            return None
+
+    def get_group(self, ds_key):
+        """Return the combinations of the given dataset group not yet given to
+        any host, without removing them.
+
+        Args:
+          ds_key (tuple): The dataset key of the group.
+
+        Returns:
+          list of dict: the combinations.
+        """
+
+        with self.__lock:
+            return list(self.groups.get(ds_key, []))
+
+    def finish(self, comb, runner=None):
+        """Notify that the given runner finished the combination. Only the
+        first runner of a combination is told to keep its results, the other
+        copies being aborted.
+
+        Args:
+          comb (dict): The combination.
+          runner (TestThread, optional): The thread which executed it.
+
+        Returns:
+          bool: whether the results of the runner should be kept.
+        """
+
+        with self.__lock:
+            runners = self.running.get(comb)
+            if not runners or runner not in runners:
+                return False
+            del self.running[comb]
+            self.finished.add(comb)
+            self.remaining_cost -= self.costs.get(comb, 0)
+
+            (_, start, speculative) = runners.pop(runner)
+            self.end_time = time.time()
+            self.runtimes.append(self.end_time - start)
+            if speculative:
+                self.speculative_wins += 1
+
+        for other in runners:
+            if other is not None:
+                other.abort(comb)
+        return True
+
+    def done(self, comb):
+        """Mark the given combination as done.
+
+        Args:
+          comb (dict): The combination.
+        """
+
+        self.comb_manager.sweeper.done(comb)
+
+    def cancel(self, comb, runner=None):
+        """Cancel the execution of the given combination by the runner. Unless
+        other copies are still running, it is returned to its group. It does
+        nothing if the runner is not executing it.
+
+        Args:
+          comb (dict): The combination.
+          runner (TestThread, optional): The thread which was executing it.
+        """
+
+        with self.__lock:
+            runners = self.running.get(comb)
+            if not runners or runner not in runners:
+                # Already cancelled or not executed by the runner
+                return
+            del runners[runner]
+            if runners or comb in self.finished:
+                return
+            self.running.pop(comb, None)
+
+            self.comb_manager.sweeper.cancel(comb)
+            ds_key = self.comb_manager.get_ds_key(comb)
+            self.groups.setdefault(ds_key, []).append(comb)
+            self.num_remaining += 1
+
+    def is_finished(self):
+        """Return whether the threads asking for work can stop, i.e., there are
+        no combinations left and, with speculation, none still running."""
+
+        with self.__lock:
+            if self.num_remaining > 0:
+                return False
+            return not (self.speculation and self.running)
+
+    def get_num_remaining(self):
+        """Return the number of combinations not yet given to any host."""
+
+        return self.num_remaining
+
+    def get_num_running(self):
+        """Return the number of combinations being executed."""
+
+        return len(self.running)
+
+    def get_remaining_cost(self):
+        """Return the estimated cost of the combinations not yet finished, in
+        units of the cost function.
+
+        Returns:
+          float: the cost.
+        """
+
+        return self.remaining_cost
+
+    def get_cost(self, comb):
+        """Return the estimated cost of the given combination, in units of
+        the cost function, or None if it was not scheduled.
+
+        Args:
+          comb (dict): The combination.
+        """
+
+        return self.costs.get(comb)
+
+    def get_makespan(self):
+        """Return the makespan estimated when the combinations were assigned,
+        in units of the cost function, and the actual one, in seconds, from
+        the assignment to the last combination finished.
+
+        Returns:
+          tuple: the estimated and the actual makespan, each one None if
+            unknown.
+        """
+
+        with self.__lock:
+            if self.end_time is None:
+                return (self.estimated_makespan, None)
+            return (self.estimated_makespan, self.end_time - self.start_time)
+
+    def log_stats(self):
+        """Log the speculative executions performed."""
+
+        if self.speculation:
+            logger.info(str(self.speculative_runs) + " speculative copies "
+                        "launched, " + str(self.speculative_wins) + " of them "
+                        "finished first")
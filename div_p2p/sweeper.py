@@ -0,0 +1,200 @@
+import os
+import pickle
+
+from threading import RLock
+
+
+class CombinationSweeper(object):
+    """This class is the queue of the combinations of a campaign. The
+    combinations are generated each time they are iterated over, and only the
+    identifiers of those done and the combinations in progress are kept, so
+    that the sweeper itself does not hold the parameter space. Note that the
+    DatasetScheduler holds the remaining combinations of each batch it
+    schedules. Counters give the number of combinations in each state in
+    constant time.
+
+    Combinations can also be added explicitly, e.g., by an explorer. They are
+    saved in a file, from which they are loaded when the campaign is resumed.
+    The combinations done are not persisted, as they are rebuilt from the
+    stored results. It is thread-safe."""
+
+    def __init__(self, id_func, generator=None, path=None):
+        """Create a CombinationSweeper.
+
+        Args:
+          id_func (function): A function returning the identifier of a
+            combination.
+          generator (function, optional): A function returning a new iterator
+            over the combinations of the parameter space (default: none).
+          path (str, optional): The file where the combinations added
+            explicitly are saved (default: they are not saved).
+        """
+
+        self.__lock = RLock()
+        self.id_func = id_func
+        self.generator = generator
+        self.path = path
+
+        self.added = []
+        self.added_ids = set()
+        if path and os.path.exists(path):
+            added_file = open(path, "rb")
+            self.added = pickle.load(added_file)
+            added_file.close()
+            self.added_ids = set(id_func(c) for c in self.added)
+
+        self.done_ids = set()
+        self.inprogress = {}
+
+        self.n_total = 0
+        self.n_done = 0
+        self._count()
+
+    def _iter_all(self):
+        if self.generator is not None:
+            for comb in self.generator():
+                yield comb
+        for comb in self.added:
+            yield comb
+
+    def _count(self):
+        """Count the combinations and those done, in a single pass."""
+
+        n_total = 0
+        n_done = 0
+        for comb in self._iter_all():
+            n_total += 1
+            if self.id_func(comb) in self.done_ids:
+                n_done += 1
+        self.n_total = n_total
+        self.n_done = n_done
+
+    def iter_remaining(self):
+        """Generate lazily the combinations neither done nor in progress.
+
+        Returns:
+          generator of dict: the combinations.
+        """
+
+        for comb in self._iter_all():
+            comb_id = self.id_func(comb)
+            with self.__lock:
+                if comb_id in self.done_ids or comb_id in self.inprogress:
+                    continue
+            yield comb
+
+    def get_num_total(self):
+        """Return the number of combinations."""
+
+        return self.n_total
+
+    def get_num_done(self):
+        """Return the number of combinations done."""
+
+        return self.n_done
+
+    def get_num_inprogress(self):
+        """Return the number of combinations in progress."""
+
+        return len(self.inprogress)
+
+    def get_num_remaining(self):
+        """Return the number of combinations neither done nor in progress."""
+
+        with self.__lock:
+            return self.n_total - self.n_done - len(self.inprogress)
+
+    def claim(self, comb):
+        """Mark the given combination as in progress, unless it is done or in
+        progress already.
+
+        Args:
+          comb (dict): The combination.
+
+        Returns:
+          bool: whether it was marked.
+        """
+
+        comb_id = self.id_func(comb)
+        with self.__lock:
+            if comb_id in self.done_ids or comb_id in self.inprogress:
+                return False
+            self.inprogress[comb_id] = comb
+            return True
+
+    def done(self, comb):
+        """Mark the given combination as done.
+
+        Args:
+          comb (dict): The combination.
+        """
+
+        comb_id = self.id_func(comb)
+        with self.__lock:
+            self.inprogress.pop(comb_id, None)
+            if comb_id not in self.done_ids:
+                self.done_ids.add(comb_id)
+                self.n_done += 1
+
+    def cancel(self, comb):
+        """Return the given combination in progress to the queue.
+
+        Args:
+          comb (dict): The combination.
+        """
+
+        with self.__lock:
+            self.inprogress.pop(self.id_func(comb), None)
+
+    def set_done_ids(self, comb_ids):
+        """Mark as done the combinations with the given identifiers, e.g.,
+        those with stored results, and forget the combinations in progress.
+
+        Args:
+          comb_ids (iterable of int): The identifiers.
+        """
+
+        with self.__lock:
+            self.done_ids = set(comb_ids)
+            self.inprogress = {}
+            self._count()
+
+    def add_combinations(self, combs):
+        """Add the given combinations to the queue and save them, except those
+        already added.
+
+        Args:
+          combs (list of dict): The combinations.
+
+        Returns:
+          int: the number of combinations added.
+        """
+
+        with self.__lock:
+            new_combs = []
+            for comb in combs:
+                comb_id = self.id_func(comb)
+                if comb_id not in self.added_ids:
+                    self.added_ids.add(comb_id)
+                    new_combs.append(comb)
+                    self.n_total += 1
+                    if comb_id in self.done_ids:
+                        self.n_done += 1
+            if not new_combs:
+                return 0
+            self.added.extend(new_combs)
+
+            if self.path:
+                # Written atomically, so that a crash does not lose them all
+                temp_path = self.path + ".tmp"
+                added_file = open(temp_path, "wb")
+                pickle.dump(self.added, added_file)
+                added_file.close()
+                os.rename(temp_path, self.path)
+            return len(new_combs)
+
+    def __str__(self):
+        with self.__lock:
+            return ("%i combinations, %i done, %i in progress, %i remaining" %
+                    (self.n_total, self.n_done, len(self.inprogress),
+                     self.get_num_remaining()))
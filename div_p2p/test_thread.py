@@ -1,24 +1,48 @@
 import os
-from threading import Thread
-from execo.action import TaktukPut
+import time
+from threading import RLock, Thread
 from execo.log import style
 from execo_engine import logger
+from execo_g5k.api_utils import get_host_cluster
+from div_p2p.aggregate import RunningStats
+from div_p2p.results import parse_output
+from div_p2p.trace import span
 from div_p2p.wrapper import DivP2PWrapper
 
 
 class TestThread(Thread):
     """This class manages the consumption and execution of combinations."""
 
-    def __init__(self, host, comb_manager, stats_manager):
+    def __init__(self, host, comb_manager, stats_manager, scheduler, ds_cache,
+                 remote_dir="/tmp", jar_path="/tmp/diversity_p2p.jar",
+                 use_worker=False, cmd_prefix="", ds_prefetch=True,
+                 batch_confs=True, result_cache=None, profiler=None,
+                 host_confs=None):
         super(TestThread, self).__init__()
 
-        self.div_p2p = DivP2PWrapper(host)
+        self.div_p2p = DivP2PWrapper(host, remote_dir, jar_path, use_worker,
+                                     cmd_prefix, profiler, host_confs)
 
         self.comb_manager = comb_manager
         self.stats_manager = stats_manager
+        self.scheduler = scheduler
+        self.ds_cache = ds_cache
+        self.ds_prefetch = ds_prefetch
+        self.batch_confs = batch_confs
+        self.result_cache = result_cache
+
+        self.__lock = RLock()
+        self.aborted = False
+        self.stopped = False
+        self.failed = False
+        self.poll_period = 10
 
         self.comb = None
         self.ds_id = -1
+        self.ds_key = None
+        self.ds_path = None
+        self.ds_local_path = None
+        self.prefetch_path = None
         self.comb_id = -1
 
     def _th_prefix(self):
@@ -26,45 +50,73 @@ class TestThread(Thread):
 
     def run(self):
 
-        while len(self.comb_manager.sweeper.get_remaining()) > 0:
-
-            # Getting the next combination (which uses a new dataset)
-            comb = self.comb_manager.sweeper.get_next()
-
-            if comb:
+        try:
+            self._run_combs()
+        except Exception:
+            self.failed = True
+            logger.exception(self._th_prefix() + "Thread failed")
+        finally:
+            if self.ds_path:
+                self.ds_cache.release(self.ds_path)
+            self._cancel_prefetch()
+            self.div_p2p.close()
+
+    def _run_combs(self):
+
+        host_key = self.div_p2p.host.address
+        ds_comb = None
+        first_in_ds = False
+
+        while not self.stopped:
+
+            # Getting the next combination, preferably using the same dataset
+            comb = self.scheduler.get_next(host_key, self.ds_key, self)
+            if not comb:
+                if self.scheduler.is_finished():
+                    break
+                # Wait for stragglers to speculate on
+                time.sleep(self.poll_period)
+                continue
+
+            with self.__lock:
+                if self.stopped:
+                    self.scheduler.cancel(comb, self)
+                    break
                 self.comb = comb
-                self.comb_id = self.comb_manager.get_comb_id(comb)
+                self.aborted = False
+                self.div_p2p.killed = False
+            self.comb_id = self.comb_manager.get_comb_id(comb)
 
+            ds_key = self.comb_manager.get_ds_key(comb)
+            if ds_key != self.ds_key:
+                self.ds_key = None
                 self.ds_id = self.comb_manager.get_ds_id(comb)
-                ds_comb = self.prepare_dataset(comb)
+                try:
+                    ds_comb = self.prepare_dataset(comb)
+                except:
+                    self.scheduler.cancel(comb, self)
+                    raise
+                self.ds_key = ds_key
+                first_in_ds = True
 
-                self.xp(comb, ds_comb)
-
-                # subloop over the combinations that use the same dataset
-                while True:
-                    comb_in_ds = self.comb_manager.sweeper.get_next(
-                        lambda r: filter(self._uses_same_ds, r))
-
-                    if comb_in_ds:
-                        self.comb = comb
-                        self.comb_id = self.comb_manager.get_comb_id(comb)
-                        try:
-                            self.xp(comb_in_ds, ds_comb)
-                        except:
-                            break
-                    else:
-                        break
+                if self.batch_confs:
+                    self.upload_group_confs(comb, ds_comb)
 
-    def _uses_same_ds(self, candidate_comb):
-        """Determine if the candidate combination uses the same dataset as the
-        current one.
+                if self.ds_prefetch:
+                    self.prefetch_next_dataset()
 
-        Args:
-          candidate_comb (dict): The combination candidate to be selected as the
-            new combination.
-        """
-
-        return self.comb_manager.uses_same_ds(self.comb, candidate_comb)
+            try:
+                self.xp(comb, ds_comb)
+                first_in_ds = False
+                if self.ds_prefetch:
+                    # The next group may have changed
+                    self.prefetch_next_dataset()
+            except:
+                # Fail if the dataset was just prepared, otherwise prepare it
+                # again with the next combination
+                if first_in_ds:
+                    raise
+                self.ds_key = None
 
     def prepare_dataset(self, comb):
         """Prepare the dataset to be used in the next set of experiments.
@@ -81,23 +133,115 @@ class TestThread(Thread):
         (ds_class_name, ds_params) = self.comb_manager.get_ds_class_params(comb)
 
         local_path = ds_params["local_path"]
-        remote_path = os.path.join(self.div_p2p.remote_dir,
-                                   os.path.basename(local_path))
-
-        ds_comb = {"ds.class.path": remote_path, "ds.class": ds_class_name}
 
-        # Copy dataset to host
+        # Copy dataset to host, if not already there
         logger.info(self._th_prefix() + "Prepare dataset with combination " +
                     str(self.comb_manager.get_ds_parameters(comb)))
 
-        copy_code = TaktukPut([self.div_p2p.host], [local_path], remote_path)
-        copy_code.run()
+        if self.ds_path:
+            self.ds_cache.release(self.ds_path)
+            self.ds_path = None
+        if local_path == self.prefetch_path:
+            # Consumed by the acquisition
+            self.prefetch_path = None
+        else:
+            self._cancel_prefetch()
+        with span("ds_copy", self.div_p2p.host.address, self.comb_id):
+            self.ds_path = self.ds_cache.acquire(local_path)
+        self.ds_local_path = local_path
+
+        ds_comb = {"ds.class.path": self.ds_path, "ds.class": ds_class_name}
 
         # Notify stats manager
         self.stats_manager.add_ds(self.ds_id, comb)
 
         return ds_comb
 
+    def _get_params(self, comb, ds_comb):
+        params = {}
+        for key in comb:
+            params[key] = comb[key]
+        for key in ds_comb:
+            params[key] = ds_comb[key]
+        return params
+
+    def upload_group_confs(self, comb, ds_comb):
+        """Transfer at once the properties files of the given combination and
+        of the remaining ones in its dataset group, most of which are likely to
+        be executed next in the host. The group is uploaded once per host, the
+        other slots only upload the combinations not uploaded yet.
+
+        Args:
+          comb (dict): The combination about to be executed.
+          ds_comb (dict): The dataset parameters.
+        """
+
+        combs = [comb] + self.scheduler.get_group(self.ds_key)
+        with span("conf_upload", self.div_p2p.host.address):
+            self.div_p2p.upload_confs([self._get_params(c, ds_comb)
+                                       for c in combs])
+
+    def _get_metric(self, stats_file, metric):
+        out_file = open(stats_file)
+        value = parse_output(out_file.read()).get(metric)
+        out_file.close()
+        if isinstance(value, (int, float)):
+            return value
+        return None
+
+    def prefetch_next_dataset(self):
+        """Start copying in background the dataset of the next group to be
+        executed in the host, so that it is transferred while the current group
+        runs."""
+
+        next_comb = self.scheduler.peek_next_group(self.div_p2p.host.address,
+                                                   self.ds_key)
+        next_path = None
+        if next_comb:
+            (_, ds_params) = self.comb_manager.get_ds_class_params(next_comb)
+            next_path = ds_params["local_path"]
+        if next_path == self.prefetch_path:
+            return
+
+        # The next group changed, e.g., it was taken by another host
+        self._cancel_prefetch()
+        if next_path and self.ds_cache.prefetch(next_path):
+            self.prefetch_path = next_path
+
+    def _cancel_prefetch(self):
+        if self.prefetch_path:
+            self.ds_cache.cancel_prefetch(self.prefetch_path)
+            self.prefetch_path = None
+
+    def abort(self, comb):
+        """Abort the execution of the given combination, if it is still the
+        one being executed, e.g., because a copy finished first in another host.
+
+        Args:
+          comb (dict): The combination.
+        """
+
+        with self.__lock:
+            if self.comb != comb or self.aborted:
+                return
+            self.aborted = True
+
+        logger.info(self._th_prefix() + "Aborting combination " +
+                    str(self.comb_manager.get_xp_parameters(comb)))
+        self.div_p2p.kill()
+
+    def stop(self):
+        """Stop the thread, e.g., because its host is dead. The combination
+        being executed, if any, is aborted and returned to the scheduler so
+        that another host executes it."""
+
+        with self.__lock:
+            self.stopped = True
+            comb = self.comb
+        if comb is not None:
+            self.scheduler.cancel(comb, self)
+            self.abort(comb)
+
     def xp(self, comb, ds_comb):
         """Perform the experiment corresponding to the given combination.
 
@@ -107,37 +251,133 @@ class TestThread(Thread):
         """
 
         comb_ok = False
+        stats_files = []
+        cache_key = None
+        cached = None
+        n_run = 0
+        runs_ok = False
         try:
             logger.info(self._th_prefix() +
                         "Execute experiment with combination " +
                         str(self.comb_manager.get_xp_parameters(comb)))
 
-            num_reps = self.comb_manager.get_num_repetitions()
-            for nr in range(0, num_reps):
+            if self.result_cache:
+                cache_key = self.result_cache.get_key(
+                    self.ds_local_path, self._get_params(comb, ds_comb),
+                    get_host_cluster(self.div_p2p.host.address))
+                cached = self.result_cache.get(
+                    cache_key, self.comb_manager.get_min_repetitions())
 
-                if num_reps > 1:
-                    logger.info(self._th_prefix() + "Repetition " + str(nr + 1))
+            if cached is not None:
+                logger.info(self._th_prefix() + "Results found in cache")
+            (n_run, runs_ok) = self._run_repetitions(comb, ds_comb,
+                                                     stats_files, cached)
 
-                # Change configuration
-                params = {}
-                for key in comb:
-                    params[key] = comb[key]
-                for key in ds_comb:
-                    params[key] = ds_comb[key]
-                self.div_p2p.change_conf(params)
+            comb_ok = not self.aborted
+            if comb_ok and self.comb_manager.adaptive_repetitions:
+                logger.info(self._th_prefix() + str(len(stats_files)) +
+                            " repetitions run")
 
-                # Execute job
-                stats_file = self.div_p2p.execute()
+        finally:
+            if comb_ok and self.scheduler.finish(comb, self):
+                # Failed runs are not cached, as other campaigns would reuse
+                # them
+                if cache_key and n_run and runs_ok:
+                    self.result_cache.put(cache_key,
+                                          [f for (f, _, _) in stats_files],
+                                          [t for (_, t, _) in stats_files])
 
                 # Notify stats manager
-                self.stats_manager.add_xp(self.comb_id, comb, stats_file)
+                self.comb_manager.add_repetitions(len(stats_files))
+                host = self.div_p2p.host if n_run else None
+                with span("store_results", self.div_p2p.host.address,
+                          self.comb_id):
+                    self.stats_manager.add_xp(self.comb_id, comb,
+                                              [f for (f, _, _) in stats_files],
+                                              host,
+                                              [t for (_, t, _) in stats_files],
+                                              [p for (_, _, p) in stats_files])
+                self.scheduler.done(comb)
+            else:
+                for (stats_file, _, _) in stats_files:
+                    if os.path.exists(stats_file):
+                        os.remove(stats_file)
+                if not comb_ok and not self.aborted:
+                    self.scheduler.cancel(comb, self)
+            logger.info('%s Remaining', self.scheduler.get_num_remaining())
+
+    def _run_repetitions(self, comb, ds_comb, stats_files, cached=None):
+        """Run the repetitions of an experiment, until they are enough or the
+        experiment is aborted. Cached repetitions are used first, so that in
+        adaptive mode only those missing to converge are run.
 
-            comb_ok = True
+        Args:
+          comb (dict): The combination with the experiment's parameters.
+          ds_comb (dict): The dataset parameters.
+          stats_files (list): The list where the local path of the output,
+            the duration and the resources used by each repetition are
+            appended.
+          cached (list of tuple, optional): The local path of the output and
+            the duration of the cached repetitions.
 
-        finally:
-            if comb_ok:
-                self.comb_manager.sweeper.done(comb)
+        Returns:
+          tuple: the number of repetitions run and whether all of them exited
+            successfully.
+        """
+
+        num_reps = self.comb_manager.get_num_repetitions()
+        rep_stats = RunningStats()
+        cached = list(cached or [])
+        n_run = 0
+        runs_ok = True
+        for nr in range(0, num_reps):
+
+            if self.aborted:
+                break
+
+            if cached:
+                (stats_file, run_time) = cached.pop(0)
+                stats_files.append((stats_file, run_time, None))
             else:
-                self.comb_manager.sweeper.cancel(comb)
-            logger.info('%s Remaining',
-                        len(self.comb_manager.sweeper.get_remaining()))
\ No newline at end of file
+                if nr > 0 and n_run == 0:
+                    logger.info(self._th_prefix() + "Cached results are not "
+                                "enough, running more repetitions")
+
+                if num_reps > 1:
+                    logger.info(self._th_prefix() + "Repetition " +
+                                str(nr + 1))
+
+                host_key = self.div_p2p.host.address
+
+                # Change configuration
+                with span("change_conf", host_key, self.comb_id):
+                    self.div_p2p.change_conf(self._get_params(comb, ds_comb))
+
+                # Execute job
+                with span("execute", host_key, self.comb_id):
+                    (stats_file, status) = self.div_p2p.execute()
+                if stats_file is None:
+                    break
+                n_run += 1
+                runs_ok = runs_ok and status == 0
+                stats_files.append((stats_file, self.div_p2p.run_times[-1],
+                                    self.div_p2p.last_profile))
+
+            # Stop repeating once the target metric is stable enough
+            if self.comb_manager.adaptive_repetitions:
+                metric = self._get_metric(stats_file,
+                                          self.comb_manager.ci_metric)
+                if metric is None:
+                    logger.warn(self._th_prefix() + "Metric " +
+                                self.comb_manager.ci_metric + " not "
+                                "found in the output")
+                else:
+                    rep_stats.add(metric)
+                    if self.comb_manager.has_converged(rep_stats):
+                        break
+
+        # Cached repetitions not needed
+        for (stats_file, _) in cached:
+            os.remove(stats_file)
+
+        return (n_run, runs_ok)
@@ -0,0 +1,202 @@
+import functools
+import json
+import threading
+import time
+
+from threading import RLock
+
+from execo_engine import logger
+
+
+class Tracer(object):
+    """This class records the duration of the phases of the campaign, e.g.,
+    reservation, deployment, dataset copy or test execution, by host and
+    thread. They can be exported as a Chrome trace, viewable in
+    chrome://tracing or Perfetto, and summarized by phase. It is
+    thread-safe."""
+
+    def __init__(self):
+        self.__lock = RLock()
+        self.start = time.time()
+        self.events = []
+        self.pids = {}
+        self.tids = {}
+
+    def add(self, phase, start, end, host=None, comb_id=None):
+        """Record a phase.
+
+        Args:
+          phase (str): The name of the phase.
+          start (float): The start time.
+          end (float): The end time.
+          host (str, optional): The address of the host where it happened
+            (default: the frontend).
+          comb_id (int, optional): The combination it belongs to.
+        """
+
+        thread = threading.current_thread().name
+        with self.__lock:
+            self.events.append((phase, start, end, host or "frontend",
+                                thread, comb_id))
+
+    def _get_id(self, ids, key):
+        if key not in ids:
+            ids[key] = len(ids) + 1
+        return ids[key]
+
+    def write_trace(self, path):
+        """Write the phases recorded in Chrome trace event format.
+
+        Args:
+          path (str): The path of the trace file.
+        """
+
+        with self.__lock:
+            trace_events = []
+            for (phase, start, end, host, thread, comb_id) in self.events:
+                event = {"name": phase, "cat": "phase", "ph": "X",
+                         "ts": int((start - self.start) * 1e6),
+                         "dur": int((end - start) * 1e6),
+                         "pid": self._get_id(self.pids, host),
+                         "tid": self._get_id(self.tids, (host, thread))}
+                if comb_id is not None:
+                    event["args"] = {"comb_id": comb_id}
+                trace_events.append(event)
+
+            for (host, pid) in self.pids.items():
+                trace_events.append({"name": "process_name", "ph": "M",
+                                     "pid": pid, "args": {"name": host}})
+            for ((host, thread), tid) in self.tids.items():
+                trace_events.append({"name": "thread_name", "ph": "M",
+                                     "pid": self.pids[host], "tid": tid,
+                                     "args": {"name": thread}})
+
+        trace_file = open(path, "w")
+        json.dump({"traceEvents": trace_events, "displayTimeUnit": "ms"},
+                  trace_file)
+        trace_file.close()
+
+    def get_summary(self):
+        """Return the statistics of each phase.
+
+        Returns:
+          dict: the number of occurrences and the total, mean and maximum
+            duration of each phase.
+        """
+
+        with self.__lock:
+            summary = {}
+            for (phase, start, end, _, _, _) in self.events:
+                stats = summary.setdefault(phase, {"n": 0, "total": 0.0,
+                                                   "max": 0.0})
+                stats["n"] += 1
+                stats["total"] += end - start
+                stats["max"] = max(stats["max"], end - start)
+            for stats in summary.values():
+                stats["mean"] = stats["total"] / stats["n"]
+            return summary
+
+    def write_summary(self, path):
+        """Write the statistics of each phase in csv format and log them.
+
+        Args:
+          path (str): The path of the summary file.
+        """
+
+        summary = self.get_summary()
+        summary_file = open(path, "w")
+        summary_file.write("phase, n, total, mean, max\n")
+        for (phase, stats) in sorted(summary.items(),
+                                     key=lambda s: -s[1]["total"]):
+            summary_file.write("%s, %i, %.3f, %.3f, %.3f\n" %
+                               (phase, stats["n"], stats["total"],
+                                stats["mean"], stats["max"]))
+            logger.info("Phase %s: %i times, %.1fs in total, %.2fs on "
+                        "average, %.2fs at most" %
+                        (phase, stats["n"], stats["total"], stats["mean"],
+                         stats["max"]))
+        summary_file.close()
+
+
+class _Span(object):
+
+    def __init__(self, tracer, phase, host, comb_id):
+        self.tracer = tracer
+        self.phase = phase
+        self.host = host
+        self.comb_id = comb_id
+        self.start = None
+
+    def __enter__(self):
+        self.start = time.time()
+        return self
+
+    def __exit__(self, t, v, traceback):
+        self.tracer.add(self.phase, self.start, time.time(), self.host,
+                        self.comb_id)
+        return False
+
+
+class _NullSpan(object):
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, t, v, traceback):
+        return False
+
+
+_null_span = _NullSpan()
+_tracer = None
+
+
+def set_tracing(enabled):
+    """Enable or disable the recording of the phases.
+
+    Args:
+      enabled (bool): Whether phases are recorded.
+    """
+
+    global _tracer
+    _tracer = Tracer() if enabled else None
+
+
+def get_tracer():
+    """Return the tracer or None if tracing is disabled."""
+
+    return _tracer
+
+
+def span(phase, host=None, comb_id=None):
+    """Return a context manager recording the duration of a phase. It does
+    nothing if tracing is disabled.
+
+    Args:
+      phase (str): The name of the phase.
+      host (str, optional): The address of the host where it happens.
+      comb_id (int, optional): The combination it belongs to.
+    """
+
+    if _tracer is None:
+        return _null_span
+    return _Span(_tracer, phase, host, comb_id)
+
+
+def traced(phase):
+    """Decorate a method so that its duration is recorded as the given phase.
+    The host is taken from the host attribute of the object, if any.
+
+    Args:
+      phase (str): The name of the phase.
+    """
+
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(self, *args, **kwargs):
+            if _tracer is None:
+                return func(self, *args, **kwargs)
+            host = getattr(self, "host", None)
+            with _Span(_tracer, phase, getattr(host, "address", None), None):
+                return func(self, *args, **kwargs)
+        return wrapper
+    return decorator
@@ -0,0 +1,186 @@
+import tempfile
+import time
+
+from threading import Condition
+
+from execo.process import SshProcess, ProcessOutputHandler
+from execo_engine import logger
+
+
+BEGIN_MARK = "__DIV_P2P_RUN_BEGIN__"
+END_MARK = "__DIV_P2P_RUN_END__"
+
+
+class WorkerException(Exception):
+    pass
+
+
+class _RunnerOutputHandler(ProcessOutputHandler):
+    """Dispatch the lines written by the remote runner to its worker."""
+
+    def __init__(self, worker):
+        super(_RunnerOutputHandler, self).__init__()
+        self.worker = worker
+
+    def read(self, process, stream, string, eof, error):
+        super(_RunnerOutputHandler, self).read(process, stream, string,
+                                               eof, error)
+        if eof or error:
+            self.worker._runner_ended()
+
+    def read_line(self, process, stream, string):
+        self.worker._runner_line(string)
+
+
+class DivP2PWorker(object):
+    """This class manages a long-lived runner process in a host.
+
+    The runner is a remote shell loop started through a single SSH session. It
+    reads the path of a properties file per line on its standard input,
+    executes the jar with it and writes the output back between begin and end
+    marks, so that consecutive runs do not pay for the SSH session setup.
+    """
+
+    def __init__(self, host, jar_path, run_timeout=None, cmd_prefix="",
+                 connection=None, profiler=None):
+        """Create a worker for the given host. The runner is started lazily.
+
+        Args:
+          host (Host): The host where the runner is executed.
+          jar_path (str): The remote path of the experiment jar.
+          run_timeout (float, optional): Maximum number of seconds to wait
+            for a single run (default: no limit).
+          cmd_prefix (str, optional): Command prepended to the java
+            invocation, e.g., to pin it to some cores (default: none).
+          connection (SshConnection, optional): The shared connection to the
+            host (default: a dedicated one).
+          profiler (RemoteProfiler, optional): The profiler of the resources
+            used by each run (default: none).
+        """
+
+        self.host = host
+        self.jar_path = jar_path
+        self.run_timeout = run_timeout
+        self.cmd_prefix = cmd_prefix
+        self.connection = connection
+        self.profiler = profiler
+
+        self.__cond = Condition()
+        self.process = None
+        self.start_time = None
+
+        self.__out = None
+        self.__in_run = False
+        self.__run_status = None
+        self.__ended = False
+
+    def start(self):
+        """Start the remote runner."""
+
+        java_cmd = (self.cmd_prefix + "java -jar " + self.jar_path +
+                    " -p \"$props\" < /dev/null")
+        if self.profiler is not None:
+            java_cmd = self.profiler.wrap(java_cmd)
+
+        runner = ("while read props; do "
+                  "echo " + BEGIN_MARK + "; " +
+                  java_cmd + "; "
+                  "echo " + END_MARK + " $?; "
+                  "done")
+
+        start = time.time()
+        self.__ended = False
+        connection_params = None
+        if self.connection is not None:
+            if self.process is not None:
+                # The previous runner may have died with the connection
+                self.connection.reconnect()
+            connection_params = self.connection.connection_params
+        self.process = SshProcess("sh -c '" + runner + "'", self.host,
+                                  connection_params=connection_params)
+        self.process.stdout_handlers.append(_RunnerOutputHandler(self))
+        self.process.start()
+        self.start_time = time.time() - start
+
+    def is_running(self):
+        """Return whether the remote runner is alive."""
+
+        return (self.process is not None and not self.__ended and
+                not self.process.ended)
+
+    def run(self, props_path):
+        """Execute a single test in the runner.
+
+        Args:
+          props_path (str): The remote path of the properties file.
+
+        Return:
+          tuple: the local path of the file containing the process output and
+            the exit code of the test.
+        """
+
+        if not self.is_running():
+            self.start()
+
+        (_, temp_file) = tempfile.mkstemp("", "div_p2p-out-", "/tmp")
+
+        with self.__cond:
+            self.__out = open(temp_file, "w")
+            self.__in_run = False
+            self.__run_status = None
+
+            self.process.write(props_path + "\n")
+
+            deadline = None
+            if self.run_timeout:
+                deadline = time.time() + self.run_timeout
+            while self.__run_status is None and not self.__ended:
+                if deadline is not None:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        break
+                    self.__cond.wait(remaining)
+                else:
+                    self.__cond.wait(1)
+
+            status = self.__run_status
+            self.__out.close()
+            self.__out = None
+
+        if status is None:
+            self.stop()
+            raise WorkerException("Runner in " + str(self.host.address) +
+                                  " did not complete the run")
+        if status != 0:
+            logger.warn("Run in " + str(self.host.address) +
+                        " exited with status " + str(status))
+
+        return (temp_file, status)
+
+    def stop(self):
+        """Stop the remote runner."""
+
+        if self.process is not None:
+            if not self.process.ended:
+                self.process.kill()
+                self.process.wait()
+            self.process = None
+
+    def _runner_line(self, line):
+        with self.__cond:
+            if line.startswith(BEGIN_MARK):
+                self.__in_run = True
+            elif line.startswith(END_MARK):
+                self.__in_run = False
+                try:
+                    self.__run_status = int(line[len(END_MARK):].strip())
+                except ValueError:
+                    self.__run_status = -1
+                self.__cond.notify_all()
+            elif self.__in_run and self.__out is not None:
+                self.__out.write(line + "\n")
+
+    def _runner_ended(self):
+        with self.__cond:
+            self.__ended = True
+            self.__cond.notify_all()
@@ -1,60 +1,329 @@
+import hashlib
 import os
+import shutil
 import tempfile
+import time
+
+from threading import RLock
 
 from execo.action import Put
 from execo.process import SshProcess
+from execo_engine import logger
+
+from div_p2p.connection import SSH_CONNECTION_ERROR, get_connection
+from div_p2p.worker import DivP2PWorker, WorkerException
+
+
+class HostConfs(object):
+    """This class keeps the record of the properties files uploaded in bundle
+    to a host. It is shared by all the slots of the host, so that each file is
+    uploaded once per host. It is thread-safe."""
+
+    def __init__(self, remote_dir):
+        """Create the record of the properties files of a host.
+
+        Args:
+          remote_dir (str): The remote directory where the bundles are
+            uploaded.
+        """
+
+        self.lock = RLock()
+        self.remote_dir = remote_dir
+        self.paths = {}
+        self.users = 0
+
+    def get_path(self, name):
+        """Return the remote path of the given properties file, or None if it
+        was not uploaded."""
+
+        with self.lock:
+            return self.paths.get(name)
+
+    def acquire(self):
+        """Register a new slot using the properties files."""
+
+        with self.lock:
+            self.users += 1
+
+    def release(self):
+        """Unregister a slot using the properties files.
+
+        Returns:
+          list of str: the remote directories of the bundles, to be removed,
+            if it was the last slot using them.
+        """
+
+        with self.lock:
+            self.users -= 1
+            if self.users > 0:
+                return []
+            dirs = sorted(set(os.path.dirname(p) for p in self.paths.values()))
+            self.paths = {}
+            return dirs
 
 
 class DivP2PWrapper:
     """This class manages the properties and execution of diversity_p2p tests.
+    All the sessions to the host go through its shared SSH connection, if
+    enabled.
     """
 
     def __init__(self, host,
                  remote_dir="/tmp",
-                 jar_path="/tmp/diversity_p2p.jar"):
+                 jar_path="/tmp/diversity_p2p.jar",
+                 use_worker=False,
+                 cmd_prefix="",
+                 profiler=None,
+                 host_confs=None):
         self.host = host
         self.remote_dir = remote_dir
         self.jar_path = jar_path
+        self.cmd_prefix = cmd_prefix
+        self.profiler = profiler
+        self.connection = get_connection(host)
 
         self.props_path = os.path.join(self.remote_dir, "properties.dat")
+        self.conf_path = self.props_path
+
+        # Properties files uploaded in bundle, possibly by other slots
+        self.host_confs = host_confs or HostConfs(remote_dir)
+        self.host_confs.acquire()
+
+        self.worker = None
+        if use_worker:
+            self.worker = DivP2PWorker(host, jar_path, cmd_prefix=cmd_prefix,
+                                       connection=self.connection,
+                                       profiler=profiler)
+
+        self.process = None
+        self.killed = False
+
+        self.run_times = []
+        # Resources used by the last run, if profiled
+        self.last_profile = {}
+
+    def _get_connection_params(self):
+        if self.connection is None:
+            return None
+        return self.connection.connection_params
+
+    def _reconnect(self):
+        """Replace the shared connection if it dropped.
+
+        Returns:
+          bool: whether the failed operation may be retried.
+        """
+
+        if self.connection is None:
+            return False
+        self.connection.reconnect()
+        return True
+
+    def _get_conf_name(self, params):
+        content = "".join(str(key) + "=" + str(params[key]) + "\n"
+                          for key in sorted(params))
+        return hashlib.sha1(content.encode()).hexdigest() + ".properties"
+
+    def _write_conf(self, params, path):
+        props = open(path, "w")
+        for key in sorted(params):
+            props.write(str(key) + "=" + str(params[key]) + "\n")
+        props.close()
+
+    def _put(self, local_path, remote_path):
+        copy = Put([self.host], [local_path], remote_path,
+                   connection_params=self._get_connection_params())
+        copy.run()
+        if not copy.ok and self._reconnect():
+            copy = Put([self.host], [local_path], remote_path,
+                       connection_params=self._get_connection_params())
+            copy.run()
+        return copy.ok
+
+    def upload_confs(self, params_list):
+        """Create the properties files of several tests and transfer them to
+        the host at once, so that later changes of configuration to any of them
+        do not need any transfer. Those already uploaded to the host, e.g., by
+        another slot, are skipped.
+
+        Args:
+          params_list (list of dict): The parameters of the tests.
+        """
+
+        # The other slots of the host wait for the files they also need
+        with self.host_confs.lock:
+            new_confs = {}
+            for params in params_list:
+                name = self._get_conf_name(params)
+                if name not in self.host_confs.paths:
+                    new_confs[name] = params
+            if not new_confs:
+                return
+
+            # Create the files in a local temporary directory
+            local_dir = tempfile.mkdtemp("", "div_p2p-confs-", "/tmp")
+            for (name, params) in new_confs.items():
+                self._write_conf(params, os.path.join(local_dir, name))
+
+            # Copy the whole directory to the remote location
+            remote_dir = os.path.join(self.host_confs.remote_dir,
+                                      os.path.basename(local_dir))
+            ok = self._put(local_dir, remote_dir)
+            shutil.rmtree(local_dir)
+
+            if ok:
+                for name in new_confs:
+                    self.host_confs.paths[name] = os.path.join(remote_dir,
+                                                               name)
+            else:
+                logger.warn("Could not upload properties files to " +
+                            str(self.host.address) + ", they will be copied "
+                            "one by one")
 
     def change_conf(self, params):
         """Create a new properties file from configuration and transfer it to
-        the host.
+        the host, unless it was already uploaded in bundle.
 
         Args:
           params (dict): The parameters of the test.
         """
 
+        conf_path = self.host_confs.get_path(self._get_conf_name(params))
+        if conf_path:
+            self.conf_path = conf_path
+            return
+
         # Create a local temporary file with the params
         (_, temp_file) = tempfile.mkstemp("", "div_p2p-conf-", "/tmp")
-        props = open(temp_file, "w")
-        for key in params:
-            props.write(str(key) + "=" + str(params[key]) + "\n")
-        props.close()
+        self._write_conf(params, temp_file)
 
         # Copy the file to the remote location
-        copy_props = Put([self.host], [temp_file], self.props_path)
-        copy_props.run()
+        self._put(temp_file, self.props_path)
+        self.conf_path = self.props_path
 
         # Remove temporary file
         os.remove(temp_file)
 
     def execute(self):
-        """Execute a single test.
+        """Execute a single test. If the worker mode is enabled the test is run
+        by the host's runner, falling back to a dedicated process if the runner
+        fails. Nothing is executed after a kill, until the killed flag is
+        reset.
+
+        Return:
+          tuple: the local path of the file containing the process output and
+            the exit code of the test, or (None, None) if it was killed.
+        """
+
+        start = time.time()
+        self.last_profile = {}
+        if self.killed:
+            return (None, None)
+
+        temp_file = None
+        status = None
+        if self.worker is not None:
+            try:
+                (temp_file, status) = self.worker.run(self.conf_path)
+            except WorkerException as e:
+                if self.killed:
+                    return (None, None)
+                logger.warn(str(e) + ", falling back to one process per run")
+                self.worker.stop()
+                self.worker = None
+
+        if temp_file is None:
+            # Output is stored in a local temporary file
+            (_, temp_file) = tempfile.mkstemp("", "div_p2p-out-", "/tmp")
+
+            test = self._run_process(temp_file)
+            if test.exit_code == SSH_CONNECTION_ERROR and not self.killed \
+                    and self._reconnect():
+                test = self._run_process(temp_file)
+            status = test.exit_code if test.exit_code is not None else -1
+
+        self.run_times.append(time.time() - start)
+        logger.debug("Run %i in %s took %.2fs", len(self.run_times),
+                     self.host.address, self.run_times[-1])
+
+        if self.profiler is not None and not self.killed:
+            self.last_profile = self.profiler.fetch(
+                self.host, self._get_connection_params())
+
+        return (temp_file, status)
+
+    def _run_process(self, out_path):
+        cmd = (self.cmd_prefix + "java -jar " + self.jar_path +
+               " -p " + self.conf_path)
+        if self.profiler is not None:
+            cmd = self.profiler.wrap(cmd)
+        test = SshProcess(cmd,
+                          self.host,
+                          connection_params=self._get_connection_params())
+        test.stdout_handlers.append(out_path)
+
+        self.process = test
+        if not self.killed:
+            test.run()
+        self.process = None
+        return test
+
+    def kill(self):
+        """Kill the test being executed, if any, both the local session and the
+        remote JVM, and prevent further executions until the killed flag is
+        reset."""
+
+        self.killed = True
+        process = self.process
+        if process is not None and not process.ended:
+            process.kill()
+        worker = self.worker
+        if worker is not None:
+            worker.stop()
+
+        # The bracket keeps the pattern from matching the shell running pkill
+        kill = SshProcess("pkill -f \"[j]ava .*-p " + self.conf_path + "\"",
+                          self.host,
+                          connection_params=self._get_connection_params())
+        kill.nolog_exit_code = True
+        kill.nolog_error = True
+        kill.run(timeout=10)
+
+    def get_timings(self):
+        """Return the warm-up and steady-state execution times.
 
         Return:
-          str: Local path of the file containing the process output.
+          tuple: the time of the first run and the mean time of the following
+            runs (None if not available).
         """
 
-        test = SshProcess("java -jar " + self.jar_path +
-                          " -p " + self.props_path,
-                          self.host)
+        if not self.run_times:
+            return (None, None)
+        warm_up = self.run_times[0]
+        steady = None
+        if len(self.run_times) > 1:
+            steady = sum(self.run_times[1:]) / (len(self.run_times) - 1)
+        return (warm_up, steady)
+
+    def close(self):
+        """Stop the worker, if any, remove the uploaded properties files and
+        log the execution timings."""
 
-        # Output is stored in a local temporary file
-        (_, temp_file) = tempfile.mkstemp("", "div_p2p-out-", "/tmp")
-        test.stdout_handlers.append(temp_file)
+        if self.worker is not None:
+            self.worker.stop()
+            self.worker = None
 
-        test.run()
+        # The last slot of the host removes them
+        confs_dirs = self.host_confs.release()
+        if confs_dirs:
+            clean = SshProcess("rm -rf " + " ".join(confs_dirs), self.host,
+                               connection_params=self._get_connection_params())
+            clean.run()
 
-        return temp_file
+        (warm_up, steady) = self.get_timings()
+        if warm_up is not None:
+            msg = ("Host " + str(self.host.address) + ": " +
+                   str(len(self.run_times)) + " runs, warm-up %.2fs" % warm_up)
+            if steady is not None:
+                msg += ", steady-state %.2fs" % steady
+            logger.info(msg)
@@ -0,0 +1,52 @@
+import unittest
+
+from div_p2p.aggregate import OnlineAggregator, RunningStats, median, \
+    t_critical
+
+
+class RunningStatsTest(unittest.TestCase):
+
+    def test_summary(self):
+        stats = RunningStats()
+        for x in [2.0, 4.0, 4.0, 4.0, 5.0, 5.0, 7.0, 9.0]:
+            stats.add(x)
+        summary = stats.get_summary()
+        self.assertEqual(summary["n"], 8)
+        self.assertAlmostEqual(summary["mean"], 5.0)
+        self.assertAlmostEqual(summary["variance"], 32.0 / 7)
+        self.assertEqual((summary["min"], summary["max"]), (2.0, 9.0))
+        self.assertEqual(summary["median"], 4.5)
+
+    def test_exact_median(self):
+        # The median must be exact with the usual numbers of repetitions
+        values = [0.1, 3.2, -0.7, 1.9, 0.4, 2.6, -1.3, 0.97, 5.0, 0.2]
+        stats = RunningStats()
+        for x in values:
+            stats.add(x)
+        self.assertAlmostEqual(stats.get_summary()["median"], 0.685)
+        self.assertEqual(median([3, 1, 2]), 2)
+        self.assertIsNone(median([]))
+
+    def test_ci_width(self):
+        stats = RunningStats()
+        stats.add(1.0)
+        self.assertIsNone(stats.get_ci_width())
+        stats.add(3.0)
+        self.assertAlmostEqual(stats.get_ci_width(),
+                               2 * t_critical(1) * 1.0)
+
+
+class OnlineAggregatorTest(unittest.TestCase):
+
+    def test_add(self):
+        aggregator = OnlineAggregator()
+        aggregator.add(1, {"m": 1, "name": "a", "ok": True})
+        summary = aggregator.add(1, {"m": 3})
+        self.assertEqual(list(summary.keys()), ["m"])
+        self.assertEqual(summary["m"]["mean"], 2.0)
+        aggregator.discard(1)
+        self.assertEqual(aggregator.get_summary(1), {})
+
+
+if __name__ == "__main__":
+    unittest.main()
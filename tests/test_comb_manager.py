@@ -0,0 +1,40 @@
+import unittest
+
+from div_p2p.engine import CombinationManager
+
+
+class FakeEngine(object):
+
+    def __init__(self, ds_config):
+        self.ds_config = ds_config
+
+
+class CombinationIdTest(unittest.TestCase):
+
+    def test_reordered_datasets(self):
+        ds_a = ("ClassA", {"size": "10"})
+        ds_b = ("ClassB", {"size": "10"})
+        before = CombinationManager(FakeEngine([ds_a, ds_b]))
+        after = CombinationManager(FakeEngine([ds_b, ds_a]))
+
+        comb_before = {"ds.config": 1, "xp.n": "4"}
+        comb_after = {"ds.config": 0, "xp.n": "4"}
+        self.assertEqual(before.get_comb_id(comb_before),
+                         after.get_comb_id(comb_after))
+        self.assertEqual(before.get_ds_id(comb_before),
+                         after.get_ds_id(comb_after))
+
+        self.assertNotEqual(before.get_comb_id(comb_after),
+                            after.get_comb_id(comb_after))
+        self.assertNotEqual(before.get_ds_id(comb_after),
+                            after.get_ds_id(comb_after))
+
+    def test_properties(self):
+        manager = CombinationManager(FakeEngine([("ClassA", {"size": "10"}),
+                                                 ("ClassA", {"size": "20"})]))
+        self.assertNotEqual(manager.get_comb_id({"ds.config": 0}),
+                            manager.get_comb_id({"ds.config": 1}))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,135 @@
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+from execo.host import Host
+
+from div_p2p import ds_cache
+from div_p2p.ds_cache import DatasetCache, DatasetCacheException, parse_size
+
+
+class FakeProcess(object):
+    """Remote command which does nothing."""
+
+    ok = True
+
+    def __init__(self, *args, **kwargs):
+        self.args = args
+
+    def run(self):
+        pass
+
+
+class FakePut(FakeProcess):
+    """Transfer which does nothing, optionally blocking until an event is
+    set."""
+
+    event = None
+
+    def run(self):
+        if self.event is not None:
+            self.event.wait()
+
+
+class DatasetCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        patches = [mock.patch.object(ds_cache, "SshProcess", FakeProcess),
+                   mock.patch.object(ds_cache, "TaktukPut", FakePut),
+                   mock.patch.object(DatasetCache, "_save")]
+        for p in patches:
+            p.start()
+            self.addCleanup(p.stop)
+        FakeProcess.ok = True
+        FakePut.event = None
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def _cache(self, budget):
+        cache = DatasetCache(Host("node-1"), "/tmp/ds-cache", budget)
+        cache.entries = {}
+        return cache
+
+    def _dataset(self, name, size):
+        path = os.path.join(self.tmp_dir, name)
+        ds_file = open(path, "w")
+        ds_file.write(name[0] * size)
+        ds_file.close()
+        return path
+
+    def test_parse_size(self):
+        self.assertEqual(parse_size("10"), 10)
+        self.assertEqual(parse_size("1.5k"), 1536)
+        self.assertEqual(parse_size(" 2G "), 2 << 30)
+
+    def test_eviction(self):
+        cache = self._cache(100)
+        paths = [self._dataset(n, 40) for n in ["a", "b", "c"]]
+        remote_a = cache.acquire(paths[0])
+        cache.acquire(paths[1])
+        cache.release(remote_a)
+
+        # The least recently used dataset not in use is evicted
+        cache.acquire(paths[2])
+        self.assertEqual(cache.evictions, 1)
+        self.assertEqual(cache.get_used_bytes(), 80)
+        self.assertEqual(cache.acquire(paths[1]).split("/")[-1], "b")
+        self.assertEqual(cache.hits, 1)
+
+    def _wait_transfers(self, cache, n):
+        for _ in range(500):
+            if len(cache.transferring) >= n:
+                return
+            time.sleep(0.01)
+        self.fail("Transfers did not start")
+
+    def test_transfers_in_flight(self):
+        cache = self._cache(100)
+        cache.release(cache.acquire(self._dataset("a", 40)))
+
+        # The second transfer fits only if the first one is not counted
+        FakePut.event = threading.Event()
+        threads = [threading.Thread(target=cache.acquire,
+                                    args=(self._dataset(n, size),))
+                   for (n, size) in [("c", 50), ("d", 20)]]
+        for (n, t) in enumerate(threads):
+            t.start()
+            self._wait_transfers(cache, n + 1)
+        FakePut.event.set()
+        for t in threads:
+            t.join()
+
+        self.assertEqual(cache.evictions, 1)
+        self.assertEqual(cache.get_used_bytes(), 70)
+        self.assertEqual(cache.transferring, {})
+
+    def test_reserved_size(self):
+        cache = self._cache(100)
+        cache.entries = {"old": {"name": "old", "size": 30,
+                                 "last_used": 0.0}}
+        cache.transferring = {"other": 40}
+        cache._evict(40)
+        self.assertEqual(cache.entries, {})
+        self.assertEqual(cache.evictions, 1)
+
+    def test_failed_transfer(self):
+        cache = self._cache(100)
+        FakeProcess.ok = False
+        self.assertRaises(DatasetCacheException, cache.acquire,
+                          self._dataset("a", 10))
+        self.assertEqual(cache.transferring, {})
+        self.assertEqual(cache.entries, {})
+
+
+if __name__ == "__main__":
+    unittest.main()
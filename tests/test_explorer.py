@@ -0,0 +1,63 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from div_p2p.explorer import GridRefinementExplorer
+
+
+class GridRefinementExplorerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.params = {"xp.n": [str(n) for n in range(9)],
+                       "ds.config": [0, 1]}
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_initial(self):
+        explorer = GridRefinementExplorer(self.params, "m")
+        self.assertEqual(explorer.refined, ["xp.n"])
+        self.assertEqual(explorer.stride, 4)
+        combs = explorer.get_initial()
+        self.assertEqual(sorted((c["ds.config"], c["xp.n"]) for c in combs),
+                         [(0, "0"), (0, "4"), (0, "8"),
+                          (1, "0"), (1, "4"), (1, "8")])
+
+    def test_refine(self):
+        explorer = GridRefinementExplorer(self.params, "m", goal="min", top=1)
+        results = dict((c, abs(int(c["xp.n"]) - 7 + 3 * c["ds.config"]))
+                       for c in explorer.get_initial())
+        combs = explorer.refine(results)
+        self.assertEqual(explorer.stride, 2)
+        # Neighbours of the best value, 8 for dataset 0 and 4 for dataset 1
+        self.assertEqual(sorted((c["ds.config"], c["xp.n"]) for c in combs),
+                         [(0, "6"), (1, "2"), (1, "6")])
+
+    def test_finished(self):
+        explorer = GridRefinementExplorer(self.params, "m")
+        explorer.stride = 1
+        self.assertEqual(explorer.refine({}), [])
+
+    def test_no_results(self):
+        explorer = GridRefinementExplorer(self.params, "m")
+        self.assertEqual(explorer.refine({}), [])
+        self.assertEqual(explorer.stride, 2)
+
+    def test_state(self):
+        path = os.path.join(self.tmp_dir, "explorer")
+        explorer = GridRefinementExplorer(self.params, "m", state_path=path)
+        results = dict((c, 1.0) for c in explorer.get_initial())
+        explorer.refine(results)
+
+        # Not saved until the new combinations are
+        self.assertEqual(GridRefinementExplorer(self.params, "m",
+                                                state_path=path).stride, 4)
+        explorer.save()
+        self.assertEqual(GridRefinementExplorer(self.params, "m",
+                                                state_path=path).stride, 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,40 @@
+import unittest
+
+from div_p2p.params import Constraint, iter_combinations, parse_values
+
+
+class ParseValuesTest(unittest.TestCase):
+
+    def test_values(self):
+        self.assertEqual(parse_values("a, b ,c"), ["a", "b", "c"])
+
+    def test_ranges(self):
+        self.assertEqual(parse_values("range(1, 3), logrange(4, 16)"),
+                         ["1", "2", "3", "4", "8", "16"])
+        self.assertEqual(parse_values("range(0, 1, 0.5)"), ["0", "0.5", "1"])
+
+    def test_duplicates(self):
+        self.assertEqual(parse_values("1, range(1,3), 2"), ["1", "2", "3"])
+
+    def test_invalid_range(self):
+        self.assertRaises(ValueError, parse_values, "range(1)")
+        self.assertRaises(ValueError, parse_values, "range(1, 3, 0)")
+        self.assertRaises(ValueError, parse_values, "logrange(0, 3)")
+
+
+class IterCombinationsTest(unittest.TestCase):
+
+    def test_constraints(self):
+        params = {"xp.a": ["1", "2", "10"], "xp.b": ["2", "x"]}
+        constraints = [Constraint("xp.a >= xp.b", params.keys())]
+        combs = list(iter_combinations(params, constraints))
+        self.assertEqual(combs, [{"xp.a": "2", "xp.b": "2"},
+                                 {"xp.a": "10", "xp.b": "2"}])
+
+    def test_all(self):
+        params = {"xp.a": ["1", "2"], "xp.b": ["x", "y", "z"]}
+        self.assertEqual(len(list(iter_combinations(params))), 6)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,54 @@
+import unittest
+
+from div_p2p.planner import PlannerException, ReservationPlanner
+
+
+class FakePlanner(ReservationPlanner):
+    """Planner whose slots are given relative to the current time."""
+
+    def __init__(self, slots, walltime="1:00:00"):
+        ReservationPlanner.__init__(self, {"c1": 1}, walltime)
+        self.relative_slots = slots
+
+    def _fetch(self, endtime):
+        self._set_slots([(self.now + start, self.now + start + 3600,
+                          {"c1": free})
+                         for (start, free) in self.relative_slots], endtime)
+
+
+class ReservationPlannerTest(unittest.TestCase):
+
+    def _find(self, slots, n_nodes, policy, total_work=None):
+        planner = FakePlanner(slots)
+        (start, resources) = planner.find_slot(n_nodes, policy, total_work)
+        return (start - planner.now, resources)
+
+    def test_earliest(self):
+        slots = [(0, 2), (600, 8)]
+        self.assertEqual(self._find(slots, 4, "earliest"), (600, {"c1": 4}))
+        self.assertEqual(self._find(slots, 2, "earliest"), (0, {"c1": 2}))
+
+    def test_makespan(self):
+        # 2 nodes now finish before 8 nodes in two hours
+        slots = [(0, 2), (7200, 8)]
+        self.assertEqual(self._find(slots, 8, "makespan", 4000),
+                         (0, {"c1": 2}))
+
+    def test_makespan_walltime(self):
+        # 2 nodes now would finish first but need more than the walltime
+        slots = [(0, 2), (3500, 8)]
+        self.assertEqual(self._find(slots, 8, "makespan", 8000),
+                         (3500, {"c1": 8}))
+
+    def test_min_nodes(self):
+        slots = [(0, 2), (600, 3), (1200, 8)]
+        self.assertEqual(self._find(slots, 8, "min_nodes", 9000),
+                         (600, {"c1": 3}))
+
+    def test_unknown_policy(self):
+        self.assertRaises(PlannerException, FakePlanner([]).find_slot, 1,
+                          "latest")
+
+
+if __name__ == "__main__":
+    unittest.main()
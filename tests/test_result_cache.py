@@ -0,0 +1,87 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from div_p2p.result_cache import ResultCache
+
+
+class ResultCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.cache = ResultCache(os.path.join(self.tmp_dir, "cache"))
+        self.cache.jar_path = self._write("jar", "jar")
+        self.ds_path = self._write("ds", "dataset")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def _write(self, name, content):
+        path = os.path.join(self.tmp_dir, name)
+        out_file = open(path, "w")
+        out_file.write(content)
+        out_file.close()
+        return path
+
+    def _read(self, path):
+        in_file = open(path)
+        content = in_file.read()
+        in_file.close()
+        os.remove(path)
+        return content
+
+    def test_key(self):
+        params = {"xp.n": "4", "ds.config": 0}
+        key = self.cache.get_key(self.ds_path, params, "c1")
+        self.assertEqual(key, self.cache.get_key(
+            self.ds_path, {"xp.n": "4", "ds.config": 1}, "c1"))
+        self.assertNotEqual(key, self.cache.get_key(self.ds_path, params,
+                                                    "c2"))
+        self.cache.env_id = "name:env"
+        self.assertNotEqual(key, self.cache.get_key(self.ds_path, params,
+                                                    "c1"))
+
+    def test_put_get(self):
+        key = self.cache.get_key(self.ds_path, {"xp.n": "4"})
+        self.assertIsNone(self.cache.get(key))
+
+        self.cache.put(key, [self._write("out0", "m\n1\n"),
+                             self._write("out1", "m\n2\n")], [1.0, 2.0])
+        self.assertIsNone(self.cache.get(key, min_reps=3))
+        results = self.cache.get(key, min_reps=2)
+        self.assertEqual([t for (_, t) in results], [1.0, 2.0])
+        self.assertEqual([self._read(p) for (p, _) in results],
+                         ["m\n1\n", "m\n2\n"])
+
+        # Replaced atomically
+        self.cache.put(key, [self._write("out0", "m\n3\n")], [3.0])
+        results = self.cache.get(key)
+        self.assertEqual([self._read(p) for (p, _) in results], ["m\n3\n"])
+        self.assertEqual((self.cache.hits, self.cache.misses), (2, 2))
+
+        self.cache.bypass = True
+        self.assertIsNone(self.cache.get(key))
+
+    def test_prune(self):
+        self.cache.max_size = 100
+        keys = []
+        for i in range(3):
+            key = self.cache.get_key(self.ds_path, {"xp.n": str(i)})
+            self.cache.put(key, [self._write("out", "x" * 40)], [1.0])
+            keys.append(key)
+            # Modification times must differ for the least recently used
+            time.sleep(0.05)
+            if i == 1:
+                for (path, _) in self.cache.get(keys[0]):
+                    os.remove(path)
+
+        self.assertIsNone(self.cache.get(keys[1]))
+        for key in [keys[0], keys[2]]:
+            results = self.cache.get(key)
+            self.assertEqual([self._read(p) for (p, _) in results], ["x" * 40])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,83 @@
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+
+from div_p2p.results import ResultsStore
+
+
+class ResultsStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp_dir, "results.db")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def _create_old_store(self):
+        # Schema of the stores created before repetitions were kept
+        conn = sqlite3.connect(self.path)
+        conn.execute("CREATE TABLE datasets (ds_id INTEGER PRIMARY KEY, "
+                     "ds_class TEXT, properties TEXT)")
+        conn.execute("CREATE TABLE xps (comb_id INTEGER, cluster TEXT)")
+        conn.execute("CREATE TABLE metrics (comb_id INTEGER, metric TEXT, "
+                     "value)")
+        conn.execute("CREATE TABLE outputs (comb_id INTEGER, content BLOB)")
+        conn.execute("INSERT INTO xps VALUES (1, 'c1')")
+        conn.execute("INSERT INTO metrics VALUES (1, 'm', 1.5)")
+        conn.commit()
+        conn.close()
+
+    def test_old_schema(self):
+        self._create_old_store()
+
+        store = ResultsStore(self.path, ["xp.n"])
+        store.add_xp(2, "c1", {"xp.n": 4}, 2, 10.0)
+        store.add_rep(2, 0, {"m": 2.5}, "m\n2.5\n")
+        store.add_rep(2, 1, {"m": 3.5}, "m\n3.5\n")
+        store.set_summary(2, {"m": {"n": 2, "mean": 3.0, "variance": 0.5,
+                                    "min": 2.5, "max": 3.5, "median": 3.0}})
+        store.close()
+
+        self.assertEqual(store.get_metrics(),
+                         {1: {0: {"m": 1.5}},
+                          2: {0: {"m": 2.5}, 1: {"m": 3.5}}})
+        self.assertEqual(store.get_output(2), ["m\n2.5\n", "m\n3.5\n"])
+        self.assertEqual(store.get_summaries([2]), {2: {"m": 3.0}})
+        (columns, rows) = store.get_xps({"xp.n": 4})
+        self.assertEqual(dict(zip(columns, rows[0])),
+                         {"comb_id": 2, "cluster": "c1", "n_reps": 2,
+                          "run_time": 10.0, "xp.n": 4})
+
+    def test_failing_write(self):
+        store = ResultsStore(self.path, ["xp.n"], commit_period=0.1)
+        store.add_xp(1, "c1", {"xp.n": 1})
+        # A value which cannot be bound makes its insert fail
+        store.add_xp(2, "c1", {"xp.n": {}})
+        store.add_xp(3, "c1", {"xp.n": 3})
+        store.flush()
+
+        self.assertRaises(Exception, store.add_xp, 4, "c1", {"xp.n": 4})
+        store.add_xp(5, "c1", {"xp.n": 5})
+        store.close()
+
+        self.assertIsNone(store.writer)
+        (columns, rows) = store.get_xps()
+        idx = columns.index("comb_id")
+        self.assertEqual(sorted(row[idx] for row in rows), [1, 3, 5])
+
+    def test_failing_write_on_close(self):
+        store = ResultsStore(self.path, ["xp.n"])
+        store.add_xp(1, "c1", {"xp.n": 1})
+        store.add_xp(2, "c1", {"xp.n": {}})
+        store.close()
+
+        self.assertIsNone(store.writer)
+        (columns, rows) = store.get_xps()
+        self.assertEqual([row[columns.index("comb_id")] for row in rows], [1])
+
+
+if __name__ == "__main__":
+    unittest.main()
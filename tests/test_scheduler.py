@@ -0,0 +1,123 @@
+import unittest
+
+from execo.host import Host
+from execo_engine.sweep import HashableDict
+
+from div_p2p.scheduler import DatasetScheduler
+from div_p2p.sweeper import CombinationSweeper
+
+
+class FakeCombinationManager(object):
+
+    def __init__(self, combs):
+        self.sweeper = CombinationSweeper(
+            lambda c: tuple(sorted(c.items())), generator=lambda: iter(combs))
+
+    def get_ds_key(self, comb):
+        return comb["ds"]
+
+    def get_expected_cost(self, comb):
+        return comb["cost"]
+
+
+class FakeRunner(object):
+
+    def __init__(self):
+        self.aborted = []
+
+    def abort(self, comb):
+        self.aborted.append(comb)
+
+
+def make_combs(groups):
+    return [HashableDict(ds=ds, n=n, cost=cost)
+            for (ds, costs) in groups for (n, cost) in enumerate(costs)]
+
+
+class DatasetSchedulerTest(unittest.TestCase):
+
+    def _scheduler(self, groups, hosts, **kwargs):
+        manager = FakeCombinationManager(make_combs(groups))
+        scheduler = DatasetScheduler(manager, **kwargs)
+        scheduler.build([Host(h) for h in hosts])
+        return scheduler
+
+    def _run(self, scheduler, host_key, comb, runner=None):
+        self.assertTrue(scheduler.finish(comb, runner))
+        scheduler.done(comb)
+
+    def test_assignment(self):
+        scheduler = self._scheduler([("a", [5, 1]), ("b", [4]), ("c", [3])],
+                                    ["h1", "h2"])
+        self.assertEqual(scheduler.host_groups, {"h1": ["a"],
+                                                 "h2": ["b", "c"]})
+        self.assertEqual(scheduler.get_num_remaining(), 4)
+        self.assertEqual(scheduler.get_remaining_cost(), 13)
+        self.assertEqual(scheduler.get_makespan(), (7, None))
+
+        # Longest first, within the group in use
+        comb = scheduler.get_next("h1")
+        self.assertEqual((comb["ds"], comb["cost"]), ("a", 5))
+        self.assertEqual(scheduler.get_next("h1", "a")["cost"], 1)
+        self.assertEqual(scheduler.get_next("h2")["ds"], "b")
+        self.assertEqual(scheduler.peek_next_group("h2", "b")["ds"], "c")
+
+    def test_stealing(self):
+        scheduler = self._scheduler([("a", [1]), ("b", [4, 3]), ("c", [2])],
+                                    ["h1", "h2"])
+        self.assertEqual(scheduler.host_groups["h1"], ["b"])
+        b = scheduler.get_next("h1")
+        a = scheduler.get_next("h2")
+        self.assertEqual((b["ds"], a["ds"]), ("b", "c"))
+        self._run(scheduler, "h2", a)
+
+        # h2 first takes its own group a, then the rest of b, being run
+        self.assertEqual(scheduler.get_next("h2", "c")["ds"], "a")
+        self.assertEqual(scheduler.get_next("h2", "a")["ds"], "b")
+        self.assertIsNone(scheduler.get_next("h2", "b"))
+
+    def test_release_host(self):
+        scheduler = self._scheduler([("a", [1]), ("b", [2])], ["h1", "h2"])
+        scheduler.release_host("h1")
+        self.assertEqual(scheduler.get_next("h2", "b")["ds"], "b")
+        self.assertEqual(scheduler.get_next("h2", "b")["ds"], "a")
+
+    def test_cancel(self):
+        scheduler = self._scheduler([("a", [2, 1])], ["h1"])
+        runner = FakeRunner()
+        comb = scheduler.get_next("h1", runner=runner)
+        self.assertEqual(scheduler.comb_manager.sweeper.get_num_inprogress(), 1)
+
+        scheduler.cancel(comb, runner)
+        scheduler.cancel(comb, runner)
+        self.assertEqual(scheduler.get_num_remaining(), 2)
+        self.assertEqual(scheduler.comb_manager.sweeper.get_num_remaining(),
+                         2)
+        self.assertEqual(scheduler.get_next("h1"), comb)
+
+    def test_speculation(self):
+        scheduler = self._scheduler([("a", [1] * 6)], ["h1", "h2"],
+                                    speculation=True, spec_min_samples=5)
+        runners = [FakeRunner() for _ in range(3)]
+        for _ in range(5):
+            self._run(scheduler, "h1", scheduler.get_next("h1", "a"))
+        straggler = scheduler.get_next("h1", "a", runners[0])
+        self.assertFalse(scheduler.is_finished())
+
+        # Running for longer than the observed runtimes
+        self.assertIsNone(scheduler.get_next("h1", "a", runners[2]))
+        runs = scheduler.running[straggler]
+        runs[runners[0]] = (runs[runners[0]][0], 0, False)
+        copy = scheduler.get_next("h2", None, runners[1])
+        self.assertEqual(copy, straggler)
+
+        # The copy wins and the original is aborted
+        self._run(scheduler, "h2", copy, runners[1])
+        self.assertEqual(runners[0].aborted, [straggler])
+        self.assertFalse(scheduler.finish(straggler, runners[0]))
+        self.assertEqual(scheduler.speculative_wins, 1)
+        self.assertTrue(scheduler.is_finished())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,55 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from collections import OrderedDict
+
+from div_p2p.engine import StatsManager
+
+
+class StatsManagerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.cwd = os.getcwd()
+        os.chdir(self.tmp_dir)
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.tmp_dir)
+
+    def _write(self, name, content):
+        out_file = open(name, "w")
+        out_file.write(content)
+        out_file.close()
+
+    def test_csv_resume(self):
+        self._write("summary.csv",
+                    "comb_id, cluster, n_reps, ds.config, xp.n, run_time\n"
+                    "5, c1, 1, 0, x, 3.0\n"
+                    "6, c1, 2, 1, y, 10.0\n"
+                    "7, c1, 1, 1, x, \n")
+        self._write("5", "m, n\n1, 2\n9, 10\n")
+        self._write("6", "m\n7.5\n")
+        self._write("7", "m\n1.5\n")
+
+        manager = StatsManager(None)
+        manager.format = "csv"
+        manager.stats_path = self.tmp_dir
+        manager.initialize(OrderedDict([("ds.config", [0, 1])]),
+                           {"xp.n": ["x", "y"]})
+
+        self.assertEqual(manager.get_done_comb_ids(), set([5, 6, 7]))
+        results = manager.get_results("m")
+        self.assertEqual(sorted((c["ds.config"], c["xp.n"], m)
+                                for (c, m) in results.items()),
+                         [(0, "x", 9), (1, "x", 1.5), (1, "y", 7.5)])
+        self.assertEqual(sorted((c["xp.n"], t)
+                                for (c, t) in manager.get_run_times()),
+                         [("x", 3.0), ("y", 5.0)])
+        manager.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
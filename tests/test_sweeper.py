@@ -0,0 +1,80 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from div_p2p.params import iter_combinations, parse_values
+from div_p2p.sweeper import CombinationSweeper
+
+
+def comb_id(comb):
+    return tuple(sorted(comb.items()))
+
+
+class CombinationSweeperTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def _sweeper(self, string, path=None):
+        params = {"xp.a": parse_values(string), "xp.b": ["x", "y"]}
+        return CombinationSweeper(
+            comb_id, generator=lambda: iter_combinations(params), path=path)
+
+    def test_counters(self):
+        sweeper = self._sweeper("1, 2")
+        self.assertEqual(sweeper.get_num_total(), 4)
+        self.assertEqual(sweeper.get_num_remaining(), 4)
+
+        combs = list(sweeper.iter_remaining())
+        self.assertTrue(sweeper.claim(combs[0]))
+        self.assertFalse(sweeper.claim(combs[0]))
+        self.assertEqual(sweeper.get_num_inprogress(), 1)
+        self.assertEqual(len(list(sweeper.iter_remaining())), 3)
+
+        sweeper.cancel(combs[0])
+        self.assertEqual(sweeper.get_num_remaining(), 4)
+
+        sweeper.claim(combs[1])
+        sweeper.done(combs[1])
+        sweeper.done(combs[1])
+        self.assertEqual(sweeper.get_num_done(), 1)
+        self.assertEqual(sweeper.get_num_remaining(), 3)
+        self.assertFalse(sweeper.claim(combs[1]))
+
+    def test_duplicate_values(self):
+        # The same value given twice must not be counted twice
+        sweeper = self._sweeper("1, range(1,3)")
+        self.assertEqual(sweeper.get_num_total(), 6)
+        for comb in list(sweeper.iter_remaining()):
+            sweeper.claim(comb)
+            sweeper.done(comb)
+        self.assertEqual(sweeper.get_num_remaining(), 0)
+
+    def test_set_done_ids(self):
+        sweeper = self._sweeper("1, 2")
+        sweeper.claim({"xp.a": "1", "xp.b": "x"})
+        sweeper.set_done_ids([comb_id({"xp.a": "2", "xp.b": "y"})])
+        self.assertEqual(sweeper.get_num_done(), 1)
+        self.assertEqual(sweeper.get_num_inprogress(), 0)
+        self.assertEqual(sweeper.get_num_remaining(), 3)
+
+    def test_added_combinations(self):
+        path = os.path.join(self.tmp_dir, "explored")
+        sweeper = CombinationSweeper(comb_id, path=path)
+        combs = [{"xp.a": "1"}, {"xp.a": "2"}]
+        self.assertEqual(sweeper.add_combinations(combs), 2)
+        self.assertEqual(sweeper.add_combinations(combs), 0)
+        sweeper.done(combs[0])
+
+        resumed = CombinationSweeper(comb_id, path=path)
+        self.assertEqual(resumed.get_num_total(), 2)
+        resumed.set_done_ids([comb_id(combs[0])])
+        self.assertEqual(list(resumed.iter_remaining()), [combs[1]])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,62 @@
+import os
+import unittest
+
+from execo.host import Host
+
+from div_p2p.wrapper import DivP2PWrapper, HostConfs
+
+
+class FakeWrapper(DivP2PWrapper):
+    """Wrapper recording the transfers instead of running them."""
+
+    def __init__(self, host_confs, remote_dir):
+        DivP2PWrapper.__init__(self, Host("node-1"), remote_dir,
+                               host_confs=host_confs)
+        self.puts = []
+
+    def _put(self, local_path, remote_path):
+        if os.path.isdir(local_path):
+            self.puts.append(sorted(os.listdir(local_path)))
+        else:
+            self.puts.append([remote_path])
+        return True
+
+
+class HostConfsTest(unittest.TestCase):
+
+    def test_upload_once_per_host(self):
+        host_confs = HostConfs("/tmp/confs")
+        slots = [FakeWrapper(host_confs, "/tmp/slot-" + str(i))
+                 for i in range(2)]
+        group = [{"xp.n": str(n)} for n in range(3)]
+
+        slots[0].upload_confs(group)
+        slots[1].upload_confs(group)
+        self.assertEqual(len(slots[0].puts[0]), 3)
+        self.assertEqual(slots[1].puts, [])
+
+        slots[1].upload_confs(group + [{"xp.n": "3"}])
+        self.assertEqual(len(slots[1].puts[0]), 1)
+
+        slots[1].change_conf({"xp.n": "1"})
+        self.assertTrue(slots[1].conf_path.startswith("/tmp/confs/"))
+        self.assertEqual(len(slots[1].puts), 1)
+
+        # Not uploaded in bundle, copied alone
+        slots[0].change_conf({"xp.n": "4"})
+        self.assertEqual(slots[0].conf_path,
+                         "/tmp/slot-0/properties.dat")
+
+    def test_release(self):
+        host_confs = HostConfs("/tmp/confs")
+        host_confs.acquire()
+        host_confs.acquire()
+        host_confs.paths = {"a": "/tmp/confs/d1/a", "b": "/tmp/confs/d2/b"}
+        self.assertEqual(host_confs.release(), [])
+        self.assertEqual(host_confs.release(),
+                         ["/tmp/confs/d1", "/tmp/confs/d2"])
+        self.assertEqual(host_confs.paths, {})
+
+
+if __name__ == "__main__":
+    unittest.main()